@@ -3,12 +3,11 @@ Admin Panel - Role-based permissions with comment restrictions
 """
 from flask import Blueprint, render_template, request, jsonify, session, redirect, url_for, current_app
 from functools import wraps
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import os
 import sqlite3
 import re
 import json
-from collections import defaultdict
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -31,9 +30,13 @@ ROLE_PERMISSIONS = {
               'change_roles', 'view_settings', 'edit_settings', 'full_access']
 }
 
-def get_db():
+def get_db(readonly=False):
     from app import get_db as app_get_db
-    return app_get_db()
+    return app_get_db(readonly)
+
+def invalidate_moderation_cache(user_id):
+    from app import invalidate_moderation_cache as app_invalidate
+    app_invalidate(user_id)
 
 def get_admin_session():
     if 'admin_role' not in session:
@@ -72,314 +75,21 @@ def require_permission(permission):
 def can_modify_role(admin_role, target_role):
     return ROLE_HIERARCHY.get(admin_role, 0) > ROLE_HIERARCHY.get(target_role, 0)
 
-def _iso_now():
-    return datetime.now().isoformat()
-
-def _parse_dt(value):
-    if value is None:
-        return None
-    text = str(value).strip()
-    if not text:
-        return None
-    # Normalize common SQLite/Postgres timestamp forms.
-    text = text.replace("Z", "+00:00")
-    for candidate in (text, text.replace(" ", "T")):
-        try:
-            return datetime.fromisoformat(candidate)
-        except Exception:
-            continue
-    # Last-resort trim fractional offset artifacts.
-    try:
-        return datetime.fromisoformat(text[:19])
-    except Exception:
-        return None
+def _utc_now():
+    # Naive UTC, like app.utc_now(): stored timestamps and cutoffs never use host-local time.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
 
-def _ensure_admin_feature_tables(conn, c, db_type):
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TIMESTAMP,
-                last_path TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_notifications (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                title TEXT,
-                message TEXT,
-                notif_type TEXT DEFAULT 'announcement',
-                source TEXT DEFAULT 'admin',
-                is_read INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sent_at TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS admin_announcements (
-                id SERIAL PRIMARY KEY,
-                title TEXT,
-                message TEXT,
-                is_global INTEGER DEFAULT 1,
-                target_user_id INTEGER,
-                scheduled_for TIMESTAMP,
-                status TEXT DEFAULT 'scheduled',
-                created_by TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                sent_at TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS admin_chat_messages (
-                id SERIAL PRIMARY KEY,
-                admin_role TEXT,
-                message TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS donation_events (
-                id SERIAL PRIMARY KEY,
-                amount_cents INTEGER,
-                currency TEXT DEFAULT 'usd',
-                status TEXT DEFAULT 'paid',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TEXT,
-                last_path TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_notifications (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                title TEXT,
-                message TEXT,
-                notif_type TEXT DEFAULT 'announcement',
-                source TEXT DEFAULT 'admin',
-                is_read INTEGER DEFAULT 0,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                sent_at TEXT
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS admin_announcements (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                title TEXT,
-                message TEXT,
-                is_global INTEGER DEFAULT 1,
-                target_user_id INTEGER,
-                scheduled_for TEXT,
-                status TEXT DEFAULT 'scheduled',
-                created_by TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                sent_at TEXT
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS admin_chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_role TEXT,
-                message TEXT,
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS donation_events (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                amount_cents INTEGER,
-                currency TEXT DEFAULT 'usd',
-                status TEXT DEFAULT 'paid',
-                created_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    conn.commit()
-
-def _ensure_daily_actions_schema(c, db_type):
-    cols = _get_table_columns(c, db_type, 'daily_actions')
-    if cols:
-        if db_type == 'postgres':
-            if 'user_id' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS user_id INTEGER")
-            if 'action' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS action TEXT")
-            if 'verse_id' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS verse_id INTEGER")
-            if 'event_date' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS event_date TEXT")
-            if 'timestamp' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS timestamp TEXT")
-        else:
-            if 'user_id' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN user_id INTEGER")
-            if 'action' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN action TEXT")
-            if 'verse_id' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN verse_id INTEGER")
-            if 'event_date' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN event_date TEXT")
-            if 'timestamp' not in cols:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN timestamp TEXT")
-        return
-
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS daily_actions (
-                id SERIAL PRIMARY KEY,
-                user_id INTEGER,
-                action TEXT,
-                verse_id INTEGER,
-                event_date TEXT,
-                timestamp TEXT,
-                UNIQUE(user_id, action, verse_id, event_date)
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS daily_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                action TEXT,
-                verse_id INTEGER,
-                event_date TEXT,
-                timestamp TEXT,
-                UNIQUE(user_id, action, verse_id, event_date)
-            )
-        """)
+def _iso_now():
+    return _utc_now().isoformat()
 
 def _get_table_columns(c, db_type, table_name):
     """Return lowercase column names for a table."""
-    cols = set()
+    from app import _table_columns
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT column_name
-                FROM information_schema.columns
-                WHERE table_schema = 'public' AND table_name = %s
-            """, (table_name,))
-            rows = c.fetchall()
-            for row in rows:
-                if hasattr(row, 'keys'):
-                    try:
-                        cols.add(str(row['column_name']).lower())
-                    except Exception:
-                        try:
-                            row = _row_to_dict(row)
-                            cols.add(str(row.get('column_name', '')).lower())
-                        except Exception:
-                            pass
-                else:
-                    cols.add(str(row[0]).lower())
-        else:
-            c.execute(f"PRAGMA table_info({table_name})")
-            rows = c.fetchall()
-            for row in rows:
-                cols.add(str(row[1]).lower())
+        return {str(col).lower() for col in _table_columns(c, db_type, table_name)}
     except Exception as e:
         print(f"[WARN] Could not read columns for {table_name}: {e}")
-    return cols
-
-def _row_to_dict(row):
-    if row is None:
-        return None
-    if isinstance(row, dict):
-        return row
-    if hasattr(row, 'keys'):
-        try:
-            return {k: row[k] for k in row.keys()}
-        except Exception:
-            return row
-    return row
-
-def _row_first_value(row, default=0):
-    if row is None:
-        return default
-    if isinstance(row, dict):
-        return next(iter(row.values()), default)
-    if hasattr(row, 'keys'):
-        try:
-            return row[0]
-        except Exception:
-            try:
-                keys = row.keys()
-                return row[keys[0]] if keys else default
-            except Exception:
-                return default
-    try:
-        return row[0]
-    except Exception:
-        return default
-
-def _ensure_audit_logs_schema(conn, c, db_type):
-    """Create/migrate audit_logs so queries work across older DB schemas."""
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS audit_logs (
-                id SERIAL PRIMARY KEY,
-                admin_id TEXT,
-                action TEXT,
-                target_user_id INTEGER,
-                details TEXT,
-                ip_address TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS audit_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id TEXT,
-                action TEXT,
-                target_user_id INTEGER,
-                details TEXT,
-                ip_address TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-    conn.commit()
-
-    cols = _get_table_columns(c, db_type, 'audit_logs')
-    required = {
-        'admin_id': 'TEXT',
-        'action': 'TEXT',
-        'target_user_id': 'INTEGER',
-        'details': 'TEXT',
-        'ip_address': 'TEXT',
-        'timestamp': 'TIMESTAMP' if db_type == 'postgres' else 'TEXT'
-    }
-
-    for col, col_type in required.items():
-        if col in cols:
-            continue
-        try:
-            if db_type == 'postgres':
-                c.execute(f"ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS {col} {col_type}")
-            else:
-                c.execute(f"ALTER TABLE audit_logs ADD COLUMN {col} {col_type}")
-            conn.commit()
-            cols.add(col)
-        except Exception as e:
-            if db_type == 'postgres':
-                conn.rollback()
-            print(f"[WARN] Could not add audit_logs.{col}: {e}")
-
-    # Backfill timestamp from created_at for legacy tables when available.
-    if 'timestamp' in cols and 'created_at' in cols:
-        try:
-            c.execute("UPDATE audit_logs SET timestamp = created_at WHERE timestamp IS NULL AND created_at IS NOT NULL")
-            conn.commit()
-        except Exception as e:
-            if db_type == 'postgres':
-                conn.rollback()
-            print(f"[WARN] Could not backfill audit_logs.timestamp: {e}")
+        return set()
 
 def _extract_target_user_id(details):
     if not details:
@@ -511,33 +221,22 @@ def _fetch_user_personas(c, db_type, user_ids):
     if not ordered_ids:
         return {}
 
-    placeholders = ','.join(['%s'] * len(ordered_ids)) if db_type == 'postgres' else ','.join(['?'] * len(ordered_ids))
-    query = f"SELECT id, name, email, role FROM users WHERE id IN ({placeholders})"
+    from app import db_query, sql_in
     try:
-        c.execute(query, tuple(ordered_ids))
-        rows = c.fetchall()
+        rows = db_query(c, db_type, f"SELECT id, name, email, role FROM users WHERE id IN ({sql_in(ordered_ids)})",
+                        ordered_ids)
     except Exception as e:
         print(f"[WARN] Could not load user personas: {e}")
         return {}
 
-    personas = {}
-    for row in rows:
-        if hasattr(row, 'keys'):
-            row = _row_to_dict(row)
-            uid = row.get('id')
-            personas[uid] = {
-                "name": row.get('name') or "Unknown",
-                "email": row.get('email') or "",
-                "role": row.get('role') or "user"
-            }
-        else:
-            uid = row[0]
-            personas[uid] = {
-                "name": row[1] or "Unknown",
-                "email": row[2] or "",
-                "role": row[3] or "user"
-            }
-    return personas
+    return {
+        row['id']: {
+            "name": row['name'] or "Unknown",
+            "email": row['email'] or "",
+            "role": row['role'] or "user"
+        }
+        for row in rows
+    }
 
 def _safe_json_dumps(value):
     try:
@@ -557,8 +256,23 @@ def _request_location_snapshot():
         "timezone": request.headers.get('CF-Timezone') or ""
     }
 
+_AUDIT_LOG_COLUMNS = None
+
+def _audit_log_columns(c, db_type):
+    """audit_logs columns only change at startup, so introspect them once per process."""
+    global _AUDIT_LOG_COLUMNS
+    if not _AUDIT_LOG_COLUMNS:
+        _AUDIT_LOG_COLUMNS = _get_table_columns(c, db_type, 'audit_logs')
+    return _AUDIT_LOG_COLUMNS
+
+_AUDIT_LOG_FIELDS = (
+    'id', 'admin_id', 'admin_name', 'action', 'details', 'ip_address', 'timestamp', 'created_at', 'status',
+    'location', 'target_user_id', 'target_name', 'target_email', 'target_role', 'target_persona', 'target',
+    'reason', 'duration', 'extras'
+)
+
 def _read_audit_logs(c, db_type, limit=100, offset=0, action=None):
-    cols = _get_table_columns(c, db_type, 'audit_logs')
+    cols = _audit_log_columns(c, db_type)
     if not cols:
         return [], 0
 
@@ -567,21 +281,20 @@ def _read_audit_logs(c, db_type, limit=100, offset=0, action=None):
     ts_expr = ts_col if ts_col else 'NULL'
     ip_expr = 'ip_address' if 'ip_address' in cols else 'NULL'
     target_expr = 'target_user_id' if 'target_user_id' in cols else 'NULL'
+    status_expr, target_name_expr, target_role_expr = (
+        col if col in cols else 'NULL' for col in ('status', 'target_name', 'target_role'))
+
+    from app import db_query, db_scalar, record_type
 
     where_sql = ""
     params = []
     if action and action.lower() != 'all':
-        where_sql = "WHERE action = %s" if db_type == 'postgres' else "WHERE action = ?"
+        where_sql = "WHERE action = ?"
         params.append(action)
 
-    count_query = f"SELECT COUNT(*) FROM audit_logs {where_sql}"
-    c.execute(count_query, tuple(params))
-    total_row = c.fetchone()
-    total = int(_row_first_value(total_row, 0) or 0)
+    total = int(db_scalar(c, db_type, f"SELECT COUNT(*) FROM audit_logs {where_sql}", params, 0))
 
-    limit_ph = "%s" if db_type == 'postgres' else "?"
-    offset_ph = "%s" if db_type == 'postgres' else "?"
-    query = f"""
+    rows = db_query(c, db_type, f"""
         SELECT
             id,
             admin_id,
@@ -589,117 +302,110 @@ def _read_audit_logs(c, db_type, limit=100, offset=0, action=None):
             details,
             {ip_expr} AS ip_address,
             {ts_expr} AS event_time,
-            {target_expr} AS target_user_id
+            {target_expr} AS target_user_id,
+            {status_expr} AS status,
+            {target_name_expr} AS target_name,
+            {target_role_expr} AS target_role
         FROM audit_logs
         {where_sql}
         ORDER BY {order_col} DESC, id DESC
-        LIMIT {limit_ph} OFFSET {offset_ph}
-    """
-    c.execute(query, tuple(params + [limit, offset]))
-    rows = c.fetchall()
+        LIMIT ? OFFSET ?
+    """, params + [limit, offset])
 
     base_logs = []
     target_user_ids = set()
     admin_user_ids = set()
     for row in rows:
-        row = _row_to_dict(row)
-        if hasattr(row, 'keys'):
-            log = {
-                "id": row.get('id'),
-                "admin_id": row.get('admin_id') or "system",
-                "action": row.get('action') or "UNKNOWN",
-                "details": row.get('details') or "",
-                "ip_address": row.get('ip_address') or "",
-                "timestamp": row.get('event_time'),
-                "target_user_id": row.get('target_user_id')
-            }
-        else:
-            log = {
-                "id": row[0],
-                "admin_id": row[1] or "system",
-                "action": row[2] or "UNKNOWN",
-                "details": row[3] or "",
-                "ip_address": row[4] or "",
-                "timestamp": row[5],
-                "target_user_id": row[6]
-            }
-
-        if log["target_user_id"] is None:
-            log["target_user_id"] = _extract_target_user_id(log["details"])
-        if log["target_user_id"] is not None:
-            target_user_ids.add(log["target_user_id"])
+        target_user_id = row.target_user_id
+        if target_user_id is None:
+            target_user_id = _extract_target_user_id(row.details or "")
+        if target_user_id is not None:
+            target_user_ids.add(target_user_id)
+        admin_id = row.admin_id or "system"
         try:
-            admin_uid = int(str(log["admin_id"]).strip())
+            admin_uid = int(str(admin_id).strip())
             admin_user_ids.add(admin_uid)
         except Exception:
-            pass
-        base_logs.append(log)
+            admin_uid = None
+        base_logs.append((row, admin_id, admin_uid, target_user_id))
 
     personas = _fetch_user_personas(c, db_type, target_user_ids)
     admin_personas = _fetch_user_personas(c, db_type, admin_user_ids)
+    AuditLogRecord = record_type('AuditLogRecord', _AUDIT_LOG_FIELDS)
     logs = []
-    for log in base_logs:
-        persona = personas.get(log["target_user_id"])
-        parsed_details = _parse_details_fields(log["details"])
+    for row, admin_id, admin_uid, target_user_id in base_logs:
+        raw_details = row.details or ""
+        action_name = row.action or "UNKNOWN"
+        ip_address = row.ip_address or ""
+        persona = personas.get(target_user_id)
+        parsed_details = _parse_details_fields(raw_details)
         location = parsed_details.get("location") if isinstance(parsed_details.get("location"), dict) else {}
         extras = parsed_details.get("extras") if isinstance(parsed_details.get("extras"), dict) else {}
         target_obj = parsed_details.get("target") if isinstance(parsed_details.get("target"), dict) else {}
-        try:
-            admin_uid = int(str(log["admin_id"]).strip())
-        except Exception:
-            admin_uid = None
         admin_persona = admin_personas.get(admin_uid) if admin_uid is not None else None
-        target_name = persona["name"] if persona else (parsed_details.get("target_name_hint") or "")
-        details_message = parsed_details.get("message") or (log["details"] if log["details"] is not None else "")
-        status = parsed_details.get("status") or ("success" if (log["action"] or "").upper() not in ("ERROR", "FAILED") else "failed")
-        reason = parsed_details.get("reason") or (extras.get("reason") if isinstance(extras, dict) else "") or ""
-        duration = parsed_details.get("duration") or (extras.get("duration") if isinstance(extras, dict) else "") or ""
-        logs.append({
-            "id": log["id"],
-            "admin_id": log["admin_id"],
-            "admin_name": (admin_persona["name"] if admin_persona else log["admin_id"]),
-            "action": log["action"],
-            "details": details_message,
-            "ip_address": log["ip_address"],
-            "timestamp": log["timestamp"],
-            "created_at": log["timestamp"],  # compatibility for existing audit UI
-            "status": status,
-            "location": {
-                "ip": location.get("ip") or log["ip_address"] or "",
+        target_name = persona["name"] if persona else (row.target_name or parsed_details.get("target_name_hint") or "")
+        target_email = persona["email"] if persona else target_obj.get("email", "")
+        target_role = persona["role"] if persona else (row.target_role or target_obj.get("role", ""))
+        details_message = parsed_details.get("message") or raw_details
+        status = (row.status or parsed_details.get("status")
+                  or ("success" if action_name.upper() not in ("ERROR", "FAILED") else "failed"))
+        reason = parsed_details.get("reason") or extras.get("reason") or ""
+        duration = parsed_details.get("duration") or extras.get("duration") or ""
+        logs.append(AuditLogRecord(
+            id=row.id,
+            admin_id=admin_id,
+            admin_name=(admin_persona["name"] if admin_persona else admin_id),
+            action=action_name,
+            details=details_message,
+            ip_address=ip_address,
+            timestamp=row.event_time,
+            created_at=row.event_time,  # compatibility for existing audit UI
+            status=status,
+            location={
+                "ip": location.get("ip") or ip_address or "",
                 "country": location.get("country") or "",
                 "region": location.get("region") or "",
                 "city": location.get("city") or "",
                 "timezone": location.get("timezone") or ""
             },
-            "target_user_id": log["target_user_id"],
-            "target_name": target_name,
-            "target_email": persona["email"] if persona else (target_obj.get("email", "") if isinstance(target_obj, dict) else ""),
-            "target_role": persona["role"] if persona else (target_obj.get("role", "") if isinstance(target_obj, dict) else ""),
-            "target_persona": persona if persona else None,
-            "target": {
-                "user_id": log["target_user_id"],
+            target_user_id=target_user_id,
+            target_name=target_name,
+            target_email=target_email,
+            target_role=target_role,
+            target_persona=persona if persona else None,
+            target={
+                "user_id": target_user_id,
                 "name": target_name,
-                "email": persona["email"] if persona else (target_obj.get("email", "") if isinstance(target_obj, dict) else ""),
-                "role": persona["role"] if persona else (target_obj.get("role", "") if isinstance(target_obj, dict) else "")
+                "email": target_email,
+                "role": target_role
             },
-            "reason": reason,
-            "duration": duration,
-            "extras": extras
-        })
+            reason=reason,
+            duration=duration,
+            extras=extras
+        ))
 
     return logs, total
 
+# Written through before the response returns (see log_action); everything else
+# is batched by the audit sink in the background.
+AUDIT_SYNC_ACTIONS = {
+    'ADMIN_LOGIN', 'BAN', 'UNBAN', 'RESTRICT_COMMENTS', 'UNRESTRICT', 'UPDATE_ROLE', 'UPDATE_SETTINGS'
+}
+
 def log_action(action, details="", target_user_id=None, status="success", extras=None, target=None):
+    """Queue an audit record; False if it could not be recorded.
+
+    AUDIT_SYNC_ACTIONS wait for the write, so False there also covers a record
+    that timed out or was spilled/dropped by the audit sink.
+    """
+    from app import AUDIT_FLUSH_TIMEOUT, audit_events
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_audit_logs_schema(conn, c, db_type)
         admin = get_admin_session()
         admin_id = admin['role'] if admin else 'unknown'
-        timestamp = datetime.now().isoformat()
+        status = str(status or "success").lower()
         payload = {
             "message": str(details or ""),
-            "status": str(status or "success").lower(),
+            "status": status,
             "location": _request_location_snapshot(),
             "extras": extras if isinstance(extras, dict) else {}
         }
@@ -707,22 +413,22 @@ def log_action(action, details="", target_user_id=None, status="success", extras
             payload["target"] = target
         elif target_user_id is not None:
             payload["target"] = {"user_id": target_user_id}
-        details_json = _safe_json_dumps(payload)
-        
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO audit_logs (admin_id, action, details, ip_address, timestamp, target_user_id)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (admin_id, action, details_json, payload.get("location", {}).get("ip") or request.remote_addr, timestamp, target_user_id))
-        else:
-            c.execute("""
-                INSERT INTO audit_logs (admin_id, action, details, ip_address, timestamp, target_user_id)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (admin_id, action, details_json, payload.get("location", {}).get("ip") or request.remote_addr, timestamp, target_user_id))
-        conn.commit()
-        conn.close()
+        target_info = payload.get("target") or {}
+        seq = audit_events.emit('audit', (
+            admin_id, action, target_user_id, _safe_json_dumps(payload),
+            payload["location"].get("ip") or request.remote_addr, _iso_now(),
+            status, target_info.get("name"), target_info.get("role")
+        ))
+        if seq is None:
+            print(f"[ERROR] Audit record for {action} could not be queued")
+            return False
+        if action in AUDIT_SYNC_ACTIONS and not audit_events.flush(seq, AUDIT_FLUSH_TIMEOUT):
+            print(f"[ERROR] Audit record for {action} was not written within {AUDIT_FLUSH_TIMEOUT}s")
+            return False
+        return True
     except Exception as e:
         print(f"[ERROR] Log action failed: {e}")
+        return False
 
 @admin_bp.route('/login')
 def admin_login():
@@ -763,24 +469,21 @@ def verify_code():
             try:
                 user_id = session.get('user_id')
                 if user_id:
+                    from app import db_execute
                     conn, db_type = get_db()
-                    c = conn.cursor()
                     is_admin = 1 if role in ('owner', 'co_owner', 'mod', 'host') else 0
-                    if db_type == 'postgres':
-                        c.execute("UPDATE users SET role = %s, is_admin = %s WHERE id = %s", (role, is_admin, user_id))
-                    else:
-                        c.execute("UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (role, is_admin, user_id))
+                    db_execute(conn, db_type, "UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (role, is_admin, user_id))
                     conn.commit()
                     conn.close()
             except Exception as e:
                 print(f"[WARN] Could not sync admin role to user: {e}")
-            log_action(
+            audited = log_action(
                 "ADMIN_LOGIN",
                 f"Role: {role}",
                 status="success",
                 extras={"module": "admin_auth", "event": "verify_code"}
             )
-            return jsonify({"success": True, "role": role, "redirect": "/admin/dashboard"})
+            return jsonify({"success": True, "role": role, "redirect": "/admin/dashboard", "audit_logged": audited})
     
     return jsonify({"success": False, "error": "Invalid code"}), 401
 
@@ -798,108 +501,27 @@ def get_permissions():
 @admin_bp.route('/api/stats')
 @admin_required
 def get_stats():
+    from app import db_scalar
     conn = None
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
+        conn, db_type = get_db(readonly=True)
         
-        def get_count(query, params=None):
-            """Helper to get count from query, handling both db types"""
+        def get_count(query, params=()):
+            """Helper to get a COUNT(*) result, 0 if the query fails"""
             try:
-                if params:
-                    c.execute(query, params)
-                else:
-                    c.execute(query)
-                row = c.fetchone()
-                if row is None:
-                    return 0
-                # Handle dict-like, sqlite3.Row, and tuple-like rows
-                if isinstance(row, dict):
-                    return row.get('count', 0) or 0
-                if hasattr(row, 'keys'):
-                    try:
-                        return row['count'] or 0
-                    except Exception:
-                        try:
-                            return row[0] or 0
-                        except Exception:
-                            return 0
-                return row[0] or 0
+                return int(db_scalar(conn, db_type, query, params, 0))
             except Exception as e:
                 print(f"[DEBUG] Query failed: {query}, error: {e}")
                 return 0
         
-        # Ensure tables exist first
-        try:
-            if db_type == 'postgres':
-                c.execute("CREATE TABLE IF NOT EXISTS bans (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS verses (id SERIAL PRIMARY KEY, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user')")
-                c.execute("CREATE TABLE IF NOT EXISTS likes (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS saves (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS comments (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS community_messages (id SERIAL PRIMARY KEY, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id SERIAL PRIMARY KEY, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-            else:
-                c.execute("CREATE TABLE IF NOT EXISTS bans (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, banned_by TEXT, banned_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_restrictions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT, restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP)")
-                c.execute("CREATE TABLE IF NOT EXISTS verses (id INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT, text TEXT, translation TEXT, source TEXT, timestamp TEXT, book TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user')")
-                c.execute("CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS saves (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-                c.execute("CREATE TABLE IF NOT EXISTS comments (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS community_messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT)")
-                c.execute("CREATE TABLE IF NOT EXISTS comment_replies (id INTEGER PRIMARY KEY AUTOINCREMENT, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL, user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP, google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0)")
-                c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-            conn.commit()
-        except Exception as e:
-            print(f"[DEBUG] Table creation warning: {e}")
-            if db_type == 'postgres':
-                conn.rollback()
-
-        # Ensure soft-delete columns exist for comment counts
-        try:
-            if db_type == 'postgres':
-                c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-                c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            else:
-                try:
-                    c.execute("SELECT is_deleted FROM comments LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE comments ADD COLUMN is_deleted INTEGER DEFAULT 0")
-                try:
-                    c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            conn.commit()
-        except Exception as e:
-            print(f"[DEBUG] Soft delete column warning: {e}")
-        
         users = get_count("SELECT COUNT(*) as count FROM users")
-        now_iso = datetime.now().isoformat()
-        if db_type == 'postgres':
-            bans = get_count("SELECT COUNT(*) as count FROM bans WHERE expires_at IS NULL OR expires_at > %s", (now_iso,))
-            banned_users = get_count(
-                "SELECT COUNT(*) as count FROM users WHERE is_banned = TRUE AND (ban_expires_at IS NULL OR ban_expires_at > %s)",
-                (now_iso,)
-            )
-        else:
-            bans = get_count("SELECT COUNT(*) as count FROM bans WHERE expires_at IS NULL OR expires_at > ?", (now_iso,))
-            banned_users = get_count(
-                "SELECT COUNT(*) as count FROM users WHERE is_banned = 1 AND (ban_expires_at IS NULL OR ban_expires_at > ?)",
-                (now_iso,)
-            )
-        
-        restricted = 0
-        try:
-            if db_type == 'postgres':
-                restricted = get_count("SELECT COUNT(*) as count FROM comment_restrictions WHERE expires_at > NOW()")
-            else:
-                restricted = get_count("SELECT COUNT(*) as count FROM comment_restrictions WHERE expires_at > datetime('now')")
-        except Exception as e:
-            print(f"[DEBUG] Restricted count error: {e}")
+        now_iso = _utc_now().isoformat()
+        bans = get_count("SELECT COUNT(*) as count FROM bans WHERE expires_at IS NULL OR expires_at > ?", (now_iso,))
+        banned_users = get_count(
+            "SELECT COUNT(*) as count FROM users WHERE is_banned = ? AND (ban_expires_at IS NULL OR ban_expires_at > ?)",
+            (True, now_iso)
+        )
+        restricted = get_count("SELECT COUNT(*) as count FROM comment_restrictions WHERE expires_at > ?", (now_iso,))
         
         verses = get_count("SELECT COUNT(*) as count FROM verses")
         comments = get_count("SELECT COUNT(*) as count FROM comments WHERE COALESCE(is_deleted, 0) = 0")
@@ -939,9 +561,9 @@ def get_stats():
 @admin_bp.route('/api/users')
 @admin_required
 def get_users():
+    from app import db_query, iso_timestamp, sql_like
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
+        conn, db_type = get_db(readonly=True)
 
         search = (request.args.get('q') or '').strip()
         role = (request.args.get('role') or '').strip()
@@ -951,12 +573,9 @@ def get_users():
         params = []
 
         if search:
-            if db_type == 'postgres':
-                where.append("(COALESCE(name, '') ILIKE %s OR COALESCE(email, '') ILIKE %s)")
-            else:
-                where.append("(LOWER(COALESCE(name, '')) LIKE ? OR LOWER(COALESCE(email, '')) LIKE ?)")
-            token = f"%{search.lower()}%"
-            params.extend([token, token] if db_type != 'postgres' else [f"%{search}%", f"%{search}%"])
+            like = sql_like(db_type)
+            where.append(f"(COALESCE(name, '') {like} ? OR COALESCE(email, '') {like} ?)")
+            params.extend([f"%{search}%", f"%{search}%"])
 
         def normalize_role_value(value):
             r = (value or '').strip().lower()
@@ -967,21 +586,19 @@ def get_users():
             return r or 'user'
 
         if role:
-            if db_type == 'postgres':
-                where.append("LOWER(COALESCE(role, 'user')) = LOWER(%s)")
-            else:
-                where.append("LOWER(COALESCE(role, 'user')) = LOWER(?)")
+            where.append("LOWER(COALESCE(role, 'user')) = LOWER(?)")
             params.append(role)
 
         if status == 'banned':
-            where.append("is_banned = TRUE" if db_type == 'postgres' else "is_banned = 1")
+            where.append("is_banned = ?")
+            params.append(True)
         elif status == 'active':
-            where.append("(is_banned IS NULL OR is_banned = FALSE)" if db_type == 'postgres' else "(is_banned IS NULL OR is_banned = 0)")
+            where.append("(is_banned IS NULL OR is_banned = ?)")
+            params.append(False)
 
         where_sql = (" WHERE " + " AND ".join(where)) if where else ""
-        query = f"SELECT id, name, email, role, is_admin, is_banned, created_at FROM users{where_sql} ORDER BY id DESC"
-        c.execute(query, tuple(params))
-        rows = c.fetchall()
+        rows = db_query(conn, db_type, f"SELECT id, name, email, role, is_admin, is_banned, created_at FROM users{where_sql} ORDER BY id DESC",
+                        params)
         
         users = []
         for row in rows:
@@ -993,7 +610,7 @@ def get_users():
                 "role": role_val,
                 "is_admin": bool(row[4]),
                 "is_banned": bool(row[5]),
-                "created_at": row[6] or "Unknown"
+                "created_at": iso_timestamp(row[6]) or "Unknown"
             })
         conn.close()
         return jsonify(users)
@@ -1008,35 +625,11 @@ def get_users():
 @admin_bp.route('/api/bans')
 @admin_required
 def get_bans():
+    from app import db_query
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        
-        # Create table with appropriate syntax
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS bans (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    banned_by TEXT,
-                    banned_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS bans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    banned_by TEXT,
-                    banned_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
+        conn, db_type = get_db(readonly=True)
         
-        c.execute("""
+        rows = db_query(conn, db_type, """
             SELECT b.id, b.user_id, b.reason, b.banned_by, b.banned_at, b.expires_at,
                    u.name, u.email
             FROM bans b
@@ -1044,8 +637,6 @@ def get_bans():
             ORDER BY b.banned_at DESC
         """)
         
-        rows = c.fetchall()
-        
         bans = []
         for row in rows:
             bans.append({
@@ -1060,21 +651,12 @@ def get_bans():
             })
         # Include users marked as banned even if bans table is empty/out of sync
         try:
-            if db_type == 'postgres':
-                c.execute("""
-                    SELECT id, name, email, ban_reason, ban_expires_at
-                    FROM users
-                    WHERE is_banned = TRUE
-                    AND id NOT IN (SELECT user_id FROM bans)
-                """)
-            else:
-                c.execute("""
-                    SELECT id, name, email, ban_reason, ban_expires_at
-                    FROM users
-                    WHERE is_banned = 1
-                    AND id NOT IN (SELECT user_id FROM bans)
-                """)
-            extra_rows = c.fetchall()
+            extra_rows = db_query(conn, db_type, """
+                SELECT id, name, email, ban_reason, ban_expires_at
+                FROM users
+                WHERE is_banned = ?
+                AND id NOT IN (SELECT user_id FROM bans)
+            """, (True,))
             for row in extra_rows:
                 bans.append({
                     "id": None,
@@ -1100,55 +682,19 @@ def get_bans():
 @require_permission('restrict_comments')
 def get_restrictions():
     """Get all active comment restrictions"""
+    from app import db_query
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
+        conn, db_type = get_db(readonly=True)
         
-        # Ensure table exists with appropriate syntax
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comment_restrictions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    restricted_by TEXT,
-                    restricted_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comment_restrictions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    restricted_by TEXT,
-                    restricted_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-        
-        now = datetime.now().isoformat()
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT r.id, r.user_id, r.reason, r.restricted_by, r.restricted_at, r.expires_at,
-                       u.name, u.email
-                FROM comment_restrictions r
-                LEFT JOIN users u ON r.user_id = u.id
-                WHERE r.expires_at > %s
-                ORDER BY r.restricted_at DESC
-            """, (now,))
-        else:
-            c.execute("""
-                SELECT r.id, r.user_id, r.reason, r.restricted_by, r.restricted_at, r.expires_at,
-                       u.name, u.email
-                FROM comment_restrictions r
-                LEFT JOIN users u ON r.user_id = u.id
-                WHERE r.expires_at > ?
-                ORDER BY r.restricted_at DESC
-            """, (now,))
-        
-        rows = c.fetchall()
+        now = _utc_now().isoformat()
+        rows = db_query(conn, db_type, """
+            SELECT r.id, r.user_id, r.reason, r.restricted_by, r.restricted_at, r.expires_at,
+                   u.name, u.email
+            FROM comment_restrictions r
+            LEFT JOIN users u ON r.user_id = u.id
+            WHERE r.expires_at > ?
+            ORDER BY r.restricted_at DESC
+        """, (now,))
         conn.close()
         
         restrictions = []
@@ -1181,20 +727,16 @@ def restrict_user(user_id):
     
     print(f"[DEBUG] restrict_user called: user_id={user_id}, hours={hours}, reason={reason}")
     
+    from app import db_execute, db_query_one
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
         
         print(f"[DEBUG] db_type={db_type}")
         
         admin = get_admin_session()
         
         # Get user info
-        if db_type == 'postgres':
-            c.execute("SELECT name, role FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT name, role FROM users WHERE id = ?", (user_id,))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, "SELECT name, role FROM users WHERE id = ?", (user_id,))
         if not row:
             print(f"[DEBUG] User {user_id} not found")
             conn.close()
@@ -1209,62 +751,32 @@ def restrict_user(user_id):
             return jsonify({"error": "Cannot restrict this user"}), 403
         
         # Calculate expiration
-        expires_at = datetime.now() + timedelta(hours=hours)
-        now = datetime.now().isoformat()
+        expires_at = _utc_now() + timedelta(hours=hours)
+        now = _utc_now().isoformat()
         expires_iso = expires_at.isoformat()
         
         print(f"[DEBUG] Creating restriction: now={now}, expires={expires_iso}")
         
-        # Create table with appropriate syntax for database type
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comment_restrictions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    restricted_by TEXT,
-                    restricted_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-            # Use INSERT ON CONFLICT for PostgreSQL
-            c.execute("""
-                INSERT INTO comment_restrictions (user_id, reason, restricted_by, restricted_at, expires_at)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    reason = EXCLUDED.reason,
-                    restricted_by = EXCLUDED.restricted_by,
-                    restricted_at = EXCLUDED.restricted_at,
-                    expires_at = EXCLUDED.expires_at
-            """, (user_id, reason, admin['role'], now, expires_iso))
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comment_restrictions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    restricted_by TEXT,
-                    restricted_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-            c.execute("""
-                INSERT OR REPLACE INTO comment_restrictions (user_id, reason, restricted_by, restricted_at, expires_at)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, reason, admin['role'], now, expires_iso))
+        db_execute(conn, db_type, """
+            INSERT INTO comment_restrictions (user_id, reason, restricted_by, restricted_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                reason = EXCLUDED.reason,
+                restricted_by = EXCLUDED.restricted_by,
+                restricted_at = EXCLUDED.restricted_at,
+                expires_at = EXCLUDED.expires_at
+        """, (user_id, reason, admin['role'], now, expires_iso))
         
         conn.commit()
+        invalidate_moderation_cache(user_id)
         
         # Verify the restriction was created
-        if db_type == 'postgres':
-            c.execute("SELECT user_id, reason, expires_at FROM comment_restrictions WHERE user_id = %s", (user_id,))
-        else:
-            c.execute("SELECT user_id, reason, expires_at FROM comment_restrictions WHERE user_id = ?", (user_id,))
-        verify = c.fetchone()
+        verify = db_query_one(conn, db_type, "SELECT user_id, reason, expires_at FROM comment_restrictions WHERE user_id = ?", (user_id,))
         print(f"[DEBUG] Verification query result: {verify}")
-        
-        # Log the action BEFORE closing connection
-        log_action(
+        conn.close()
+
+        # The audit write needs a pooled connection of its own, so ours is released first.
+        audited = log_action(
             "RESTRICT_COMMENTS",
             f"Restricted {user_name} ({user_id}) for {hours}h: {reason}",
             target_user_id=user_id,
@@ -1273,9 +785,8 @@ def restrict_user(user_id):
             target={"user_id": user_id, "name": user_name, "role": user_role}
         )
         
-        conn.close()
         print(f"[DEBUG] Restriction successful for user {user_id}")
-        return jsonify({"success": True, "hours": hours})
+        return jsonify({"success": True, "hours": hours, "audit_logged": audited})
     except Exception as e:
         print(f"[ERROR] Restrict: {e}")
         import traceback
@@ -1287,25 +798,22 @@ def restrict_user(user_id):
 @require_permission('restrict_comments')
 def remove_restriction(user_id):
     """Remove comment restriction from user"""
+    from app import db_execute
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
-        
-        if db_type == 'postgres':
-            c.execute("DELETE FROM comment_restrictions WHERE user_id = %s", (user_id,))
-        else:
-            c.execute("DELETE FROM comment_restrictions WHERE user_id = ?", (user_id,))
+        db_execute(conn, db_type, "DELETE FROM comment_restrictions WHERE user_id = ?", (user_id,))
         conn.commit()
         conn.close()
+        invalidate_moderation_cache(user_id)
         
-        log_action(
+        audited = log_action(
             "UNRESTRICT",
             f"Removed comment restriction from user {user_id}",
             target_user_id=user_id,
             status="success",
             extras={"module": "comments", "event": "restriction_removed"}
         )
-        return jsonify({"success": True})
+        return jsonify({"success": True, "audit_logged": audited})
     except Exception as e:
         print(f"[ERROR] Unrestrict: {e}")
         import traceback
@@ -1317,181 +825,61 @@ def remove_restriction(user_id):
 @require_permission('delete_comments')
 def get_comments():
     """Get all comments and community messages for moderation"""
+    from app import db_query, get_reaction_counts_for_items, get_replies_for_parents
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
+        conn, db_type = get_db(readonly=True)
         comment_type = (request.args.get('type') or 'all').strip().lower()
         
         print(f"[DEBUG] Getting comments, db_type={db_type}")
         
         all_items = []
-        
-        def _reaction_counts(item_type, item_id):
-            result = {"heart": 0, "pray": 0, "cross": 0}
-            try:
-                if db_type == 'postgres':
-                    c.execute("""
-                        SELECT reaction, COUNT(*) AS cnt
-                        FROM comment_reactions
-                        WHERE item_type = %s AND item_id = %s
-                        GROUP BY reaction
-                    """, (item_type, item_id))
-                else:
-                    c.execute("""
-                        SELECT reaction, COUNT(*) AS cnt
-                        FROM comment_reactions
-                        WHERE item_type = ? AND item_id = ?
-                        GROUP BY reaction
-                    """, (item_type, item_id))
-                rows = c.fetchall()
-                for rr in rows:
-                    rr = _row_to_dict(rr)
-                    key = (rr.get('reaction') if hasattr(rr, 'keys') else rr[0]) or ''
-                    cnt = rr.get('cnt') if hasattr(rr, 'keys') else rr[1]
-                    key = str(key).lower()
-                    if key in result:
-                        result[key] = int(cnt or 0)
-            except Exception:
-                pass
-            return result
-
-        def _reply_count(item_type, item_id):
-            try:
-                if db_type == 'postgres':
-                    c.execute("""
-                        SELECT COUNT(*) AS cnt FROM comment_replies
-                        WHERE parent_type = %s AND parent_id = %s AND COALESCE(is_deleted, 0) = 0
-                    """, (item_type, item_id))
-                else:
-                    c.execute("""
-                        SELECT COUNT(*) AS cnt FROM comment_replies
-                        WHERE parent_type = ? AND parent_id = ? AND COALESCE(is_deleted, 0) = 0
-                    """, (item_type, item_id))
-                row = c.fetchone()
-                row = _row_to_dict(row)
-                return int((row.get('cnt') if hasattr(row, 'keys') else row[0]) if row else 0)
-            except Exception:
-                return 0
-
-        def _replies(item_type, item_id):
-            try:
-                if db_type == 'postgres':
-                    c.execute("""
-                        SELECT text, timestamp, google_name
-                        FROM comment_replies
-                        WHERE parent_type = %s AND parent_id = %s AND COALESCE(is_deleted, 0) = 0
-                        ORDER BY timestamp ASC
-                        LIMIT 20
-                    """, (item_type, item_id))
-                else:
-                    c.execute("""
-                        SELECT text, timestamp, google_name
-                        FROM comment_replies
-                        WHERE parent_type = ? AND parent_id = ? AND COALESCE(is_deleted, 0) = 0
-                        ORDER BY timestamp ASC
-                        LIMIT 20
-                    """, (item_type, item_id))
-                rows = c.fetchall()
-                result = []
-                for rr in rows:
-                    rr = _row_to_dict(rr)
-                    if hasattr(rr, 'keys'):
-                        result.append({
-                            "text": rr.get('text') or "",
-                            "timestamp": rr.get('timestamp'),
-                            "user_name": rr.get('google_name') or "Anonymous"
-                        })
-                    else:
-                        result.append({
-                            "text": rr[0] or "",
-                            "timestamp": rr[1],
-                            "user_name": rr[2] or "Anonymous"
-                        })
-                return result
-            except Exception:
-                return []
-
-        # Get verse comments
+        sources = []
         if comment_type in ('all', 'comment'):
-            try:
-                if db_type == 'postgres':
-                    c.execute("""
-                        SELECT id, verse_id, text, timestamp, google_name, user_id, 'comment' as type
-                        FROM comments
-                        WHERE COALESCE(is_deleted, 0) = 0
-                        ORDER BY timestamp DESC
-                        LIMIT 100
-                    """)
-                else:
-                    c.execute("""
-                        SELECT id, verse_id, text, timestamp, google_name, user_id, 'comment' as type
-                        FROM comments
-                        WHERE COALESCE(is_deleted, 0) = 0
-                        ORDER BY timestamp DESC
-                        LIMIT 100
-                    """)
-                
-                rows = c.fetchall()
-                print(f"[DEBUG] Found {len(rows)} verse comments")
-                
-                for row in rows:
-                    row_id = row[0]
-                    all_items.append({
-                        "id": row_id,
-                        "verse_id": row[1],
-                        "text": row[2] or "",
-                        "timestamp": row[3],
-                        "google_name": row[4] or "Anonymous",
-                        "user_name": row[4] or "Anonymous",
-                        "user_id": row[5],
-                        "type": row[6],
-                        "email": "No email",
-                        "reactions": _reaction_counts("comment", row_id),
-                        "reply_count": _reply_count("comment", row_id),
-                        "replies": _replies("comment", row_id)
-                    })
-            except Exception as e:
-                print(f"[ERROR] Getting verse comments: {e}")
-        
-        # Get community messages
+            sources.append(('comment', """
+                SELECT id, verse_id, text, timestamp, google_name, user_id
+                FROM comments
+                WHERE COALESCE(is_deleted, 0) = 0
+                ORDER BY timestamp DESC
+                LIMIT 100
+            """))
         if comment_type in ('all', 'community'):
+            sources.append(('community', """
+                SELECT id, NULL AS verse_id, text, timestamp, google_name, user_id
+                FROM community_messages
+                ORDER BY timestamp DESC
+                LIMIT 100
+            """))
+
+        # Reactions and replies come in one batched query per kind, not three per item.
+        for item_type, sql in sources:
             try:
-                if db_type == 'postgres':
-                    c.execute("""
-                        SELECT id, NULL as verse_id, text, timestamp, google_name, user_id, 'community' as type
-                        FROM community_messages
-                        ORDER BY timestamp DESC
-                        LIMIT 100
-                    """)
-                else:
-                    c.execute("""
-                        SELECT id, NULL as verse_id, text, timestamp, google_name, user_id, 'community' as type
-                        FROM community_messages
-                        ORDER BY timestamp DESC
-                        LIMIT 100
-                    """)
-                
-                rows = c.fetchall()
-                print(f"[DEBUG] Found {len(rows)} community messages")
-                
+                rows = db_query(conn, db_type, sql)
+                print(f"[DEBUG] Found {len(rows)} {item_type} items")
+                ids = [row.id for row in rows]
+                reactions = get_reaction_counts_for_items(conn, db_type, item_type, ids)
+                replies = get_replies_for_parents(conn, db_type, item_type, ids)
                 for row in rows:
-                    row_id = row[0]
+                    item_replies = replies[row.id]
                     all_items.append({
-                        "id": row_id,
-                        "verse_id": row[1],
-                        "text": row[2] or "",
-                        "timestamp": row[3],
-                        "google_name": row[4] or "Anonymous",
-                        "user_name": row[4] or "Anonymous",
-                        "user_id": row[5],
-                        "type": row[6],
+                        "id": row.id,
+                        "verse_id": row.verse_id,
+                        "text": row.text or "",
+                        "timestamp": row.timestamp,
+                        "google_name": row.google_name or "Anonymous",
+                        "user_name": row.google_name or "Anonymous",
+                        "user_id": row.user_id,
+                        "type": item_type,
                         "email": "No email",
-                        "reactions": _reaction_counts("community", row_id),
-                        "reply_count": _reply_count("community", row_id),
-                        "replies": _replies("community", row_id)
+                        "reactions": reactions[row.id],
+                        "reply_count": len(item_replies),
+                        "replies": [{
+                            "text": reply.text,
+                            "timestamp": reply.timestamp,
+                            "user_name": reply.user_name
+                        } for reply in item_replies[:20]]
                     })
             except Exception as e:
-                print(f"[ERROR] Getting community messages: {e}")
+                print(f"[ERROR] Getting {item_type} items: {e}")
         
         conn.close()
         
@@ -1511,51 +899,22 @@ def get_comments():
 @require_permission('delete_comments')
 def delete_comment(comment_id):
     """Soft delete a comment"""
+    from app import db_execute
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
         comment_type = (request.args.get('type') or 'comment').strip().lower()
 
-        # Ensure replies table has is_deleted column
-        try:
-            if db_type == 'postgres':
-                c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            else:
-                c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-        except Exception:
-            try:
-                c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            except Exception:
-                pass
-        
         if comment_type == 'community':
-            if db_type == 'postgres':
-                c.execute("DELETE FROM community_messages WHERE id = %s", (comment_id,))
-            else:
-                c.execute("DELETE FROM community_messages WHERE id = ?", (comment_id,))
-            try:
-                if db_type == 'postgres':
-                    c.execute("UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = %s AND parent_id = %s",
-                              ('community', comment_id))
-                else:
-                    c.execute("UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
-                              ('community', comment_id))
-            except Exception:
-                pass
+            db_execute(conn, db_type, "DELETE FROM community_messages WHERE id = ?", (comment_id,))
+            parent_type = 'community'
         else:
-            if db_type == 'postgres':
-                c.execute("UPDATE comments SET is_deleted = 1 WHERE id = %s", (comment_id,))
-            else:
-                c.execute("UPDATE comments SET is_deleted = 1 WHERE id = ?", (comment_id,))
-            try:
-                if db_type == 'postgres':
-                    c.execute("UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = %s AND parent_id = %s",
-                              ('comment', comment_id))
-                else:
-                    c.execute("UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
-                              ('comment', comment_id))
-            except Exception:
-                pass
+            db_execute(conn, db_type, "UPDATE comments SET is_deleted = 1 WHERE id = ?", (comment_id,))
+            parent_type = 'comment'
+        try:
+            db_execute(conn, db_type, "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
+                       (parent_type, comment_id))
+        except Exception:
+            pass
         conn.commit()
         conn.close()
         
@@ -1580,39 +939,11 @@ def ban_user(user_id):
     reason = data.get('reason', 'No reason provided')
     duration = data.get('duration', 'permanent')
     
+    from app import db_execute, db_query_one
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
         
-        # Create table with appropriate syntax
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS bans (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    banned_by TEXT,
-                    banned_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS bans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER UNIQUE,
-                    reason TEXT,
-                    banned_by TEXT,
-                    banned_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            """)
-        
-        if db_type == 'postgres':
-            c.execute("SELECT role, name FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT role, name FROM users WHERE id = ?", (user_id,))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, "SELECT role, name FROM users WHERE id = ?", (user_id,))
         if not row:
             conn.close()
             return jsonify({"error": "User not found"}), 404
@@ -1624,27 +955,10 @@ def ban_user(user_id):
             conn.close()
             return jsonify({"error": "Cannot ban this user"}), 403
 
-        # Ensure ban columns exist on users table for legacy DBs
-        try:
-            if db_type == 'postgres':
-                c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ban_expires_at TIMESTAMP")
-                c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ban_reason TEXT")
-            else:
-                try:
-                    c.execute("SELECT ban_expires_at FROM users LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE users ADD COLUMN ban_expires_at TEXT")
-                try:
-                    c.execute("SELECT ban_reason FROM users LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE users ADD COLUMN ban_reason TEXT")
-        except Exception:
-            pass
-        
         if banned:
             expires_at = None
             if duration != 'permanent':
-                now = datetime.now()
+                now = _utc_now()
                 if duration.endswith('m'):
                     expires_at = now + timedelta(minutes=int(duration[:-1]))
                 elif duration.endswith('h'):
@@ -1657,31 +971,21 @@ def ban_user(user_id):
                     expires_at = now + timedelta(days=int(duration[:-2]) * 30)
                 expires_at = expires_at.isoformat() if expires_at else None
             
-            if db_type == 'postgres':
-                c.execute(
-                    "UPDATE users SET is_banned = TRUE, ban_expires_at = %s, ban_reason = %s WHERE id = %s",
-                    (expires_at, reason, user_id)
-                )
-                c.execute("""
-                    INSERT INTO bans (user_id, reason, banned_by, banned_at, expires_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (user_id) DO UPDATE SET
-                        reason = EXCLUDED.reason,
-                        banned_by = EXCLUDED.banned_by,
-                        banned_at = EXCLUDED.banned_at,
-                        expires_at = EXCLUDED.expires_at
-                """, (user_id, reason, admin['role'], datetime.now().isoformat(), expires_at))
-            else:
-                c.execute(
-                    "UPDATE users SET is_banned = 1, ban_expires_at = ?, ban_reason = ? WHERE id = ?",
-                    (expires_at, reason, user_id)
-                )
-                c.execute("""
-                    INSERT OR REPLACE INTO bans (user_id, reason, banned_by, banned_at, expires_at)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (user_id, reason, admin['role'], datetime.now().isoformat(), expires_at))
+            db_execute(conn, db_type, "UPDATE users SET is_banned = ?, ban_expires_at = ?, ban_reason = ? WHERE id = ?",
+                       (True, expires_at, reason, user_id))
+            db_execute(conn, db_type, """
+                INSERT INTO bans (user_id, reason, banned_by, banned_at, expires_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    reason = EXCLUDED.reason,
+                    banned_by = EXCLUDED.banned_by,
+                    banned_at = EXCLUDED.banned_at,
+                    expires_at = EXCLUDED.expires_at
+            """, (user_id, reason, admin['role'], _utc_now().isoformat(), expires_at))
+            conn.commit()
+            conn.close()
             
-            log_action(
+            audited = log_action(
                 "BAN",
                 f"Banned {user_name} ({user_id}) for {duration}: {reason}",
                 target_user_id=user_id,
@@ -1690,19 +994,12 @@ def ban_user(user_id):
                 target={"user_id": user_id, "name": user_name, "role": target_role}
             )
         else:
-            if db_type == 'postgres':
-                c.execute(
-                    "UPDATE users SET is_banned = FALSE, ban_expires_at = NULL, ban_reason = NULL WHERE id = %s",
-                    (user_id,)
-                )
-                c.execute("DELETE FROM bans WHERE user_id = %s", (user_id,))
-            else:
-                c.execute(
-                    "UPDATE users SET is_banned = 0, ban_expires_at = NULL, ban_reason = NULL WHERE id = ?",
-                    (user_id,)
-                )
-                c.execute("DELETE FROM bans WHERE user_id = ?", (user_id,))
-            log_action(
+            db_execute(conn, db_type, "UPDATE users SET is_banned = ?, ban_expires_at = NULL, ban_reason = NULL WHERE id = ?",
+                       (False, user_id))
+            db_execute(conn, db_type, "DELETE FROM bans WHERE user_id = ?", (user_id,))
+            conn.commit()
+            conn.close()
+            audited = log_action(
                 "UNBAN",
                 f"Unbanned {user_name} ({user_id})",
                 target_user_id=user_id,
@@ -1711,10 +1008,9 @@ def ban_user(user_id):
                 target={"user_id": user_id, "name": user_name, "role": target_role}
             )
         
-        conn.commit()
-        conn.close()
+        invalidate_moderation_cache(user_id)
         
-        return jsonify({"success": True, "banned": banned})
+        return jsonify({"success": True, "banned": banned, "audit_logged": audited})
     except Exception as e:
         print(f"[ERROR] Ban: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1730,15 +1026,11 @@ def update_user_role(user_id):
     if not new_role or new_role not in ROLE_HIERARCHY:
         return jsonify({"error": "Invalid role"}), 400
     
+    from app import db_execute, db_query_one
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
         
-        if db_type == 'postgres':
-            c.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, "SELECT role FROM users WHERE id = ?", (user_id,))
         if not row:
             conn.close()
             return jsonify({"error": "User not found"}), 404
@@ -1754,23 +1046,20 @@ def update_user_role(user_id):
             return jsonify({"error": "Cannot assign this role"}), 403
         
         is_admin = 1 if ROLE_HIERARCHY[new_role] > 0 else 0
-        if db_type == 'postgres':
-            c.execute("UPDATE users SET role = %s, is_admin = %s WHERE id = %s", 
-                     (new_role, is_admin, user_id))
-        else:
-            c.execute("UPDATE users SET role = ?, is_admin = ? WHERE id = ?", 
-                     (new_role, is_admin, user_id))
+        db_execute(conn, db_type, "UPDATE users SET role = ?, is_admin = ? WHERE id = ?",
+                   (new_role, is_admin, user_id))
         conn.commit()
         conn.close()
+        invalidate_moderation_cache(user_id)
         
-        log_action(
+        audited = log_action(
             "UPDATE_ROLE",
             f"User {user_id} to {new_role}",
             target_user_id=user_id,
             status="success",
             extras={"new_role": new_role, "previous_role": current_role, "module": "users"}
         )
-        return jsonify({"success": True})
+        return jsonify({"success": True, "audit_logged": audited})
     except Exception as e:
         print(f"[ERROR] Update role: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1780,9 +1069,8 @@ def update_user_role(user_id):
 def get_audit_logs():
     conn = None
     try:
-        conn, db_type = get_db()
+        conn, db_type = get_db(readonly=True)
         c = conn.cursor()
-        _ensure_audit_logs_schema(conn, c, db_type)
         logs, _ = _read_audit_logs(c, db_type, limit=100, offset=0, action=None)
         conn.close()
         return jsonify(logs)
@@ -1796,6 +1084,22 @@ def get_audit_logs():
                 pass
         return jsonify({"error": str(e)}), 500
 
+@admin_bp.route('/api/audit-sink')
+@admin_required
+@require_permission('view_audit')
+def get_audit_sink_stats():
+    """Queue depth and write/flush latency of the batched audit sink."""
+    from app import audit_events
+    return jsonify(audit_events.stats())
+
+@admin_bp.route('/api/outbound-cache')
+@admin_required
+@require_permission('view_settings')
+def get_outbound_cache_stats():
+    """Hit/miss/coalescing counters of the cache in front of bible-api and gutendex."""
+    from app import outbound_cache
+    return jsonify(outbound_cache.stats())
+
 @admin_bp.route('/api/audits')
 @admin_required
 @require_permission('view_audit')
@@ -1817,9 +1121,8 @@ def get_audits():
         }
         normalized_action = action_map.get(action, action)
 
-        conn, db_type = get_db()
+        conn, db_type = get_db(readonly=True)
         c = conn.cursor()
-        _ensure_audit_logs_schema(conn, c, db_type)
         logs, total = _read_audit_logs(c, db_type, limit=per_page, offset=offset, action=normalized_action)
         conn.close()
 
@@ -1847,9 +1150,8 @@ def get_recent_activity():
     """Get recent activity for dashboard (last 10 actions)"""
     conn = None
     try:
-        conn, db_type = get_db()
+        conn, db_type = get_db(readonly=True)
         c = conn.cursor()
-        _ensure_audit_logs_schema(conn, c, db_type)
         logs, _ = _read_audit_logs(c, db_type, limit=10, offset=0, action=None)
         conn.close()
         return jsonify(logs)
@@ -1867,26 +1169,14 @@ def get_recent_activity():
 @admin_required
 @require_permission('view_settings')
 def get_settings():
+    from app import db_scalar
     admin = get_admin_session()
     maintenance_mode = os.environ.get('MAINTENANCE_MODE', 'false')
     conn = None
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", ('maintenance_mode',))
-        else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", ('maintenance_mode',))
-        row = _row_to_dict(c.fetchone())
-        if row:
-            maintenance_mode = (row.get('value') if hasattr(row, 'keys') else row[0]) or maintenance_mode
+        conn, db_type = get_db(readonly=True)
+        maintenance_mode = db_scalar(conn, db_type, "SELECT value FROM system_settings WHERE key = ?",
+                                     ('maintenance_mode',)) or maintenance_mode
         conn.close()
     except Exception:
         if conn:
@@ -1904,6 +1194,27 @@ def get_settings():
         "can_edit": has_permission('edit_settings')
     })
 
+@admin_bp.route('/api/db/indexes', methods=['GET'])
+@admin_required
+@require_permission('view_settings')
+def get_index_report():
+    """Managed index status, usage counts and EXPLAIN hints for hot queries."""
+    conn = None
+    try:
+        from app import build_index_report
+        conn, db_type = get_db(readonly=True)
+        report = build_index_report(conn, db_type)
+        conn.close()
+        return jsonify(report)
+    except Exception as e:
+        print(f"[ERROR] Index report: {e}")
+        if conn:
+            try:
+                conn.close()
+            except:
+                pass
+        return jsonify({"error": str(e)}), 500
+
 @admin_bp.route('/api/check-session')
 def check_session():
     admin = get_admin_session()
@@ -1911,27 +1222,14 @@ def check_session():
         try:
             user_id = session.get('user_id')
             if user_id:
+                from app import db_execute, db_scalar
                 conn, db_type = get_db()
-                c = conn.cursor()
-                if db_type == 'postgres':
-                    c.execute("SELECT role FROM users WHERE id = %s", (user_id,))
-                else:
-                    c.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-                row = c.fetchone()
-                db_role = None
-                if row:
-                    try:
-                        db_role = row['role']
-                    except Exception:
-                        db_role = row[0]
+                db_role = db_scalar(conn, db_type, "SELECT role FROM users WHERE id = ?", (user_id,))
                 admin_role = (admin.get('role') or 'user').strip().lower()
                 db_role_norm = (db_role or 'user').strip().lower()
                 if ROLE_HIERARCHY.get(admin_role, 0) > ROLE_HIERARCHY.get(db_role_norm, 0):
                     is_admin = 1 if ROLE_HIERARCHY.get(admin_role, 0) > 0 else 0
-                    if db_type == 'postgres':
-                        c.execute("UPDATE users SET role = %s, is_admin = %s WHERE id = %s", (admin_role, is_admin, user_id))
-                    else:
-                        c.execute("UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (admin_role, is_admin, user_id))
+                    db_execute(conn, db_type, "UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (admin_role, is_admin, user_id))
                     conn.commit()
                 conn.close()
         except Exception:
@@ -1944,60 +1242,26 @@ def check_session():
 
 def _dispatch_announcement_row(c, db_type, announcement_row):
     """Insert notification rows for target users and mark announcement sent."""
-    announcement_row = _row_to_dict(announcement_row)
-    if hasattr(announcement_row, 'keys'):
-        ann_id = announcement_row.get('id')
-        title = announcement_row.get('title') or 'Announcement'
-        message = announcement_row.get('message') or ''
-        is_global = int(announcement_row.get('is_global') or 0) == 1
-        target_user_id = announcement_row.get('target_user_id')
-    else:
-        ann_id, title, message, is_global, target_user_id = announcement_row[0], announcement_row[1], announcement_row[2], (announcement_row[3] == 1), announcement_row[4]
-
+    from app import db_execute
+    ann_id, title, message, is_global, target_user_id = announcement_row[:5]
+    title = title or 'Announcement'
+    message = message or ''
     now_iso = _iso_now()
     created = 0
 
-    if is_global:
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM users")
-        else:
-            c.execute("SELECT id FROM users")
-        users = c.fetchall()
-        user_ids = []
-        for u in users:
-            u = _row_to_dict(u)
-            uid = u.get('id') if hasattr(u, 'keys') else u[0]
-            if uid is not None:
-                user_ids.append(uid)
-        for uid in user_ids:
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                    VALUES (%s, %s, %s, %s, %s, 0, %s, %s)
-                """, (uid, title, message, 'announcement', 'admin', now_iso, now_iso))
-            else:
-                c.execute("""
-                    INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                    VALUES (?, ?, ?, ?, ?, 0, ?, ?)
-                """, (uid, title, message, 'announcement', 'admin', now_iso, now_iso))
-            created += 1
+    if int(is_global or 0) == 1:
+        created = db_execute(c, db_type, """
+            INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
+            SELECT id, ?, ?, ?, ?, 0, ?, ? FROM users
+        """, (title, message, 'announcement', 'admin', now_iso, now_iso)).rowcount
     elif target_user_id is not None:
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                VALUES (%s, %s, %s, %s, %s, 0, %s, %s)
-            """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
-        else:
-            c.execute("""
-                INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
-            """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
+        db_execute(c, db_type, """
+            INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+        """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
         created = 1
 
-    if db_type == 'postgres':
-        c.execute("UPDATE admin_announcements SET status = %s, sent_at = %s WHERE id = %s", ('sent', now_iso, ann_id))
-    else:
-        c.execute("UPDATE admin_announcements SET status = ?, sent_at = ? WHERE id = ?", ('sent', now_iso, ann_id))
+    db_execute(c, db_type, "UPDATE admin_announcements SET status = ?, sent_at = ? WHERE id = ?", ('sent', now_iso, ann_id))
 
     return created
 
@@ -2005,31 +1269,12 @@ def _dispatch_announcement_row(c, db_type, announcement_row):
 @admin_required
 @require_permission('view_audit')
 def get_admin_insights():
+    from app import db_query, db_query_one, db_scalar, iso_timestamp, online_counter, sql_date
     conn = None
     try:
         conn, db_type = get_db()
         c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        _ensure_daily_actions_schema(c, db_type)
-        if db_type == 'postgres':
-            c.execute("CREATE TABLE IF NOT EXISTS users (id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user')")
-            c.execute("CREATE TABLE IF NOT EXISTS likes (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS saves (id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-        else:
-            c.execute("CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0, is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user')")
-            c.execute("CREATE TABLE IF NOT EXISTS likes (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS saves (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, timestamp TEXT, UNIQUE(user_id, verse_id))")
-            c.execute("CREATE TABLE IF NOT EXISTS daily_actions (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL, verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT)")
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        now = datetime.now()
+        now = _utc_now()
         active_cutoff = now - timedelta(minutes=5)
         retention_1d_cutoff = now - timedelta(days=1)
         retention_7d_cutoff = now - timedelta(days=7)
@@ -2037,76 +1282,41 @@ def get_admin_insights():
 
         # Process due scheduled announcements while loading insights.
         now_iso = _iso_now()
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, title, message, is_global, target_user_id
-                FROM admin_announcements
-                WHERE status = %s AND scheduled_for IS NOT NULL AND scheduled_for <= %s
-                ORDER BY scheduled_for ASC
-            """, ('scheduled', now_iso))
-        else:
-            c.execute("""
-                SELECT id, title, message, is_global, target_user_id
-                FROM admin_announcements
-                WHERE status = ? AND scheduled_for IS NOT NULL AND scheduled_for <= ?
-                ORDER BY scheduled_for ASC
-            """, ('scheduled', now_iso))
-        due_rows = c.fetchall()
+        due_rows = db_query(c, db_type, """
+            SELECT id, title, message, is_global, target_user_id
+            FROM admin_announcements
+            WHERE status = ? AND scheduled_for IS NOT NULL AND scheduled_for <= ?
+            ORDER BY scheduled_for ASC
+        """, ('scheduled', now_iso))
         for row in due_rows:
             _dispatch_announcement_row(c, db_type, row)
 
         # Active users now from presence pings.
-        c.execute("SELECT user_id, last_seen FROM user_presence")
-        presence_rows = c.fetchall()
-        active_users_now = 0
-        for row in presence_rows:
-            row = _row_to_dict(row)
-            last_seen = row.get('last_seen') if hasattr(row, 'keys') else row[1]
-            dt = _parse_dt(last_seen)
-            if dt and dt >= active_cutoff:
-                active_users_now += 1
+        active_users_now = online_counter.online(5)
+        online_series = online_counter.series(c, db_type, 60)
 
         if active_users_now == 0:
             try:
-                if db_type == 'postgres':
-                    c.execute("SELECT COUNT(DISTINCT user_id) FROM daily_actions WHERE timestamp >= %s", (active_cutoff.isoformat(),))
-                else:
-                    c.execute("SELECT COUNT(DISTINCT user_id) FROM daily_actions WHERE timestamp >= ?", (active_cutoff.isoformat(),))
-                active_row = c.fetchone()
-                active_users_now = int(_row_first_value(active_row, 0) or 0)
+                active_users_now = int(db_scalar(c, db_type, "SELECT COUNT(DISTINCT user_id) AS total FROM daily_actions WHERE timestamp >= ?",
+                                                 (active_cutoff.isoformat(),), 0))
             except Exception:
                 pass
 
         # Recent signups.
-        c.execute("SELECT id, name, email, role, created_at FROM users ORDER BY created_at DESC LIMIT 8")
-        signup_rows = c.fetchall()
-        recent_signups = []
-        for row in signup_rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                recent_signups.append({
-                    "id": row.get('id'),
-                    "name": row.get('name') or "Unknown",
-                    "email": row.get('email') or "",
-                    "role": row.get('role') or "user",
-                    "created_at": row.get('created_at')
-                })
-            else:
-                recent_signups.append({
-                    "id": row[0],
-                    "name": row[1] or "Unknown",
-                    "email": row[2] or "",
-                    "role": row[3] or "user",
-                    "created_at": row[4]
-                })
+        signup_rows = db_query(c, db_type, "SELECT id, name, email, role, created_at FROM users ORDER BY created_at DESC LIMIT 8")
+        recent_signups = [{
+            "id": row.id,
+            "name": row.name or "Unknown",
+            "email": row.email or "",
+            "role": row.role or "user",
+            "created_at": iso_timestamp(row.created_at)
+        } for row in signup_rows]
 
         # Total users.
-        c.execute("SELECT COUNT(*) FROM users")
-        total_users_row = c.fetchone()
-        total_users = int(_row_first_value(total_users_row, 0) or 0)
+        total_users = int(db_scalar(c, db_type, "SELECT COUNT(*) AS total FROM users", (), 0))
 
         # Daily active users (from daily_actions table).
-        c.execute("""
+        dau_rows = db_query(c, db_type, """
             SELECT event_date, COUNT(DISTINCT user_id) AS cnt
             FROM daily_actions
             WHERE user_id IS NOT NULL
@@ -2114,84 +1324,62 @@ def get_admin_insights():
             ORDER BY event_date DESC
             LIMIT 14
         """)
-        dau_rows = c.fetchall()
-        dau_series = []
-        for row in reversed(dau_rows):
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                dau_series.append({"date": row.get('event_date'), "count": int(row.get('cnt') or 0)})
-            else:
-                dau_series.append({"date": row[0], "count": int(row[1] or 0)})
-
-        # User growth (new users/day).
-        c.execute("SELECT created_at FROM users")
-        created_rows = c.fetchall()
-        growth_counter = defaultdict(int)
-        for row in created_rows:
-            row = _row_to_dict(row)
-            val = row.get('created_at') if hasattr(row, 'keys') else row[0]
-            dt = _parse_dt(val)
-            if dt:
-                growth_counter[dt.date().isoformat()] += 1
-        growth_dates = sorted(growth_counter.keys())[-14:]
-        growth_series = [{"date": d, "count": growth_counter[d]} for d in growth_dates]
-
-        # Retention windows from daily_actions activity.
-        c.execute("SELECT id, created_at FROM users")
-        all_user_rows = c.fetchall()
-        c.execute("SELECT user_id, timestamp FROM daily_actions WHERE user_id IS NOT NULL")
-        action_rows = c.fetchall()
-        active_1d = set()
-        active_7d = set()
-        active_30d = set()
-        for row in action_rows:
-            row = _row_to_dict(row)
-            uid = row.get('user_id') if hasattr(row, 'keys') else row[0]
-            ts = row.get('timestamp') if hasattr(row, 'keys') else row[1]
-            dt = _parse_dt(ts)
-            if not dt or uid is None:
-                continue
-            if dt >= retention_1d_cutoff:
-                active_1d.add(uid)
-            if dt >= retention_7d_cutoff:
-                active_7d.add(uid)
-            if dt >= retention_30d_cutoff:
-                active_30d.add(uid)
-
-        base_users_for_1d = 0
-        base_users_for_7d = 0
-        base_users_for_30d = 0
-        for row in all_user_rows:
-            row = _row_to_dict(row)
-            created_at = row.get('created_at') if hasattr(row, 'keys') else row[1]
-            dt = _parse_dt(created_at)
-            if dt and dt <= retention_1d_cutoff:
-                base_users_for_1d += 1
-            if dt and dt <= retention_7d_cutoff:
-                base_users_for_7d += 1
-            if dt and dt <= retention_30d_cutoff:
-                base_users_for_30d += 1
+        dau_series = [{"date": row.event_date, "count": int(row.cnt or 0)} for row in reversed(dau_rows)]
+
+        # User growth (new users/day, last 14 days that had signups).
+        signup_day = sql_date(db_type, 'created_at')
+        growth_rows = db_query(c, db_type, f"""
+            SELECT {signup_day} AS day, COUNT(*) AS cnt
+            FROM users
+            WHERE created_at IS NOT NULL
+            GROUP BY {signup_day}
+            ORDER BY day DESC
+            LIMIT 14
+        """)
+        growth_series = [{"date": str(row.day), "count": int(row.cnt or 0)}
+                         for row in reversed(growth_rows) if row.day is not None]
+
+        # Retention windows from daily_actions activity; only the last 30 days are scanned.
+        cutoffs = (retention_1d_cutoff.isoformat(), retention_7d_cutoff.isoformat(), retention_30d_cutoff.isoformat())
+        active = db_query_one(c, db_type, """
+            SELECT
+                COUNT(DISTINCT CASE WHEN timestamp >= ? THEN user_id END) AS d1,
+                COUNT(DISTINCT CASE WHEN timestamp >= ? THEN user_id END) AS d7,
+                COUNT(DISTINCT user_id) AS d30
+            FROM daily_actions
+            WHERE user_id IS NOT NULL AND timestamp >= ?
+        """, cutoffs)
+        base = db_query_one(c, db_type, """
+            SELECT
+                SUM(CASE WHEN created_at <= ? THEN 1 ELSE 0 END) AS d1,
+                SUM(CASE WHEN created_at <= ? THEN 1 ELSE 0 END) AS d7,
+                SUM(CASE WHEN created_at <= ? THEN 1 ELSE 0 END) AS d30
+            FROM users
+            WHERE created_at IS NOT NULL
+        """, cutoffs)
+
+        def _rate(window):
+            users = int(base[window] or 0)
+            return round((int(active[window] or 0) / users) * 100, 2) if users else 0
 
         retention = {
-            "day_1": round((len(active_1d) / base_users_for_1d) * 100, 2) if base_users_for_1d else 0,
-            "day_7": round((len(active_7d) / base_users_for_7d) * 100, 2) if base_users_for_7d else 0,
-            "day_30": round((len(active_30d) / base_users_for_30d) * 100, 2) if base_users_for_30d else 0
+            "day_1": _rate('d1'),
+            "day_7": _rate('d7'),
+            "day_30": _rate('d30')
         }
 
         # Conversion rate: users with at least one like/save.
-        c.execute("""
-            SELECT COUNT(DISTINCT user_id) FROM (
+        converted_users = int(db_scalar(c, db_type, """
+            SELECT COUNT(DISTINCT user_id) AS total FROM (
                 SELECT user_id FROM likes
                 UNION
                 SELECT user_id FROM saves
             ) t
-        """)
-        conv_row = c.fetchone()
-        converted_users = int(_row_first_value(conv_row, 0) or 0)
+        """, (), 0))
         conversion_rate = round((converted_users / total_users) * 100, 2) if total_users else 0
 
         # Top active users by actions.
-        c.execute("""
+        top_rows = db_query(c, db_type, """
             SELECT da.user_id, COUNT(*) AS cnt, u.name, u.email
             FROM daily_actions da
             LEFT JOIN users u ON u.id = da.user_id
@@ -2200,27 +1388,15 @@ def get_admin_insights():
             ORDER BY cnt DESC
             LIMIT 8
         """)
-        top_rows = c.fetchall()
-        top_active_users = []
-        for row in top_rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                top_active_users.append({
-                    "user_id": row.get('user_id'),
-                    "name": row.get('name') or "Unknown",
-                    "email": row.get('email') or "",
-                    "actions": int(row.get('cnt') or 0)
-                })
-            else:
-                top_active_users.append({
-                    "user_id": row[0],
-                    "name": row[2] or "Unknown",
-                    "email": row[3] or "",
-                    "actions": int(row[1] or 0)
-                })
+        top_active_users = [{
+            "user_id": row.user_id,
+            "name": row.name or "Unknown",
+            "email": row.email or "",
+            "actions": int(row.cnt or 0)
+        } for row in top_rows]
 
         # Most used features.
-        c.execute("""
+        feature_rows = db_query(c, db_type, """
             SELECT action, COUNT(*) AS cnt
             FROM daily_actions
             WHERE action IS NOT NULL
@@ -2228,44 +1404,24 @@ def get_admin_insights():
             ORDER BY cnt DESC
             LIMIT 10
         """)
-        feature_rows = c.fetchall()
-        most_used_features = []
-        for row in feature_rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                most_used_features.append({"feature": row.get('action') or "unknown", "count": int(row.get('cnt') or 0)})
-            else:
-                most_used_features.append({"feature": row[0] or "unknown", "count": int(row[1] or 0)})
+        most_used_features = [{"feature": row.action or "unknown", "count": int(row.cnt or 0)} for row in feature_rows]
 
         # Revenue (if donation events are being inserted externally).
-        c.execute("SELECT COALESCE(SUM(amount_cents), 0) FROM donation_events WHERE status = 'paid'")
-        rev_row = c.fetchone()
-        revenue_cents = int(_row_first_value(rev_row, 0) or 0)
+        revenue_cents = int(db_scalar(c, db_type, "SELECT COALESCE(SUM(amount_cents), 0) AS total FROM donation_events WHERE status = 'paid'", (), 0))
 
         # Scheduled/sent announcement counts.
-        c.execute("SELECT COUNT(*) FROM admin_announcements WHERE status = 'scheduled'")
-        scheduled_row = c.fetchone()
-        announcements_scheduled = int(_row_first_value(scheduled_row, 0) or 0)
-        c.execute("SELECT COUNT(*) FROM admin_announcements WHERE status = 'sent'")
-        sent_row = c.fetchone()
-        announcements_sent = int(_row_first_value(sent_row, 0) or 0)
+        announcements_scheduled = int(db_scalar(c, db_type, "SELECT COUNT(*) AS total FROM admin_announcements WHERE status = 'scheduled'", (), 0))
+        announcements_sent = int(db_scalar(c, db_type, "SELECT COUNT(*) AS total FROM admin_announcements WHERE status = 'sent'", (), 0))
 
         # Maintenance mode state
-        if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", ('maintenance_mode',))
-        else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", ('maintenance_mode',))
-        maint_row = c.fetchone()
-        maintenance_mode = False
-        if maint_row:
-            maint_row = _row_to_dict(maint_row)
-            maint_val = maint_row.get('value') if hasattr(maint_row, 'keys') else maint_row[0]
-            maintenance_mode = str(maint_val).strip().lower() in ('1', 'true', 'yes', 'on')
+        maint_val = db_scalar(c, db_type, "SELECT value FROM system_settings WHERE key = ?", ('maintenance_mode',))
+        maintenance_mode = maint_val is not None and str(maint_val).strip().lower() in ('1', 'true', 'yes', 'on')
 
         conn.commit()
         conn.close()
         return jsonify({
             "active_users_now": active_users_now,
+            "online_series": online_series,
             "recent_signups": recent_signups,
             "daily_active_users": dau_series,
             "user_growth": growth_series,
@@ -2293,29 +1449,18 @@ def get_admin_insights():
 @admin_required
 @require_permission('view_audit')
 def list_announcements():
+    from app import db_query
     conn = None
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        c.execute("""
+        conn, db_type = get_db(readonly=True)
+        rows = db_query(conn, db_type, """
             SELECT id, title, message, is_global, target_user_id, scheduled_for, status, created_by, created_at, sent_at
             FROM admin_announcements
             ORDER BY created_at DESC
             LIMIT 100
         """)
-        rows = c.fetchall()
         conn.close()
-        out = []
-        for row in rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                out.append({k: row.get(k) for k in ['id', 'title', 'message', 'is_global', 'target_user_id', 'scheduled_for', 'status', 'created_by', 'created_at', 'sent_at']})
-            else:
-                out.append({
-                    "id": row[0], "title": row[1], "message": row[2], "is_global": row[3], "target_user_id": row[4],
-                    "scheduled_for": row[5], "status": row[6], "created_by": row[7], "created_at": row[8], "sent_at": row[9]
-                })
+        out = [row.as_dict() for row in rows]
         return jsonify(out)
     except Exception as e:
         print(f"[ERROR] List announcements: {e}")
@@ -2332,13 +1477,9 @@ def list_announcements():
 def delete_announcement(announcement_id):
     conn = None
     try:
+        from app import db_execute
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        if db_type == 'postgres':
-            c.execute("DELETE FROM admin_announcements WHERE id = %s", (announcement_id,))
-        else:
-            c.execute("DELETE FROM admin_announcements WHERE id = ?", (announcement_id,))
+        db_execute(conn, db_type, "DELETE FROM admin_announcements WHERE id = ?", (announcement_id,))
         conn.commit()
         conn.close()
         log_action("DELETE_ANNOUNCEMENT", f"Deleted announcement #{announcement_id}", status="success")
@@ -2359,63 +1500,29 @@ def delete_announcement(announcement_id):
 def list_notifications():
     conn = None
     try:
+        from app import db_query
         notif_type = (request.args.get('type') or 'all').strip().lower()
-        conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        if notif_type != 'all':
-            if db_type == 'postgres':
-                c.execute("""
-                    SELECT id, user_id, title, message, notif_type, source, is_read, created_at, sent_at
-                    FROM user_notifications
-                    WHERE LOWER(notif_type) = %s
-                    ORDER BY created_at DESC
-                    LIMIT 200
-                """, (notif_type,))
-            else:
-                c.execute("""
-                    SELECT id, user_id, title, message, notif_type, source, is_read, created_at, sent_at
-                    FROM user_notifications
-                    WHERE LOWER(notif_type) = ?
-                    ORDER BY created_at DESC
-                    LIMIT 200
-                """, (notif_type,))
-        else:
-            c.execute("""
-                SELECT id, user_id, title, message, notif_type, source, is_read, created_at, sent_at
-                FROM user_notifications
-                ORDER BY created_at DESC
-                LIMIT 200
-            """)
-        rows = c.fetchall()
+        conn, db_type = get_db(readonly=True)
+        where, params = ("WHERE LOWER(notif_type) = ?", (notif_type,)) if notif_type != 'all' else ("", ())
+        rows = db_query(conn, db_type, f"""
+            SELECT id, user_id, title, message, notif_type, source, is_read, created_at, sent_at
+            FROM user_notifications
+            {where}
+            ORDER BY created_at DESC
+            LIMIT 200
+        """, params)
         conn.close()
-        out = []
-        for row in rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                out.append({
-                    "id": row.get('id'),
-                    "user_id": row.get('user_id'),
-                    "title": row.get('title') or '',
-                    "message": row.get('message') or '',
-                    "notif_type": row.get('notif_type') or '',
-                    "source": row.get('source') or '',
-                    "is_read": bool(row.get('is_read') or 0),
-                    "created_at": row.get('created_at'),
-                    "sent_at": row.get('sent_at')
-                })
-            else:
-                out.append({
-                    "id": row[0],
-                    "user_id": row[1],
-                    "title": row[2] or '',
-                    "message": row[3] or '',
-                    "notif_type": row[4] or '',
-                    "source": row[5] or '',
-                    "is_read": bool(row[6] or 0),
-                    "created_at": row[7],
-                    "sent_at": row[8] if len(row) > 8 else None
-                })
+        out = [{
+            "id": row.id,
+            "user_id": row.user_id,
+            "title": row.title or '',
+            "message": row.message or '',
+            "notif_type": row.notif_type or '',
+            "source": row.source or '',
+            "is_read": bool(row.is_read or 0),
+            "created_at": row.created_at,
+            "sent_at": row.sent_at
+        } for row in rows]
         return jsonify(out)
     except Exception as e:
         print(f"[ERROR] List notifications: {e}")
@@ -2432,13 +1539,9 @@ def list_notifications():
 def delete_notification(notification_id):
     conn = None
     try:
+        from app import db_execute
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        if db_type == 'postgres':
-            c.execute("DELETE FROM user_notifications WHERE id = %s", (notification_id,))
-        else:
-            c.execute("DELETE FROM user_notifications WHERE id = ?", (notification_id,))
+        db_execute(conn, db_type, "DELETE FROM user_notifications WHERE id = ?", (notification_id,))
         conn.commit()
         conn.close()
         log_action("DELETE_NOTIFICATION", f"Deleted notification #{notification_id}", status="success")
@@ -2474,44 +1577,25 @@ def create_announcement():
         scheduled_for = str(data.get('scheduled_for') or '').strip() or None
         status = 'scheduled' if scheduled_for else 'draft'
 
+        from app import db_insert, db_query_one
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
         admin = get_admin_session()
         admin_role = admin['role'] if admin else 'unknown'
         now_iso = _iso_now()
 
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO admin_announcements (title, message, is_global, target_user_id, scheduled_for, status, created_by, created_at)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                RETURNING id
-            """, (title, message, is_global, target_user_id, scheduled_for, status, admin_role, now_iso))
-            row = _row_to_dict(c.fetchone())
-            announcement_id = row.get('id') if hasattr(row, 'keys') else row[0]
-        else:
-            c.execute("""
-                INSERT INTO admin_announcements (title, message, is_global, target_user_id, scheduled_for, status, created_by, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (title, message, is_global, target_user_id, scheduled_for, status, admin_role, now_iso))
-            announcement_id = c.lastrowid
+        announcement_id = db_insert(conn, db_type, """
+            INSERT INTO admin_announcements (title, message, is_global, target_user_id, scheduled_for, status, created_by, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (title, message, is_global, target_user_id, scheduled_for, status, admin_role, now_iso))
 
         dispatched = 0
         if status == 'draft':
-            if db_type == 'postgres':
-                c.execute("""
-                    SELECT id, title, message, is_global, target_user_id
-                    FROM admin_announcements
-                    WHERE id = %s
-                """, (announcement_id,))
-            else:
-                c.execute("""
-                    SELECT id, title, message, is_global, target_user_id
-                    FROM admin_announcements
-                    WHERE id = ?
-                """, (announcement_id,))
-            ann_row = _row_to_dict(c.fetchone())
-            dispatched = _dispatch_announcement_row(c, db_type, ann_row)
+            ann_row = db_query_one(conn, db_type, """
+                SELECT id, title, message, is_global, target_user_id
+                FROM admin_announcements
+                WHERE id = ?
+            """, (announcement_id,))
+            dispatched = _dispatch_announcement_row(conn, db_type, ann_row)
 
         log_action(
             "CREATE_ANNOUNCEMENT",
@@ -2539,26 +1623,17 @@ def create_announcement():
 def send_announcement_now(announcement_id):
     conn = None
     try:
+        from app import db_query_one
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, title, message, is_global, target_user_id
-                FROM admin_announcements
-                WHERE id = %s
-            """, (announcement_id,))
-        else:
-            c.execute("""
-                SELECT id, title, message, is_global, target_user_id
-                FROM admin_announcements
-                WHERE id = ?
-            """, (announcement_id,))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, """
+            SELECT id, title, message, is_global, target_user_id
+            FROM admin_announcements
+            WHERE id = ?
+        """, (announcement_id,))
         if not row:
             conn.close()
             return jsonify({"error": "Announcement not found"}), 404
-        dispatched = _dispatch_announcement_row(c, db_type, row)
+        dispatched = _dispatch_announcement_row(conn, db_type, row)
         log_action("SEND_ANNOUNCEMENT", f"Sent announcement #{announcement_id}", status="success", extras={"dispatched": dispatched})
         conn.commit()
         conn.close()
@@ -2592,20 +1667,13 @@ def admin_message_user():
 
     conn = None
     try:
+        from app import db_execute
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
         now_iso = _iso_now()
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                VALUES (%s, %s, %s, %s, %s, 0, %s, %s)
-            """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
-        else:
-            c.execute("""
-                INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                VALUES (?, ?, ?, ?, ?, 0, ?, ?)
-            """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
+        db_execute(conn, db_type, """
+            INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+        """, (target_user_id, title, message, 'direct_message', 'admin', now_iso, now_iso))
         log_action("DIRECT_MESSAGE", f"Sent direct message to user {target_user_id}", target_user_id=target_user_id, status="success")
         conn.commit()
         conn.close()
@@ -2631,27 +1699,13 @@ def send_push_notification():
         return jsonify({"error": "Message required"}), 400
     conn = None
     try:
+        from app import db_execute
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
         now_iso = _iso_now()
-        c.execute("SELECT id FROM users")
-        users = c.fetchall()
-        sent = 0
-        for row in users:
-            row = _row_to_dict(row)
-            uid = row.get('id') if hasattr(row, 'keys') else row[0]
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                    VALUES (%s, %s, %s, %s, %s, 0, %s, %s)
-                """, (uid, title, message, 'push', 'admin', now_iso, now_iso))
-            else:
-                c.execute("""
-                    INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
-                    VALUES (?, ?, ?, ?, ?, 0, ?, ?)
-                """, (uid, title, message, 'push', 'admin', now_iso, now_iso))
-            sent += 1
+        sent = db_execute(conn, db_type, """
+            INSERT INTO user_notifications (user_id, title, message, notif_type, source, is_read, created_at, sent_at)
+            SELECT id, ?, ?, ?, ?, 0, ?, ? FROM users
+        """, (title, message, 'push', 'admin', now_iso, now_iso)).rowcount
         log_action("PUSH_BROADCAST", "Broadcast push notification", status="success", extras={"sent_count": sent})
         conn.commit()
         conn.close()
@@ -2670,11 +1724,10 @@ def send_push_notification():
 @admin_required
 @require_permission('view_audit')
 def admin_chat():
+    from app import db_execute, db_query
     conn = None
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
-        _ensure_admin_feature_tables(conn, c, db_type)
         if request.method == 'POST':
             data = request.get_json() or {}
             msg = str(data.get('message') or '').strip()
@@ -2684,40 +1737,26 @@ def admin_chat():
             admin = get_admin_session()
             role = admin['role'] if admin else 'unknown'
             now_iso = _iso_now()
-            if db_type == 'postgres':
-                c.execute("INSERT INTO admin_chat_messages (admin_role, message, created_at) VALUES (%s, %s, %s)", (role, msg, now_iso))
-            else:
-                c.execute("INSERT INTO admin_chat_messages (admin_role, message, created_at) VALUES (?, ?, ?)", (role, msg, now_iso))
+            db_execute(conn, db_type, "INSERT INTO admin_chat_messages (admin_role, message, created_at) VALUES (?, ?, ?)",
+                       (role, msg, now_iso))
             conn.commit()
             log_action("ADMIN_CHAT_MESSAGE", "Posted admin chat message", status="success")
             conn.close()
             return jsonify({"success": True})
 
-        c.execute("""
+        rows = db_query(conn, db_type, """
             SELECT id, admin_role, message, created_at
             FROM admin_chat_messages
             ORDER BY created_at DESC
             LIMIT 100
         """)
-        rows = c.fetchall()
         conn.close()
-        out = []
-        for row in reversed(rows):
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                out.append({
-                    "id": row.get('id'),
-                    "admin_role": row.get('admin_role') or "unknown",
-                    "message": row.get('message') or "",
-                    "created_at": row.get('created_at')
-                })
-            else:
-                out.append({
-                    "id": row[0],
-                    "admin_role": row[1] or "unknown",
-                    "message": row[2] or "",
-                    "created_at": row[3]
-                })
+        out = [{
+            "id": row.id,
+            "admin_role": row.admin_role or "unknown",
+            "message": row.message or "",
+            "created_at": row.created_at
+        } for row in reversed(rows)]
         return jsonify(out)
     except Exception as e:
         print(f"[ERROR] Admin chat: {e}")
@@ -2733,18 +1772,9 @@ def admin_chat():
 @admin_required
 def get_system_settings():
     """Get system settings including verse refresh interval"""
+    from app import db_query, sql_in
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        
-        # Ensure settings table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        conn, db_type = get_db(readonly=True)
 
         defaults = {
             "verse_interval": "60",
@@ -2755,19 +1785,9 @@ def get_system_settings():
             "maintenance_mode": "0"
         }
 
-        placeholders = ",".join(["%s"] * len(defaults)) if db_type == 'postgres' else ",".join(["?"] * len(defaults))
-        c.execute(
-            f"SELECT key, value FROM system_settings WHERE key IN ({placeholders})",
-            tuple(defaults.keys())
-        )
-        rows = c.fetchall()
-        stored = {}
-        for row in rows:
-            row = _row_to_dict(row)
-            if hasattr(row, 'keys'):
-                stored[str(row.get('key'))] = str(row.get('value'))
-            else:
-                stored[str(row[0])] = str(row[1])
+        rows = db_query(conn, db_type, f"SELECT key, value FROM system_settings WHERE key IN ({sql_in(defaults)})",
+                        tuple(defaults))
+        stored = {str(row.key): str(row.value) for row in rows}
         conn.close()
 
         merged = {**defaults, **stored}
@@ -2799,20 +1819,19 @@ def update_system_settings():
     """Update system settings"""
     data = request.get_json() or {}
     
+    from app import db_execute
     try:
         conn, db_type = get_db()
-        c = conn.cursor()
-        
-        # Ensure settings table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
         
         updates = []
+        changes = {}
+
+        def save(key, value):
+            db_execute(conn, db_type, """
+                INSERT INTO system_settings (key, value, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
+            """, (key, str(value)))
 
         # Update verse_interval if provided
         if 'verse_interval' in data:
@@ -2822,88 +1841,36 @@ def update_system_settings():
                 conn.close()
                 return jsonify({"error": "Interval must be between 10 and 3600 seconds"}), 400
 
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('verse_interval', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET
-                        value = EXCLUDED.value,
-                        updated_at = EXCLUDED.updated_at
-                """, (str(interval),))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('verse_interval', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET
-                        value = excluded.value,
-                        updated_at = excluded.updated_at
-                """, (str(interval),))
+            save('verse_interval', interval)
             updates.append(f"verse_interval={interval}")
-            
-            # Update the running generator's interval
-            try:
-                from app import generator
-                generator.set_interval(interval)
-                print(f"[INFO] Updated generator interval to {interval} seconds")
-            except Exception as gen_err:
-                print(f"[WARN] Could not update generator interval: {gen_err}")
+            changes['verse_interval'] = interval
 
         if 'auto_refresh_seconds' in data:
             auto_refresh = int(data['auto_refresh_seconds'])
             if auto_refresh < 10 or auto_refresh > 300:
                 conn.close()
                 return jsonify({"error": "Auto refresh must be between 10 and 300 seconds"}), 400
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('auto_refresh_seconds', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-                """, (str(auto_refresh),))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('auto_refresh_seconds', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
-                """, (str(auto_refresh),))
+            save('auto_refresh_seconds', auto_refresh)
             updates.append(f"auto_refresh_seconds={auto_refresh}")
+            changes['auto_refresh_seconds'] = auto_refresh
 
         if 'audit_retention_days' in data:
             retention_days = int(data['audit_retention_days'])
             if retention_days < 7 or retention_days > 365:
                 conn.close()
                 return jsonify({"error": "Audit retention must be between 7 and 365 days"}), 400
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('audit_retention_days', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-                """, (str(retention_days),))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('audit_retention_days', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
-                """, (str(retention_days),))
+            save('audit_retention_days', retention_days)
             updates.append(f"audit_retention_days={retention_days}")
+            changes['audit_retention_days'] = retention_days
 
         if 'safety_mode' in data:
             safety_mode = str(data['safety_mode']).strip().lower()
             if safety_mode not in ('strict', 'balanced', 'relaxed'):
                 conn.close()
                 return jsonify({"error": "Safety mode must be strict, balanced, or relaxed"}), 400
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('safety_mode', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-                """, (safety_mode,))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('safety_mode', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
-                """, (safety_mode,))
+            save('safety_mode', safety_mode)
             updates.append(f"safety_mode={safety_mode}")
+            changes['safety_mode'] = safety_mode
 
         if 'show_user_persona' in data:
             raw_persona = data['show_user_persona']
@@ -2911,19 +1878,9 @@ def update_system_settings():
                 show_user_persona = 1 if raw_persona.strip().lower() in ('1', 'true', 'yes', 'on') else 0
             else:
                 show_user_persona = 1 if bool(raw_persona) else 0
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('show_user_persona', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-                """, (str(show_user_persona),))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('show_user_persona', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
-                """, (str(show_user_persona),))
+            save('show_user_persona', show_user_persona)
             updates.append(f"show_user_persona={show_user_persona}")
+            changes['show_user_persona'] = show_user_persona
 
         if 'maintenance_mode' in data:
             raw_maintenance = data['maintenance_mode']
@@ -2931,32 +1888,33 @@ def update_system_settings():
                 maintenance_mode = 1 if raw_maintenance.strip().lower() in ('1', 'true', 'yes', 'on') else 0
             else:
                 maintenance_mode = 1 if bool(raw_maintenance) else 0
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('maintenance_mode', %s, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-                """, (str(maintenance_mode),))
-            else:
-                c.execute("""
-                    INSERT INTO system_settings (key, value, updated_at)
-                    VALUES ('maintenance_mode', ?, CURRENT_TIMESTAMP)
-                    ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
-                """, (str(maintenance_mode),))
+            save('maintenance_mode', maintenance_mode)
             updates.append(f"maintenance_mode={maintenance_mode}")
+            changes['maintenance_mode'] = maintenance_mode
 
+        conn.commit()
+        conn.close()
+        if 'verse_interval' in changes:
+            # Update the running generator's interval; publishing it takes its own connection.
+            try:
+                from app import generator
+                generator.set_interval(changes['verse_interval'])
+                print(f"[INFO] Updated generator interval to {changes['verse_interval']} seconds")
+            except Exception as gen_err:
+                print(f"[WARN] Could not update generator interval: {gen_err}")
+        if changes:
+            from app import system_settings_changed
+            system_settings_changed(changes)
+        audited = True
         if updates:
-            log_action(
+            audited = log_action(
                 "UPDATE_SETTINGS",
                 "Updated system settings: " + ", ".join(updates),
                 status="success",
                 extras={"updated_keys": updates, "module": "settings"}
             )
-
-        conn.commit()
-        conn.close()
         
-        return jsonify({"success": True})
+        return jsonify({"success": True, "audit_logged": audited})
     except Exception as e:
         print(f"[ERROR] Update system settings: {e}")
         return jsonify({"error": str(e)}), 500
@@ -1,4 +1,6 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, send_from_directory, flash, render_template_string
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for, session, send_from_directory, flash, render_template_string
+from flask.json.provider import DefaultJSONProvider
+from flask.sessions import SecureCookieSessionInterface
 import sqlite3
 import time
 import threading
@@ -9,11 +11,36 @@ import secrets
 import json
 import random
 import logging
+import math
+import atexit
+import click
+import calendar
+import csv
+import mmap
+import socket
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait as wait_futures
+from contextlib import contextmanager
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 import hashlib
-from functools import wraps
-from urllib.parse import quote
+from functools import lru_cache, partial, wraps
+from itertools import accumulate
+from json.encoder import encode_basestring_ascii as _json_str
+from operator import itemgetter
+try:
+    from _collections import _tuplegetter  # what namedtuple uses for field access
+except ImportError:
+    def _tuplegetter(index, doc):
+        return property(itemgetter(index), doc=doc)
+from urllib.parse import quote, urlsplit
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: event spill files are not shared between processes there
 
 # Load environment variables from .env file (for local development)
 try:
@@ -26,12 +53,24 @@ except ImportError:
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Heartbeat endpoints polled by every open tab; re-signing the session cookie
+# on each of them buys nothing, so they only send it when the session changed.
+SESSION_QUIET_ENDPOINTS = {'presence_ping', 'presence_online', 'current_stream'}
+
+class QuietSessionInterface(SecureCookieSessionInterface):
+    def should_set_cookie(self, app, session):
+        if request.endpoint in SESSION_QUIET_ENDPOINTS and not session.modified:
+            return False
+        return super().should_set_cookie(app, session)
+
 app = Flask(__name__)
 app.permanent_session_lifetime = timedelta(days=30)
+app.session_interface = QuietSessionInterface()
 
 @app.before_request
 def make_session_permanent():
-    session.permanent = True
+    if not session.permanent:
+        session.permanent = True
 
 # Configuration
 app.secret_key = os.environ.get('SECRET_KEY', 'eK8#mP2$vL9@nQ4&wX5*fJ7!hR3(tY6)bU1$cI0~pO8+lA2=zS9')
@@ -147,11 +186,8 @@ if RENDER_ENV and FORCE_SQLITE:
 if RENDER_ENV and not IS_POSTGRES:
     raise RuntimeError("Postgres DATABASE_URL is required in production (Render).")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SQLITE_PATH = os.path.join(BASE_DIR, 'bible_ios.db')
-BOOK_TEXT_CACHE = {}
+SQLITE_PATH = os.environ.get('SQLITE_PATH') or os.path.join(BASE_DIR, 'bible_ios.db')
 BOOK_META_CACHE = {}
-BAN_SCHEMA_READY = False
-RESTRICTION_SCHEMA_READY = False
 
 FALLBACK_BOOKS = [
     {"id": "GEN", "name": "Genesis"},
@@ -231,63 +267,933 @@ def get_public_url():
     except Exception:
         return PUBLIC_URL.rstrip('/')
 
-def get_db():
-    """Get database connection - PostgreSQL for Render, SQLite for local"""
+# Size the pool with the gthread count: every thread not parked on an SSE stream
+# (threads - SSE_MAX_STREAMS) may check out a connection, plus the background
+# writers (events, presence, generator). render.yaml sets the three together.
+DB_POOL_MIN_SIZE = max(0, int(os.environ.get('DB_POOL_MIN_SIZE', '1')))
+DB_POOL_MAX_SIZE = max(1, int(os.environ.get('DB_POOL_MAX_SIZE', '10')))
+DB_POOL_TIMEOUT = max(0.1, float(os.environ.get('DB_POOL_TIMEOUT', '10')))
+DB_POOL_MAX_LIFETIME = max(30.0, float(os.environ.get('DB_POOL_MAX_LIFETIME', '1800')))
+DB_POOL_MAX_IDLE = max(5.0, float(os.environ.get('DB_POOL_MAX_IDLE', '300')))
+DB_POOL_HEALTHCHECK_AFTER = max(0.0, float(os.environ.get('DB_POOL_HEALTHCHECK_AFTER', '30')))
+SQLITE_CONNECTIONS_PER_THREAD = max(1, int(os.environ.get('SQLITE_CONNECTIONS_PER_THREAD', '2')))
+SQLITE_WAL = os.environ.get('SQLITE_WAL', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+SQLITE_BUSY_TIMEOUT = max(1.0, float(os.environ.get('SQLITE_BUSY_TIMEOUT', '20')))
+SQLITE_CACHE_SIZE_KB = max(2000, int(os.environ.get('SQLITE_CACHE_SIZE_KB', '16384')))
+SQLITE_MMAP_SIZE = max(0, int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))))
+SQLITE_MAINTENANCE_INTERVAL = max(30.0, float(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', '300')))
+SQLITE_STATEMENT_CACHE = max(16, int(os.environ.get('SQLITE_STATEMENT_CACHE', '256')))
+# Postgres statements are PREPAREd server-side once a pooled connection has run them this
+# many times (0 disables); DB_PREPARED_MAX caps the prepared statements per connection and
+# DB_STATEMENT_TRACK_MAX the not-yet-prepared statements whose uses are being counted.
+DB_PREPARE_THRESHOLD = max(0, int(os.environ.get('DB_PREPARE_THRESHOLD', '3')))
+DB_PREPARED_MAX = max(1, int(os.environ.get('DB_PREPARED_MAX', '256')))
+DB_STATEMENT_TRACK_MAX = max(16, int(os.environ.get('DB_STATEMENT_TRACK_MAX', '1024')))
+
+class DatabasePoolTimeout(RuntimeError):
+    """Raised when no pooled connection frees up within DB_POOL_TIMEOUT."""
+
+class PooledConnection:
+    """Connection proxy whose close() hands the connection back to its pool.
+
+    Existing call sites keep using conn.cursor()/commit()/close(); closing
+    twice is harmless, which matches the defensive close patterns in handlers.
+    A proxy dropped without close() hands its connection to reclaim (if
+    given) when it is garbage collected, so a missed close costs a log line
+    rather than a pool slot.
+    """
+    __slots__ = ('_conn', '_release', '_reclaim')
+
+    def __init__(self, conn, release, reclaim=None):
+        self._conn = conn
+        self._release = release
+        self._reclaim = reclaim
+
+    def __getattr__(self, name):
+        conn = self._conn
+        if conn is None:
+            raise RuntimeError("Connection already returned to the pool")
+        return getattr(conn, name)
+
+    @property
+    def raw(self):
+        return self._conn
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._release(conn)
+
+    def __del__(self):
+        conn, self._conn = getattr(self, '_conn', None), None
+        if conn is not None and self._reclaim is not None:
+            try:
+                self._reclaim(conn)
+            except Exception:
+                pass
+
+class PostgresConnectionPool:
+    """Thread-safe Postgres pool with lifetime recycling and checkout health checks."""
+
+    def __init__(self, dsn, min_size=1, max_size=10, timeout=10.0, max_lifetime=1800.0,
+                 max_idle=300.0, healthcheck_after=30.0):
+        self.dsn = dsn
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.healthcheck_after = healthcheck_after
+        self._cond = threading.Condition()
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._born = {}       # id(conn) -> created_at for checked-out connections
+        self._size = 0
+        self._pid = os.getpid()
+        self._waits = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._leaked = 0
+
+    def _connect(self):
+        import psycopg2
+        conn = psycopg2.connect(self.dsn, sslmode='require', connection_factory=_pg_connection_class())
+        self._created += 1
+        return conn
+
+    def _check_fork(self):
+        # Connections inherited from a pre-fork master must not be shared.
+        if self._pid != os.getpid():
+            self._idle.clear()
+            self._born.clear()
+            self._size = 0
+            self._pid = os.getpid()
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        with self._cond:
+            self._born.pop(id(conn), None)
+            self._size = max(0, self._size - 1)
+            self._discarded += 1
+            self._cond.notify()
+
+    def _is_usable(self, conn, created_at, last_used, now):
+        if getattr(conn, 'closed', 1):
+            return False
+        if now - created_at > self.max_lifetime:
+            return False
+        if now - last_used > self.healthcheck_after:
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.fetchone()
+                cur.close()
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                self._check_fork()
+                while True:
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        create = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise DatabasePoolTimeout(
+                            f"No database connection available within {self.timeout:.1f}s "
+                            f"(pool max {self.max_size})"
+                        )
+                    self._waits += 1
+                    self._cond.wait(remaining)
+
+            if create:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size = max(0, self._size - 1)
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+            else:
+                conn, created_at, last_used = entry
+                if not self._is_usable(conn, created_at, last_used, time.monotonic()):
+                    self._discard(conn)
+                    continue
+            with self._cond:
+                self._born[id(conn)] = created_at
+            return conn
+
+    def release(self, conn):
+        with self._cond:
+            if self._pid != os.getpid():
+                return
+            created_at = self._born.pop(id(conn), None)
+        if created_at is None:
+            self._close_quietly(conn)
+            return
+        try:
+            if conn.closed:
+                raise RuntimeError("connection closed")
+            import psycopg2.extensions
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except Exception:
+            with self._cond:
+                self._born[id(conn)] = created_at
+            self._discard(conn)
+            return
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            with self._cond:
+                self._born[id(conn)] = created_at
+            self._discard(conn)
+            return
+        stale = []
+        with self._cond:
+            self._idle.append((conn, created_at, now))
+            # Trim connections that sat idle too long, but keep min_size warm.
+            while len(self._idle) > self.min_size and now - self._idle[0][2] > self.max_idle:
+                stale.append(self._idle.popleft()[0])
+                self._size = max(0, self._size - 1)
+                self._discarded += 1
+            self._cond.notify()
+        for old in stale:
+            self._close_quietly(old)
+
+    def reclaim(self, conn):
+        """Release a connection whose proxy was garbage collected without close()."""
+        with self._cond:
+            self._leaked += 1
+        logger.warning("Reclaimed a pooled connection that was never closed")
+        self.release(conn)
+
+    def warm(self):
+        """Open connections up to min_size so the first requests skip the handshake."""
+        with self._cond:
+            missing = self.min_size - self._size
+        conns = []
+        try:
+            for _ in range(max(0, missing)):
+                conns.append(self.acquire())
+        finally:
+            for conn in conns:
+                self.release(conn)
+
+    def close_all(self):
+        with self._cond:
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+            self._size = max(0, self._size - len(idle))
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "backend": "postgres",
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._born),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self._created,
+                "discarded": self._discarded,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "leaked": self._leaked
+            }
+
+class SQLiteConnectionCache:
+    """Per-thread reuse of tuned SQLite connections.
+
+    sqlite3 connections are bound to the thread that opened them, so each
+    thread keeps a short free list per mode. Nested get_db() calls in one
+    thread get a separate connection instead of sharing an open transaction.
+    Read-only connections are opened with mode=ro and query_only so GET
+    handlers never take the write lock.
+    """
+
+    def __init__(self, path, per_thread=2, timeout=20):
+        self.path = path
+        self.per_thread = per_thread
+        self.timeout = timeout
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._opened_readonly = 0
+        self._reused = 0
+        self._journal_mode = None
+        self._maintenance_thread = None
+        self._last_checkpoint = None
+        self._last_maintenance_error = None
+
+    def _free_list(self, readonly=False):
+        attr = 'free_ro' if readonly else 'free'
+        free = getattr(self._local, attr, None)
+        if free is None:
+            free = []
+            setattr(self._local, attr, free)
+        return free
+
+    def _configure(self, conn, readonly):
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        if readonly:
+            conn.execute("PRAGMA query_only = 1")
+
+    def _ensure_journal_mode(self, conn):
+        # journal_mode is persistent in the file; set it once per process from a writer.
+        if self._journal_mode is not None:
+            return
+        with self._lock:
+            if self._journal_mode is not None:
+                return
+            mode = 'wal' if SQLITE_WAL else 'delete'
+            row = conn.execute(f"PRAGMA journal_mode = {mode}").fetchone()
+            self._journal_mode = str(row[0]).lower() if row else mode
+            if self._journal_mode != mode:
+                logger.warning(f"SQLite journal_mode is {self._journal_mode}, wanted {mode}")
+
+    def _connect(self, readonly=False):
+        if readonly:
+            if self._journal_mode is None:
+                self.release(self.acquire())
+            try:
+                conn = sqlite3.connect(f"file:{quote(self.path)}?mode=ro", timeout=self.timeout,
+                                       uri=True, cached_statements=SQLITE_STATEMENT_CACHE)
+            except sqlite3.OperationalError:
+                # File not created yet (or not readable as a URI); a normal connection still works.
+                conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                       cached_statements=SQLITE_STATEMENT_CACHE)
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, cached_statements=SQLITE_STATEMENT_CACHE)
+            self._ensure_journal_mode(conn)
+        self._configure(conn, readonly)
+        with self._lock:
+            if readonly:
+                self._opened_readonly += 1
+            else:
+                self._opened += 1
+        return conn
+
+    def acquire(self, readonly=False):
+        free = self._free_list(readonly)
+        if free:
+            with self._lock:
+                self._reused += 1
+            return free.pop()
+        return self._connect(readonly)
+
+    def release(self, conn, readonly=False):
+        free = self._free_list(readonly)
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            try:
+                conn.close()
+            except Exception:
+                pass
+            return
+        if len(free) >= self.per_thread:
+            conn.close()
+            return
+        free.append(conn)
+
+    def run_maintenance(self):
+        """Checkpoint the WAL without blocking writers and refresh planner stats."""
+        conn = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            row = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            conn.execute("PRAGMA optimize")
+            self._last_checkpoint = {
+                "at": utc_now().isoformat(),
+                "busy": row[0] if row else None,
+                "wal_pages": row[1] if row else None,
+                "checkpointed": row[2] if row else None
+            }
+        finally:
+            conn.close()
+
+    def _maintenance_loop(self):
+        while True:
+            time.sleep(SQLITE_MAINTENANCE_INTERVAL)
+            try:
+                self.run_maintenance()
+                self._last_maintenance_error = None
+            except Exception as e:
+                self._last_maintenance_error = str(e)
+                logger.warning(f"SQLite maintenance failed: {e}")
+
+    def start_maintenance(self):
+        if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+            return
+        with self._lock:
+            if self._maintenance_thread is not None and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(target=self._maintenance_loop, daemon=True)
+            self._maintenance_thread.start()
+
+    def close_all(self):
+        for attr in ('free', 'free_ro'):
+            free = getattr(self._local, attr, None) or []
+            while free:
+                try:
+                    free.pop().close()
+                except Exception:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "sqlite",
+                "journal_mode": self._journal_mode,
+                "opened": self._opened,
+                "opened_readonly": self._opened_readonly,
+                "reused": self._reused,
+                "per_thread": self.per_thread,
+                "last_checkpoint": self._last_checkpoint,
+                "last_maintenance_error": self._last_maintenance_error
+            }
+
+_pg_pool = None
+_pg_pool_lock = threading.Lock()
+_sqlite_cache = SQLiteConnectionCache(SQLITE_PATH, per_thread=SQLITE_CONNECTIONS_PER_THREAD,
+                                      timeout=SQLITE_BUSY_TIMEOUT)
+
+def _get_pg_pool():
+    global _pg_pool
+    if _pg_pool is None:
+        with _pg_pool_lock:
+            if _pg_pool is None:
+                _pg_pool = PostgresConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    healthcheck_after=DB_POOL_HEALTHCHECK_AFTER
+                )
+                try:
+                    _pg_pool.warm()
+                except DatabasePoolTimeout:
+                    pass
+    return _pg_pool
+
+def _sqlite_connection(readonly=False):
+    _sqlite_cache.start_maintenance()
+    conn = _sqlite_cache.acquire(readonly)
+    return PooledConnection(conn, partial(_sqlite_cache.release, readonly=readonly)), 'sqlite'
+
+def get_db(readonly=False):
+    """Get a pooled database connection - PostgreSQL for Render, SQLite for local.
+
+    conn.close() returns the connection to the pool rather than closing it.
+    readonly=True hands SQLite callers a query_only connection; handlers that
+    never write should ask for one.
+    """
     global POSTGRES_AVAILABLE
     if FORCE_SQLITE:
-        conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-        conn.row_factory = sqlite3.Row
-        return conn, 'sqlite'
+        return _sqlite_connection(readonly)
     if FORCE_POSTGRES and not IS_POSTGRES:
         raise RuntimeError("DB_MODE=postgres but DATABASE_URL is not set to a postgres URL")
     if IS_POSTGRES and POSTGRES_AVAILABLE:
         try:
-            import psycopg2
-            import psycopg2.extras
-            conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-            return conn, 'postgres'
+            pool = _get_pg_pool()
+            return PooledConnection(pool.acquire(), pool.release, pool.reclaim), 'postgres'
         except ImportError:
             if STRICT_DB or RENDER_ENV:
                 logger.error("psycopg2 not installed and strict DB mode enabled")
                 raise
             logger.warning("psycopg2 not installed, falling back to SQLite")
-            conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-            conn.row_factory = sqlite3.Row
-            return conn, 'sqlite'
+            return _sqlite_connection(readonly)
+        except DatabasePoolTimeout:
+            logger.error("PostgreSQL pool exhausted")
+            raise
         except Exception as e:
             logger.error(f"PostgreSQL connection failed: {e}")
             if STRICT_DB or RENDER_ENV:
                 raise
             POSTGRES_AVAILABLE = False
             # Fallback to SQLite if Postgres fails
-            conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-            conn.row_factory = sqlite3.Row
-            return conn, 'sqlite'
+            return _sqlite_connection(readonly)
     else:
-        conn = sqlite3.connect(SQLITE_PATH, timeout=20)
-        conn.row_factory = sqlite3.Row
-        return conn, 'sqlite'
+        return _sqlite_connection(readonly)
+
+@contextmanager
+def db_connection(readonly=False):
+    """Context manager around get_db(): yields (conn, db_type), rolls back on error, always releases."""
+    conn, db_type = get_db(readonly)
+    try:
+        yield conn, db_type
+    except Exception:
+        try:
+            conn.rollback()
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
 
-def get_cursor(conn, db_type):
-    """Get cursor with dict access"""
+def get_db_pool_stats():
+    if _pg_pool is not None:
+        return _pg_pool.stats()
+    return _sqlite_cache.stats()
+
+def _close_db_pools():
+    if _pg_pool is not None:
+        _pg_pool.close_all()
+    _sqlite_cache.close_all()
+
+atexit.register(_close_db_pools)
+
+# Dialect-neutral query layer: SQL is written once with '?' placeholders and
+# rewritten per dialect (cached), Postgres statements are prepared server-side
+# after repeated use, and every row comes back as the same lightweight Row.
+
+class Row(tuple):
+    """Result row usable as row[0], row['column'], row.column or row.get('column') on both backends.
+
+    Each result shape gets its own slot-less subclass (see _row_class), built
+    straight by the row cursors below, so a row costs one tuple allocation.
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._index[key])
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        idx = self._index.get(key)
+        return default if idx is None else tuple.__getitem__(self, idx)
+
+    def keys(self):
+        return list(self._fields)
+
+    def as_dict(self):
+        return dict(zip(self._fields, self))
+
+@lru_cache(maxsize=512)
+def _row_class(fields):
+    index = {}
+    for i, name in enumerate(fields):
+        index.setdefault(name, i)
+    namespace = {'__slots__': (), '_fields': fields, '_index': index}
+    for name, i in index.items():
+        if not name.isidentifier() or hasattr(Row, name):
+            # Postgres names an unaliased COUNT(*) "count"; row.count stays
+            # tuple.count, so such columns are reachable as row['count'] only.
+            continue
+        namespace[name] = _tuplegetter(i, name)
+    cls = type('Row', (Row,), namespace)
+    new = tuple.__new__
+    cls._from_sqlite = staticmethod(lambda cursor, values: new(cls, values))
+    return cls
+
+def _description_class(description):
+    return _row_class(tuple(d[0] for d in description)) if description else None
+
+class SQLiteRowCursor(sqlite3.Cursor):
+    """sqlite3 cursor whose rows come back as the shape's Row class."""
+
+    def execute(self, sql, parameters=()):
+        self.row_factory = None
+        super().execute(sql, parameters)
+        cls = _description_class(self.description)
+        if cls is not None:
+            self.row_factory = cls._from_sqlite
+        return self
+
+_pg_row_cursor_cls = None
+
+def _pg_row_cursor_class():
+    """psycopg2 cursor factory returning Row instances instead of tuples."""
+    global _pg_row_cursor_cls
+    if _pg_row_cursor_cls is None:
+        import psycopg2.extensions
+
+        class PostgresRowCursor(psycopg2.extensions.cursor):
+            def _wrap(self, rows):
+                cls = _description_class(self.description)
+                new = tuple.__new__
+                return [new(cls, r) for r in rows]
+
+            def fetchone(self):
+                row = super().fetchone()
+                return None if row is None else tuple.__new__(_description_class(self.description), row)
+
+            def fetchmany(self, size=None):
+                return self._wrap(super().fetchmany(self.arraysize if size is None else size))
+
+            def fetchall(self):
+                return self._wrap(super().fetchall())
+
+            def __iter__(self):
+                cls = _description_class(self.description)
+                for row in super().__iter__():
+                    yield tuple.__new__(cls, row)
+
+        _pg_row_cursor_cls = PostgresRowCursor
+    return _pg_row_cursor_cls
+
+def row_cursor(target, db_type):
+    """Cursor on target's connection that yields Row objects (see db_execute)."""
+    conn = _raw_connection(target)
+    if db_type == 'postgres':
+        return conn.cursor(cursor_factory=_pg_row_cursor_class())
+    return conn.cursor(SQLiteRowCursor)
+
+@lru_cache(maxsize=1024)
+def _translate_sql(sql, style):
+    """Rewrite '?' placeholders (outside string literals) for a paramstyle.
+
+    'qmark' leaves SQLite SQL untouched, 'format' yields psycopg2's %s (escaping
+    literal %), 'numeric' yields $1..$n for PREPARE.
+    """
+    if style == 'qmark':
+        return sql
+    out = []
+    quote_char = None
+    n = 0
+    for ch in sql:
+        if quote_char:
+            if ch == quote_char:
+                quote_char = None
+        elif ch in ("'", '"'):
+            quote_char = ch
+        elif ch == '?':
+            n += 1
+            out.append('%s' if style == 'format' else f'${n}')
+            continue
+        if ch == '%' and style == 'format':
+            out.append('%%')
+            continue
+        out.append(ch)
+    return ''.join(out)
+
+_PREPARABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+_VARIADIC_IN = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)+\s*\)', re.I)
+
+@lru_cache(maxsize=1024)
+def _is_variadic(sql):
+    """True for SQL with a sql_in() list: its text changes with the list length, so it is not worth preparing."""
+    return _VARIADIC_IN.search(sql) is not None
+_pg_connection_cls = None
+
+def _pg_connection_class():
+    """psycopg2 connection subclass that tracks its server-side prepared statements."""
+    global _pg_connection_cls
+    if _pg_connection_cls is None:
+        import psycopg2.extensions
+
+        class PreparingConnection(psycopg2.extensions.connection):
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.prepared = {}   # sql -> statement name, or False if it cannot be prepared
+                self.statement_uses = OrderedDict()   # LRU, capped at DB_STATEMENT_TRACK_MAX
+                self.prepare_count = 0
+                self.stale_statements = []   # names whose EXECUTE failed, deallocated once usable
+
+        _pg_connection_cls = PreparingConnection
+    return _pg_connection_cls
+
+def _run_guarded(cur, sql):
+    """Run sql under a savepoint so a failure leaves the caller's transaction usable; False if it failed."""
+    try:
+        cur.execute("SAVEPOINT bq_prepare")
+    except Exception as e:
+        logger.debug(f"Savepoint unavailable: {e}")
+        return False
+    try:
+        cur.execute(sql)
+        cur.execute("RELEASE SAVEPOINT bq_prepare")
+        return True
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT bq_prepare")
+        logger.debug(f"{sql.split(' ', 1)[0]} failed: {e}")
+        return False
+
+def _forget_prepared(conn, sql, name):
+    """Drop a statement whose EXECUTE failed (e.g. 'cached plan must not change result type' after
+    a migration); it is deallocated on the next statement and prepared afresh if it stays hot."""
+    conn.prepared.pop(sql, None)
+    conn.stale_statements.append(name)
+
+def _prepared_name(conn, cur, sql):
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None or not DB_PREPARE_THRESHOLD:
+        return None
+    import psycopg2.extensions
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        # The caller's statement will fail on its own; a savepoint here would only mask why.
+        return None
+    while conn.stale_statements:
+        _run_guarded(cur, f"DEALLOCATE {conn.stale_statements.pop()}")
+    name = prepared.get(sql)
+    if name is not None:
+        return name or None
+    if len(prepared) >= DB_PREPARED_MAX or _is_variadic(sql):
+        return None
+    statement_uses = conn.statement_uses
+    uses = statement_uses.pop(sql, 0) + 1
+    if uses < DB_PREPARE_THRESHOLD:
+        statement_uses[sql] = uses
+        if len(statement_uses) > DB_STATEMENT_TRACK_MAX:
+            statement_uses.popitem(last=False)
+        return None
+    if not sql.lstrip().upper().startswith(_PREPARABLE):
+        prepared[sql] = False
+        return None
+    conn.prepare_count += 1
+    name = f"bq{conn.prepare_count}"
+    # A statement Postgres cannot type (e.g. a bare parameter) must not abort the
+    # caller's transaction, so the PREPARE runs under a savepoint.
+    if not _run_guarded(cur, f"PREPARE {name} AS {_translate_sql(sql, 'numeric')}"):
+        prepared[sql] = False
+        return None
+    prepared[sql] = name
+    return name
+
+def _raw_connection(target):
+    if isinstance(target, PooledConnection):
+        return target.raw
+    if isinstance(target, sqlite3.Cursor) or not hasattr(target, 'commit'):
+        return target.connection
+    return target
+
+def db_execute(target, db_type, sql, params=()):
+    """Run one statement written with '?' placeholders; returns a row_cursor.
+
+    target is a connection or any cursor on it (handlers usually have both).
+    """
+    conn = _raw_connection(target)
+    params = tuple(params) if params else ()
+    cur = row_cursor(conn, db_type)
     if db_type == 'postgres':
-        import psycopg2.extras
-        return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        name = _prepared_name(conn, cur, sql)
+        if name:
+            try:
+                if params:
+                    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+                else:
+                    cur.execute(f"EXECUTE {name}")
+            except Exception:
+                _forget_prepared(conn, sql, name)
+                raise
+            return cur
+        if params:
+            cur.execute(_translate_sql(sql, 'format'), params)
+        else:
+            # Without arguments psycopg2 does no %-interpolation, so the SQL goes out verbatim.
+            cur.execute(sql)
     else:
-        return conn.cursor()
+        cur.execute(sql, params)
+    return cur
 
-def row_value(row, key, default=None):
-    """Safely read a key from dict-like or sqlite3.Row results."""
-    try:
-        if isinstance(row, dict):
-            return row.get(key, default)
-        if hasattr(row, 'keys'):
-            keys = row.keys()
-            if key in keys:
-                return row[key]
-    except Exception:
-        pass
-    return default
+def db_query(target, db_type, sql, params=()):
+    return db_execute(target, db_type, sql, params).fetchall()
+
+def db_query_one(target, db_type, sql, params=()):
+    return db_execute(target, db_type, sql, params).fetchone()
+
+def db_scalar(target, db_type, sql, params=(), default=None):
+    row = db_execute(target, db_type, sql, params).fetchone()
+    if row is None or row[0] is None:
+        return default
+    return row[0]
+
+def db_insert(target, db_type, sql, params=()):
+    """Run an INSERT and return the new row's id (RETURNING on Postgres, lastrowid on SQLite)."""
+    if db_type == 'postgres':
+        return db_execute(target, db_type, sql + " RETURNING id", params).fetchone()[0]
+    return db_execute(target, db_type, sql, params).lastrowid
+
+def sql_like(db_type):
+    """Case-insensitive LIKE operator (SQLite's LIKE already ignores ASCII case)."""
+    return 'ILIKE' if db_type == 'postgres' else 'LIKE'
+
+def sql_in(values):
+    """Placeholder list for an IN (...) clause: sql_in([1, 2]) -> '?, ?'."""
+    return ', '.join('?' * len(values))
+
+def sql_date(db_type, column):
+    """Calendar-day expression for a TIMESTAMP_COLUMNS column (both dialects yield YYYY-MM-DD)."""
+    if db_type == 'postgres':
+        return f"CAST({column} AS DATE)"
+    return f"date({column})"
+
+def sql_epoch(db_type, column):
+    """Whole seconds since 1970 for a TIMESTAMP_COLUMNS column, matching epoch_seconds()."""
+    if db_type == 'postgres':
+        return f"CAST(FLOOR(EXTRACT(EPOCH FROM {column})) AS BIGINT)"
+    return f"CAST(strftime('%s', {column}) AS INTEGER)"
+
+def utc_now():
+    """Current time as naive UTC, the form every stored timestamp and every cutoff uses.
+
+    Naive so isoformat() text matches the TIMESTAMP (without time zone) columns
+    on Postgres and the normalized ISO-8601 TEXT on SQLite, whatever the host TZ.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def epoch_seconds(dt):
+    # Both dialects read a naive stored time as UTC; do the same so buckets line up.
+    return calendar.timegm(dt.timetuple())
+
+def minute_key(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M')
+
+# Response records: fixed-shape, slotted objects for hot list endpoints. They
+# replace per-row dicts and are written to JSON directly by RecordJSONProvider.
+
+class Record:
+    """Base for record_type() classes; supports rec.field, rec['field'] and rec.get('field')."""
+    __slots__ = ()
+    _fields = ()
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def keys(self):
+        return list(self._fields)
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self._fields}
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self._fields)
+        return f"{type(self).__name__}({values})"
+
+@lru_cache(maxsize=None)
+def record_type(name, fields):
+    """namedtuple-style factory: a slotted class with a generated __init__ and JSON encoder.
+
+    Keys are encoded in sorted order, matching Flask's sort_keys output.
+    """
+    fields = tuple(fields)
+    args = ', '.join(fields)
+    body = '\n'.join(f"    self.{f} = {f}" for f in fields) or '    pass'
+    lines = []
+    parts = []
+    for i, f in enumerate(sorted(fields)):
+        key = ('{' if i == 0 else ',') + _json_str(f) + ':'
+        # Strings and nulls dominate these payloads; encode them inline.
+        lines.append(f"    v = self.{f}\n"
+                     f"    t = type(v)\n"
+                     f"    j{i} = _json_str(v) if t is str else ('null' if v is None else "
+                     f"(int.__repr__(v) if t is int else _json_value(v)))")
+        parts.append(f"{key!r} + j{i}")
+    encode = ' + '.join(parts) + " + '}'" if parts else "'{}'"
+    json_body = '\n'.join(lines + [f"    return {encode}"])
+    source = (f"def __init__(self, {args}):\n{body}\n"
+              f"def _json(self):\n{json_body}\n")
+    namespace = {'_json_value': _json_value, '_json_str': _json_str}
+    exec(source, namespace)
+    return type(name, (Record,), {
+        '__slots__': fields,
+        '_fields': fields,
+        '__init__': namespace['__init__'],
+        '_json': namespace['_json']
+    })
+
+_json_encoder = None
+
+def _record_json_default(o):
+    # Inside records, native Postgres timestamps go out in the ISO-8601 form SQLite stores.
+    if isinstance(o, (datetime, date)):
+        return o.isoformat()
+    return RecordJSONProvider.default(o)
+
+def _json_fallback(value):
+    global _json_encoder
+    if _json_encoder is None:
+        _json_encoder = json.JSONEncoder(default=_record_json_default, ensure_ascii=True, sort_keys=True,
+                                         separators=(',', ':'))
+    return _json_encoder.encode(value)
+
+def iso_timestamp(value):
+    """ISO-8601 text for a timestamp column value; TEXT (SQLite) values pass through unchanged."""
+    return value.isoformat() if isinstance(value, (datetime, date)) else value
+
+def _json_value(value):
+    """Compact JSON for one value, byte-identical to Flask's default provider output."""
+    t = type(value)
+    if t is str:
+        return _json_str(value)
+    if value is None:
+        return 'null'
+    if t is int:
+        return int.__repr__(value)
+    if t is bool:
+        return 'true' if value else 'false'
+    if isinstance(value, Record):
+        return value._json()
+    if t is list or isinstance(value, tuple):
+        return '[' + ','.join([_json_value(v) for v in value]) + ']'
+    if t is dict and _holds_records(value) and all(type(k) is str for k in value):
+        return '{' + ','.join([_json_str(k) + ':' + _json_value(value[k]) for k in sorted(value)]) + '}'
+    # Plain dicts (reaction counts, locations) and everything else go through the C encoder.
+    return _json_fallback(value)
+
+def _holds_records(obj):
+    if isinstance(obj, Record):
+        return True
+    if type(obj) is list:
+        return bool(obj) and isinstance(obj[0], Record)
+    if type(obj) is dict:
+        for v in obj.values():
+            if isinstance(v, Record) or (type(v) is list and v and isinstance(v[0], Record)):
+                return True
+    return False
+
+class RecordJSONProvider(DefaultJSONProvider):
+    """Default provider plus Record support; compact Record payloads skip json.dumps entirely.
+
+    Only Record fields get ISO-8601 timestamps; any other datetime keeps
+    Flask's default (HTTP date) wire format.
+    """
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return {name: iso_timestamp(value) for name, value in o.as_dict().items()}
+        return DefaultJSONProvider.default(o)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs == {'separators': (',', ':')} and self.ensure_ascii and self.sort_keys and _holds_records(obj):
+            return _json_value(obj)
+        return super().dumps(obj, **kwargs)
+
+app.json = RecordJSONProvider(app)
 
 def _redact_db_url(url):
     try:
@@ -300,503 +1206,935 @@ def _redact_db_url(url):
     except Exception:
         return ''
 
-def _list_tables(conn, db_type):
-    c = conn.cursor()
+def _list_tables(target, db_type):
     if db_type == 'postgres':
-        c.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
-        return [r[0] for r in c.fetchall()]
-    c.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    return [r[0] for r in c.fetchall()]
+        rows = db_query(target, db_type, "SELECT table_name FROM information_schema.tables WHERE table_schema = 'public'")
+    else:
+        rows = db_query(target, db_type, "SELECT name FROM sqlite_master WHERE type='table'")
+    return [r[0] for r in rows]
 
-def _table_columns(conn, db_type, table):
-    c = conn.cursor()
+def _table_columns(target, db_type, table):
     if db_type == 'postgres':
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name = %s", (table,))
-        return [r[0] for r in c.fetchall()]
-    c.execute(f"PRAGMA table_info({table})")
-    return [r[1] for r in c.fetchall()]
-
-def read_system_setting(key, default=None):
-    conn = None
-    try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        if db_type == 'postgres':
-            c.execute("SELECT value FROM system_settings WHERE key = %s", (key,))
-        else:
-            c.execute("SELECT value FROM system_settings WHERE key = ?", (key,))
-        row = c.fetchone()
-        conn.close()
-        if not row:
-            return default
-        if hasattr(row, 'keys'):
-            try:
-                val = row['value']
-            except Exception:
-                val = None
-            return default if val is None else val
-        return row[0] if row[0] is not None else default
-    except Exception:
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
-        return default
-
-def init_db():
-    """Initialize database tables"""
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
-    
-    try:
-        if db_type == 'postgres':
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS verses (
-                    id SERIAL PRIMARY KEY, reference TEXT, text TEXT, 
-                    translation TEXT, source TEXT, timestamp TEXT, book TEXT
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT, 
-                    name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0,
-                    is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user',
-                    custom_picture TEXT, avatar_decoration TEXT
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS likes (
-                    id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, 
-                    timestamp TEXT, UNIQUE(user_id, verse_id)
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS saves (
-                    id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER, 
-                    timestamp TEXT, UNIQUE(user_id, verse_id)
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS comments (
-                    id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER,
-                    text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS collections (
-                    id SERIAL PRIMARY KEY, user_id INTEGER, name TEXT, 
-                    color TEXT, created_at TEXT
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS verse_collections (
-                    id SERIAL PRIMARY KEY, collection_id INTEGER, verse_id INTEGER,
-                    UNIQUE(collection_id, verse_id)
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS community_messages (
-                    id SERIAL PRIMARY KEY, user_id INTEGER, text TEXT, 
-                    timestamp TEXT, google_name TEXT, google_picture TEXT
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS comment_reactions (
-                    id SERIAL PRIMARY KEY,
-                    item_type TEXT NOT NULL,
-                    item_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    reaction TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(item_type, item_id, user_id, reaction)
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS comment_replies (
-                    id SERIAL PRIMARY KEY,
-                    parent_type TEXT NOT NULL,
-                    parent_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    text TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    google_name TEXT,
-                    google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            ''')
-
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS daily_actions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    verse_id INTEGER,
-                    event_date TEXT NOT NULL,
-                    timestamp TEXT,
-                    UNIQUE(user_id, action, verse_id, event_date)
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id SERIAL PRIMARY KEY, admin_id TEXT,
-                    action TEXT, target_user_id INTEGER, details TEXT,
-                    ip_address TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS bans (
-                    id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE,
-                    reason TEXT, banned_by TEXT, banned_at TIMESTAMP,
-                    expires_at TIMESTAMP
-                )
-            ''')
-        else:
-            # SQLite tables
-            c.execute('''CREATE TABLE IF NOT EXISTS verses 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT, text TEXT, 
-                          translation TEXT, source TEXT, timestamp TEXT, book TEXT)''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS users 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT, 
-                          name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0,
-                          is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user',
-                          custom_picture TEXT, avatar_decoration TEXT)''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS likes 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, 
-                          timestamp TEXT, UNIQUE(user_id, verse_id))''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS saves 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER, 
-                          timestamp TEXT, UNIQUE(user_id, verse_id))''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS comments 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER,
-                          text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT,
-                          is_deleted INTEGER DEFAULT 0)''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS collections 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT, 
-                          color TEXT, created_at TEXT)''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS verse_collections 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, collection_id INTEGER, verse_id INTEGER,
-                          UNIQUE(collection_id, verse_id))''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS community_messages 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, text TEXT, 
-                          timestamp TEXT, google_name TEXT, google_picture TEXT)''')
-
-            c.execute('''CREATE TABLE IF NOT EXISTS comment_reactions
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, item_type TEXT NOT NULL, item_id INTEGER NOT NULL,
-                          user_id INTEGER NOT NULL, reaction TEXT NOT NULL, timestamp TEXT,
-                          UNIQUE(item_type, item_id, user_id, reaction))''')
-
-            c.execute('''CREATE TABLE IF NOT EXISTS comment_replies
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL,
-                          user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TEXT, google_name TEXT,
-                          google_picture TEXT, is_deleted INTEGER DEFAULT 0)''')
-
-            c.execute('''CREATE TABLE IF NOT EXISTS daily_actions
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL,
-                          verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT,
-                          UNIQUE(user_id, action, verse_id, event_date))''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS audit_logs 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, admin_id TEXT,
-                          action TEXT, target_user_id INTEGER, details TEXT,
-                          ip_address TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-            
-            c.execute('''CREATE TABLE IF NOT EXISTS bans 
-                         (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE,
-                          reason TEXT, banned_by TEXT, banned_at TIMESTAMP,
-                          expires_at TIMESTAMP)''')
-        
-        conn.commit()
-        logger.info(f"Database initialized ({db_type})")
-    except Exception as e:
-        logger.error(f"DB Init Error: {e}")
-    finally:
-        conn.close()
-
-def migrate_db():
-    """Run database migrations to add missing columns"""
-    conn, db_type = get_db()
-    c = conn.cursor()
-    
-    try:
-        logger.info(f"Running database migrations ({db_type})...")
-        
-        if db_type == 'postgres':
-            # Add is_deleted column to comments table
-            try:
-                c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-                logger.info("Added is_deleted column to comments")
-            except Exception as e:
-                logger.warning(f"is_deleted column may already exist: {e}")
-            
-            # Add ip_address column to audit_logs table
-            try:
-                c.execute("ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS ip_address TEXT")
-                logger.info("Added ip_address column to audit_logs")
-            except Exception as e:
-                logger.warning(f"ip_address column may already exist: {e}")
-                
-            # Add target_user_id column to audit_logs if missing
-            try:
-                c.execute("ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS target_user_id INTEGER")
-                logger.info("Added target_user_id column to audit_logs")
-            except Exception as e:
-                logger.warning(f"target_user_id column may already exist: {e}")
-            
-            # Create comment_restrictions table if not exists
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_restrictions (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER UNIQUE,
-                        reason TEXT,
-                        restricted_by TEXT,
-                        restricted_at TIMESTAMP,
-                        expires_at TIMESTAMP
-                    )
-                """)
-                logger.info("Created comment_restrictions table")
-            except Exception as e:
-                logger.warning(f"comment_restrictions table may already exist: {e}")
-
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_reactions (
-                        id SERIAL PRIMARY KEY,
-                        item_type TEXT NOT NULL,
-                        item_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        reaction TEXT NOT NULL,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        UNIQUE(item_type, item_id, user_id, reaction)
-                    )
-                """)
-                logger.info("Created comment_reactions table")
-            except Exception as e:
-                logger.warning(f"comment_reactions table may already exist: {e}")
-
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_replies (
-                        id SERIAL PRIMARY KEY,
-                        parent_type TEXT NOT NULL,
-                        parent_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        text TEXT NOT NULL,
-                        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        google_name TEXT,
-                        google_picture TEXT,
-                        is_deleted INTEGER DEFAULT 0
-                    )
-                """)
-                logger.info("Created comment_replies table")
-            except Exception as e:
-                logger.warning(f"comment_replies table may already exist: {e}")
-
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS daily_actions (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER NOT NULL,
-                        action TEXT NOT NULL,
-                        verse_id INTEGER,
-                        event_date TEXT NOT NULL,
-                        timestamp TEXT,
-                        UNIQUE(user_id, action, verse_id, event_date)
-                    )
-                """)
-                logger.info("Created daily_actions table")
-            except Exception as e:
-                logger.warning(f"daily_actions table may already exist: {e}")
-            try:
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS user_id INTEGER")
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS action TEXT")
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS verse_id INTEGER")
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS event_date TEXT")
-                c.execute("ALTER TABLE daily_actions ADD COLUMN IF NOT EXISTS timestamp TEXT")
-            except Exception:
-                pass
+        rows = db_query(target, db_type, "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = ?", (table,))
+        return [r[0] for r in rows]
+    return [r[1] for r in db_query(target, db_type, f"PRAGMA table_info({table})")]
+
+# Per-process caches stay coherent across workers through cache_versions: a
+# writer bumps the named counter after committing, and readers poll it at most
+# every CACHE_VERSION_POLL seconds instead of querying on each request.
+CACHE_VERSION_POLL = max(0.0, float(os.environ.get('CACHE_VERSION_POLL', '2.0')))
+
+class SharedVersion:
+    """This process's view of one cache_versions counter."""
+
+    def __init__(self, name, poll=CACHE_VERSION_POLL):
+        self.name = name
+        self.poll = poll
+        self.version = None
+        self.checked_at = float('-inf')
+        self.lock = threading.Lock()
 
+    def changed(self):
+        """True when the counter moved since the last poll; between polls this is a clock check."""
+        if time.monotonic() - self.checked_at < self.poll:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.checked_at < self.poll:
+                return False
+            self.checked_at = now
             try:
-                c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS custom_picture TEXT")
-                c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS avatar_decoration TEXT")
-            except Exception:
-                pass
-                
-        else:
-            # SQLite migrations
-            # Check if is_deleted column exists in comments
-            try:
-                c.execute("SELECT is_deleted FROM comments LIMIT 1")
-            except:
-                try:
-                    c.execute("ALTER TABLE comments ADD COLUMN is_deleted INTEGER DEFAULT 0")
-                    logger.info("Added is_deleted column to comments")
-                except Exception as e:
-                    logger.warning(f"Could not add is_deleted: {e}")
-            
-            # Check if ip_address column exists in audit_logs
-            try:
-                c.execute("SELECT ip_address FROM audit_logs LIMIT 1")
-            except:
-                try:
-                    c.execute("ALTER TABLE audit_logs ADD COLUMN ip_address TEXT")
-                    logger.info("Added ip_address column to audit_logs")
-                except Exception as e:
-                    logger.warning(f"Could not add ip_address: {e}")
-            
-            # Check if target_user_id column exists in audit_logs
-            try:
-                c.execute("SELECT target_user_id FROM audit_logs LIMIT 1")
-            except:
-                try:
-                    c.execute("ALTER TABLE audit_logs ADD COLUMN target_user_id INTEGER")
-                    logger.info("Added target_user_id column to audit_logs")
-                except Exception as e:
-                    logger.warning(f"Could not add target_user_id: {e}")
-            
-            # Create comment_restrictions table if not exists
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_restrictions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE,
-                        reason TEXT,
-                        restricted_by TEXT,
-                        restricted_at TIMESTAMP,
-                        expires_at TIMESTAMP
-                    )
-                """)
-                logger.info("Created comment_restrictions table")
+                with db_connection(readonly=True) as (conn, db_type):
+                    version = int(db_scalar(conn, db_type, "SELECT version FROM cache_versions WHERE name = ?",
+                                            (self.name,), 0))
             except Exception as e:
-                logger.warning(f"comment_restrictions table may already exist: {e}")
+                logger.warning(f"Cache version check failed for {self.name}: {e}")
+                return False
+            moved = self.version is not None and version != self.version
+            self.version = version
+            return moved
+
+    def bump(self):
+        """Tell other processes to drop their cached copies."""
+        try:
+            with db_connection() as (conn, db_type):
+                db_execute(conn, db_type, """
+                    INSERT INTO cache_versions (name, version) VALUES (?, 1)
+                    ON CONFLICT (name) DO UPDATE SET version = cache_versions.version + 1
+                """, (self.name,))
+                conn.commit()
+        except Exception as e:
+            logger.warning(f"Cache version bump failed for {self.name}: {e}")
 
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_reactions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        item_type TEXT NOT NULL,
-                        item_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        reaction TEXT NOT NULL,
-                        timestamp TEXT,
-                        UNIQUE(item_type, item_id, user_id, reaction)
-                    )
-                """)
-                logger.info("Created comment_reactions table")
-            except Exception as e:
-                logger.warning(f"comment_reactions table may already exist: {e}")
+SYSTEM_SETTINGS_TTL = max(1.0, float(os.environ.get('SYSTEM_SETTINGS_TTL', '30')))
 
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_replies (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        parent_type TEXT NOT NULL,
-                        parent_id INTEGER NOT NULL,
-                        user_id INTEGER NOT NULL,
-                        text TEXT NOT NULL,
-                        timestamp TEXT,
-                        google_name TEXT,
-                        google_picture TEXT,
-                        is_deleted INTEGER DEFAULT 0
-                    )
-                """)
-                logger.info("Created comment_replies table")
-            except Exception as e:
-                logger.warning(f"comment_replies table may already exist: {e}")
+class SystemSettingsCache:
+    """All of system_settings held in memory.
 
-            try:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS daily_actions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER NOT NULL,
-                        action TEXT NOT NULL,
-                        verse_id INTEGER,
-                        event_date TEXT NOT NULL,
-                        timestamp TEXT,
-                        UNIQUE(user_id, action, verse_id, event_date)
-                    )
-                """)
-                logger.info("Created daily_actions table")
-            except Exception as e:
-                logger.warning(f"daily_actions table may already exist: {e}")
-            try:
-                c.execute("PRAGMA table_info(daily_actions)")
-                cols = {str(r[1]).lower() for r in c.fetchall()}
-                if 'user_id' not in cols:
-                    c.execute("ALTER TABLE daily_actions ADD COLUMN user_id INTEGER")
-                if 'action' not in cols:
-                    c.execute("ALTER TABLE daily_actions ADD COLUMN action TEXT")
-                if 'verse_id' not in cols:
-                    c.execute("ALTER TABLE daily_actions ADD COLUMN verse_id INTEGER")
-                if 'event_date' not in cols:
-                    c.execute("ALTER TABLE daily_actions ADD COLUMN event_date TEXT")
-                if 'timestamp' not in cols:
-                    c.execute("ALTER TABLE daily_actions ADD COLUMN timestamp TEXT")
-            except Exception as e:
-                logger.warning(f"Could not migrate daily_actions columns: {e}")
+    The table is reloaded every SYSTEM_SETTINGS_TTL seconds or as soon as the
+    'system_settings' cache version moves; writers in this process apply
+    their changes directly through update().
+    """
 
+    def __init__(self, ttl=SYSTEM_SETTINGS_TTL):
+        self.ttl = ttl
+        self.values = None
+        self.loaded_at = float('-inf')
+        self.lock = threading.Lock()
+        self.version = SharedVersion('system_settings')
+
+    def get(self, key, default=None):
+        if self.version.changed():
+            self.invalidate()
+        values = self.values
+        if values is None or time.monotonic() - self.loaded_at >= self.ttl:
+            values = self._reload()
+        value = values.get(key)
+        return default if value is None else value
+
+    def _reload(self):
+        with self.lock:
+            if self.values is not None and time.monotonic() - self.loaded_at < self.ttl:
+                return self.values
             try:
-                c.execute("PRAGMA table_info(users)")
-                ucols = {str(r[1]).lower() for r in c.fetchall()}
-                if 'custom_picture' not in ucols:
-                    c.execute("ALTER TABLE users ADD COLUMN custom_picture TEXT")
-                if 'avatar_decoration' not in ucols:
-                    c.execute("ALTER TABLE users ADD COLUMN avatar_decoration TEXT")
+                with db_connection(readonly=True) as (conn, db_type):
+                    rows = db_query(conn, db_type, "SELECT key, value FROM system_settings")
+                self.values = {row.key: row.value for row in rows}
             except Exception as e:
-                logger.warning(f"Could not migrate user profile columns: {e}")
-        
-        conn.commit()
-        logger.info("Database migrations completed")
-    except Exception as e:
-        logger.error(f"Migration error: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        conn.close()
-
-init_db()
-migrate_db()
+                logger.warning(f"System settings reload failed: {e}")
+                if self.values is None:
+                    self.values = {}
+            # A failed reload keeps the last good values until the next TTL.
+            self.loaded_at = time.monotonic()
+            return self.values
+
+    def update(self, changes):
+        with self.lock:
+            values = dict(self.values or {})
+            values.update({key: str(value) for key, value in changes.items()})
+            self.values = values
+        self.version.bump()
 
-def get_challenge_period_key():
-    now = datetime.now().astimezone()
-    start = now.replace(minute=0, second=0, microsecond=0)
-    block_hour = (start.hour // 2) * 2
-    start = start.replace(hour=block_hour)
-    return start.strftime("%Y-%m-%d-%H")
+    def invalidate(self):
+        with self.lock:
+            self.loaded_at = float('-inf')
 
-def get_hour_window():
-    now = datetime.now().astimezone()
-    start = now.replace(minute=0, second=0, microsecond=0)
-    block_hour = (start.hour // 2) * 2
-    start = start.replace(hour=block_hour)
-    return start, start + timedelta(hours=2)
+_system_settings = SystemSettingsCache()
+
+def read_system_setting(key, default=None):
+    return _system_settings.get(key, default)
+
+def system_settings_changed(changes):
+    """Call after committing writes to system_settings: {key: new value}."""
+    _system_settings.update(changes)
+
+# Schema registry: every table the app or admin blueprint touches is defined
+# here once, per dialect. Handlers never run DDL; the versioned migrations
+# below apply these definitions and ensure_schema() runs them at startup.
+SCHEMA_TABLES = [
+    ('verses', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS verses (
+                id SERIAL PRIMARY KEY, reference TEXT, text TEXT,
+                translation TEXT, source TEXT, timestamp TEXT, book TEXT
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS verses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, reference TEXT, text TEXT,
+                translation TEXT, source TEXT, timestamp TEXT, book TEXT
+            )
+        '''
+    }),
+    ('users', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY, google_id TEXT UNIQUE, email TEXT,
+                name TEXT, picture TEXT, created_at TIMESTAMP, is_admin INTEGER DEFAULT 0,
+                is_banned BOOLEAN DEFAULT FALSE, ban_expires_at TIMESTAMP, ban_reason TEXT, role TEXT DEFAULT 'user',
+                custom_picture TEXT, avatar_decoration TEXT
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, google_id TEXT UNIQUE, email TEXT,
+                name TEXT, picture TEXT, created_at TEXT, is_admin INTEGER DEFAULT 0,
+                is_banned INTEGER DEFAULT 0, ban_expires_at TEXT, ban_reason TEXT, role TEXT DEFAULT 'user',
+                custom_picture TEXT, avatar_decoration TEXT
+            )
+        '''
+    }),
+    ('likes', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS likes (
+                id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER,
+                timestamp TIMESTAMP, UNIQUE(user_id, verse_id)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS likes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER,
+                timestamp TEXT, UNIQUE(user_id, verse_id)
+            )
+        '''
+    }),
+    ('saves', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS saves (
+                id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER,
+                timestamp TIMESTAMP, UNIQUE(user_id, verse_id)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS saves (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER,
+                timestamp TEXT, UNIQUE(user_id, verse_id)
+            )
+        '''
+    }),
+    ('comments', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS comments (
+                id SERIAL PRIMARY KEY, user_id INTEGER, verse_id INTEGER,
+                text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT,
+                is_deleted INTEGER DEFAULT 0
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS comments (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, verse_id INTEGER,
+                text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT,
+                is_deleted INTEGER DEFAULT 0
+            )
+        '''
+    }),
+    ('collections', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS collections (
+                id SERIAL PRIMARY KEY, user_id INTEGER, name TEXT,
+                color TEXT, created_at TEXT
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS collections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, name TEXT,
+                color TEXT, created_at TEXT
+            )
+        '''
+    }),
+    ('verse_collections', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS verse_collections (
+                id SERIAL PRIMARY KEY, collection_id INTEGER, verse_id INTEGER,
+                UNIQUE(collection_id, verse_id)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS verse_collections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, collection_id INTEGER, verse_id INTEGER,
+                UNIQUE(collection_id, verse_id)
+            )
+        '''
+    }),
+    ('community_messages', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS community_messages (
+                id SERIAL PRIMARY KEY, user_id INTEGER, text TEXT,
+                timestamp TEXT, google_name TEXT, google_picture TEXT
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS community_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, text TEXT,
+                timestamp TEXT, google_name TEXT, google_picture TEXT
+            )
+        '''
+    }),
+    ('comment_reactions', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS comment_reactions (
+                id SERIAL PRIMARY KEY, item_type TEXT NOT NULL, item_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL, reaction TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE(item_type, item_id, user_id, reaction)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS comment_reactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, item_type TEXT NOT NULL, item_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL, reaction TEXT NOT NULL, timestamp TEXT,
+                UNIQUE(item_type, item_id, user_id, reaction)
+            )
+        '''
+    }),
+    ('comment_replies', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS comment_replies (
+                id SERIAL PRIMARY KEY, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL, text TEXT NOT NULL,
+                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS comment_replies (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, parent_type TEXT NOT NULL, parent_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL, text TEXT NOT NULL, timestamp TEXT,
+                google_name TEXT, google_picture TEXT, is_deleted INTEGER DEFAULT 0
+            )
+        '''
+    }),
+    ('comment_restrictions', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS comment_restrictions (
+                id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE, reason TEXT,
+                restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS comment_restrictions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE, reason TEXT,
+                restricted_by TEXT, restricted_at TIMESTAMP, expires_at TIMESTAMP
+            )
+        '''
+    }),
+    ('daily_actions', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS daily_actions (
+                id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL, action TEXT NOT NULL,
+                verse_id INTEGER, event_date TEXT NOT NULL, timestamp TIMESTAMP,
+                UNIQUE(user_id, action, verse_id, event_date)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS daily_actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, action TEXT NOT NULL,
+                verse_id INTEGER, event_date TEXT NOT NULL, timestamp TEXT,
+                UNIQUE(user_id, action, verse_id, event_date)
+            )
+        '''
+    }),
+    ('audit_logs', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS audit_logs (
+                id SERIAL PRIMARY KEY, admin_id TEXT,
+                action TEXT, target_user_id INTEGER, details TEXT,
+                ip_address TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS audit_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, admin_id TEXT,
+                action TEXT, target_user_id INTEGER, details TEXT,
+                ip_address TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    }),
+    ('bans', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS bans (
+                id SERIAL PRIMARY KEY, user_id INTEGER UNIQUE,
+                reason TEXT, banned_by TEXT, banned_at TIMESTAMP,
+                expires_at TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS bans (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER UNIQUE,
+                reason TEXT, banned_by TEXT, banned_at TIMESTAMP,
+                expires_at TIMESTAMP
+            )
+        '''
+    }),
+    ('system_settings', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS system_settings (
+                key TEXT PRIMARY KEY, value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS system_settings (
+                key TEXT PRIMARY KEY, value TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    }),
+    ('direct_messages', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS direct_messages (
+                id SERIAL PRIMARY KEY, sender_id INTEGER NOT NULL, recipient_id INTEGER NOT NULL,
+                message TEXT NOT NULL, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_read INTEGER DEFAULT 0
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS direct_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, sender_id INTEGER NOT NULL, recipient_id INTEGER NOT NULL,
+                message TEXT NOT NULL, created_at TEXT, is_read INTEGER DEFAULT 0
+            )
+        '''
+    }),
+    ('dm_typing', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS dm_typing (
+                user_id INTEGER NOT NULL, other_id INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (user_id, other_id)
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS dm_typing (
+                user_id INTEGER NOT NULL, other_id INTEGER NOT NULL, updated_at TEXT,
+                PRIMARY KEY (user_id, other_id)
+            )
+        '''
+    }),
+    ('user_presence', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS user_presence (
+                user_id INTEGER PRIMARY KEY, last_seen TIMESTAMP, last_path TEXT,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS user_presence (
+                user_id INTEGER PRIMARY KEY, last_seen TEXT, last_path TEXT,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    }),
+    ('user_notifications', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS user_notifications (
+                id SERIAL PRIMARY KEY, user_id INTEGER, title TEXT, message TEXT,
+                notif_type TEXT DEFAULT 'announcement', source TEXT DEFAULT 'admin',
+                is_read INTEGER DEFAULT 0, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                sent_at TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS user_notifications (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, title TEXT, message TEXT,
+                notif_type TEXT DEFAULT 'announcement', source TEXT DEFAULT 'admin',
+                is_read INTEGER DEFAULT 0, created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                sent_at TEXT
+            )
+        '''
+    }),
+    ('admin_announcements', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS admin_announcements (
+                id SERIAL PRIMARY KEY, title TEXT, message TEXT,
+                is_global INTEGER DEFAULT 1, target_user_id INTEGER,
+                scheduled_for TIMESTAMP, status TEXT DEFAULT 'scheduled', created_by TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, sent_at TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS admin_announcements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT, message TEXT,
+                is_global INTEGER DEFAULT 1, target_user_id INTEGER,
+                scheduled_for TEXT, status TEXT DEFAULT 'scheduled', created_by TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP, sent_at TEXT
+            )
+        '''
+    }),
+    ('admin_chat_messages', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS admin_chat_messages (
+                id SERIAL PRIMARY KEY, admin_role TEXT, message TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS admin_chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, admin_role TEXT, message TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    }),
+    ('donation_events', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS donation_events (
+                id SERIAL PRIMARY KEY, amount_cents INTEGER, currency TEXT DEFAULT 'usd',
+                status TEXT DEFAULT 'paid', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS donation_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, amount_cents INTEGER, currency TEXT DEFAULT 'usd',
+                status TEXT DEFAULT 'paid', created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        '''
+    }),
+    ('presence_concurrency', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS presence_concurrency (
+                minute TIMESTAMP PRIMARY KEY, online INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS presence_concurrency (
+                minute TEXT PRIMARY KEY, online INTEGER NOT NULL DEFAULT 0
+            )
+        '''
+    }),
+    ('cache_versions', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS cache_versions (
+                name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0
+            )
+        '''
+    }),
+    ('generator_state', {
+        'postgres': '''
+            CREATE TABLE IF NOT EXISTS generator_state (
+                name TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0, verse TEXT,
+                total_verses INTEGER NOT NULL DEFAULT 0, verse_interval INTEGER,
+                rotates_at DOUBLE PRECISION, leader TEXT, updated_at TIMESTAMP
+            )
+        ''',
+        'sqlite': '''
+            CREATE TABLE IF NOT EXISTS generator_state (
+                name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0, verse TEXT,
+                total_verses INTEGER NOT NULL DEFAULT 0, verse_interval INTEGER,
+                rotates_at REAL, leader TEXT, updated_at TEXT
+            )
+        '''
+    }),
+]
+
+# Columns added after a table first shipped: (table, column, postgres type, sqlite type).
+SCHEMA_COLUMNS = [
+    ('users', 'ban_expires_at', 'TIMESTAMP', 'TEXT'),
+    ('users', 'ban_reason', 'TEXT', 'TEXT'),
+    ('users', 'custom_picture', 'TEXT', 'TEXT'),
+    ('users', 'avatar_decoration', 'TEXT', 'TEXT'),
+    ('comments', 'is_deleted', 'INTEGER DEFAULT 0', 'INTEGER DEFAULT 0'),
+    ('comment_replies', 'is_deleted', 'INTEGER DEFAULT 0', 'INTEGER DEFAULT 0'),
+    ('audit_logs', 'admin_id', 'TEXT', 'TEXT'),
+    ('audit_logs', 'action', 'TEXT', 'TEXT'),
+    ('audit_logs', 'target_user_id', 'INTEGER', 'INTEGER'),
+    ('audit_logs', 'details', 'TEXT', 'TEXT'),
+    ('audit_logs', 'ip_address', 'TEXT', 'TEXT'),
+    ('audit_logs', 'timestamp', 'TIMESTAMP', 'TEXT'),
+    ('audit_logs', 'status', 'TEXT', 'TEXT'),
+    ('audit_logs', 'target_name', 'TEXT', 'TEXT'),
+    ('audit_logs', 'target_role', 'TEXT', 'TEXT'),
+    ('daily_actions', 'user_id', 'INTEGER', 'INTEGER'),
+    ('daily_actions', 'action', 'TEXT', 'TEXT'),
+    ('daily_actions', 'verse_id', 'INTEGER', 'INTEGER'),
+    ('daily_actions', 'event_date', 'TEXT', 'TEXT'),
+    ('daily_actions', 'timestamp', 'TIMESTAMP', 'TEXT'),
+]
+
+# Indexes for the hot lookups: (name, table, columns, partial predicate).
+# Partial predicates repeat the exact expression the handlers filter on,
+# otherwise neither planner will match them.
+# Unordered participant pair for a DM conversation, per dialect. Queries must use
+# these exact expressions for the planner to match idx_direct_messages_conversation.
+DM_CONVERSATION_KEY = {
+    'postgres': ('LEAST(sender_id, recipient_id)', 'GREATEST(sender_id, recipient_id)'),
+    'sqlite': ('min(sender_id, recipient_id)', 'max(sender_id, recipient_id)'),
+}
+
+# (name, table, columns, partial predicate); columns may be a per-dialect dict
+# for expression indexes.
+SCHEMA_INDEXES = [
+    ('idx_comments_verse_live', 'comments', 'verse_id, timestamp', 'COALESCE(is_deleted, 0) = 0'),
+    ('idx_comments_user', 'comments', 'user_id', None),
+    ('idx_comments_timestamp', 'comments', 'timestamp', None),
+    ('idx_comment_replies_parent_live', 'comment_replies', 'parent_type, parent_id, timestamp', 'COALESCE(is_deleted, 0) = 0'),
+    ('idx_comment_replies_user', 'comment_replies', 'user_id', None),
+    ('idx_comment_reactions_item', 'comment_reactions', 'item_type, item_id, reaction', None),
+    ('idx_community_messages_timestamp', 'community_messages', 'timestamp', None),
+    ('idx_community_messages_user', 'community_messages', 'user_id', None),
+    ('idx_direct_messages_pair', 'direct_messages', 'sender_id, recipient_id, created_at', None),
+    ('idx_direct_messages_recipient', 'direct_messages', 'recipient_id, sender_id, created_at', None),
+    ('idx_direct_messages_conversation', 'direct_messages',
+     {dialect: ', '.join(key) + ', created_at' for dialect, key in DM_CONVERSATION_KEY.items()}, None),
+    ('idx_user_notifications_user', 'user_notifications', 'user_id, created_at', None),
+    ('idx_daily_actions_lookup', 'daily_actions', 'user_id, action, event_date', None),
+    ('idx_daily_actions_timestamp', 'daily_actions', 'timestamp', None),
+    ('idx_audit_logs_timestamp', 'audit_logs', 'timestamp', None),
+    ('idx_audit_logs_action', 'audit_logs', 'action, timestamp', None),
+    ('idx_verses_reference', 'verses', 'reference', None),
+    ('idx_user_presence_last_seen', 'user_presence', 'last_seen', None),
+    ('idx_users_created_at', 'users', 'created_at', None),
+    ('idx_likes_user_timestamp', 'likes', 'user_id, timestamp', None),
+    ('idx_saves_user_timestamp', 'saves', 'user_id, timestamp', None),
+]
+
+# Representative hot queries for the admin index report, with ? placeholders.
+INDEX_REPORT_QUERIES = [
+    ('comments for verse', "SELECT id FROM comments WHERE verse_id = ? AND COALESCE(is_deleted, 0) = 0 ORDER BY timestamp DESC", (0,)),
+    ('replies for parent', "SELECT id FROM comment_replies WHERE parent_type = ? AND parent_id = ? AND COALESCE(is_deleted, 0) = 0 ORDER BY timestamp ASC", ('comment', 0)),
+    ('reaction counts', "SELECT reaction, COUNT(*) FROM comment_reactions WHERE item_type = ? AND item_id = ? GROUP BY reaction", ('comment', 0)),
+    ('dm conversation', {dialect: f"SELECT id FROM direct_messages WHERE {low} = ? AND {high} = ? ORDER BY created_at ASC, id ASC LIMIT 200"
+                         for dialect, (low, high) in DM_CONVERSATION_KEY.items()}, (0, 0)),
+    ('user notifications', "SELECT id FROM user_notifications WHERE user_id = ? ORDER BY created_at DESC LIMIT 50", (0,)),
+    ('online presence', "SELECT COUNT(*) FROM user_presence WHERE last_seen >= ?", ('1970-01-01T00:00:00',)),
+    ('retention window', "SELECT COUNT(DISTINCT user_id) FROM daily_actions WHERE user_id IS NOT NULL AND timestamp >= ?", ('1970-01-01T00:00:00',)),
+    ('challenge progress', "SELECT COUNT(*) FROM daily_actions WHERE user_id = ? AND action = ? AND event_date = ?", (0, 'save', '')),
+    ('audit log page', "SELECT id FROM audit_logs ORDER BY timestamp DESC, id DESC LIMIT 50", ()),
+    ('verse by reference', "SELECT id FROM verses WHERE reference = ? AND text = ?", ('', '')),
+]
+
+SCHEMA_VERSION = 0
+SCHEMA_READY = False
+_schema_lock = threading.Lock()
+SCHEMA_MIGRATION_LOCK_ID = 470113  # pg advisory lock key shared by all workers
+SCHEMA_INDEX_LOCK_ID = 470115      # held by the worker building indexes concurrently
+
+# Migration steps name exactly what they introduce, so a schema version always
+# means the same tables, columns and indexes. Definitions still come from the
+# registries above; anything added there later needs a new step of its own.
+def _create_tables(*names):
+    """Migration step creating these SCHEMA_TABLES entries."""
+    def step(conn, c, db_type):
+        ddl = dict(SCHEMA_TABLES)
+        for name in names:
+            c.execute(ddl[name][db_type])
+    return step
+
+def _add_columns(*columns):
+    """Migration step adding these (table, column) pairs from SCHEMA_COLUMNS."""
+    def step(conn, c, db_type):
+        types = {(table, column): (pg_type, sqlite_type) for table, column, pg_type, sqlite_type in SCHEMA_COLUMNS}
+        existing = {table: {col.lower() for col in _table_columns(conn, db_type, table)}
+                    for table in {table for table, _ in columns}}
+        for table, column in columns:
+            if column in existing[table]:
+                continue
+            pg_type, sqlite_type = types[(table, column)]
+            if db_type == 'postgres':
+                c.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {pg_type}")
+            else:
+                c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {sqlite_type}")
+            existing[table].add(column)
+            logger.info(f"Added {column} column to {table}")
+    return step
+
+def _migration_backfill_audit_timestamp(conn, c, db_type):
+    # Legacy audit_logs tables recorded the event time in created_at.
+    if 'created_at' in {col.lower() for col in _table_columns(conn, db_type, 'audit_logs')}:
+        c.execute("UPDATE audit_logs SET timestamp = created_at WHERE timestamp IS NULL AND created_at IS NOT NULL")
+
+def _index_sql(name, table, columns, where, db_type):
+    if isinstance(columns, dict):
+        columns = columns[db_type]
+    # CONCURRENTLY keeps the table writable during the build; it cannot run in a transaction.
+    concurrently = ' CONCURRENTLY' if db_type == 'postgres' else ''
+    sql = f"CREATE INDEX{concurrently} IF NOT EXISTS {name} ON {table} ({columns})"
+    if where:
+        sql += f" WHERE {where}"
+    return sql
+
+def _create_indexes(*names):
+    """Migration step creating these SCHEMA_INDEXES entries."""
+    def step(conn, c, db_type):
+        # Postgres builds them after the migration transaction, see build_indexes_concurrently().
+        if db_type == 'postgres':
+            return
+        definitions = {name: (table, columns, where) for name, table, columns, where in SCHEMA_INDEXES}
+        for name in names:
+            c.execute(_index_sql(name, *definitions[name], db_type))
+    return step
+
+def build_indexes_concurrently():
+    """Create missing or invalid SCHEMA_INDEXES on Postgres without blocking writes.
+
+    Runs on its own autocommit connection outside the migration transaction.
+    Only one worker builds at a time (session advisory lock); the others skip.
+    An index left INVALID by an interrupted build is dropped and rebuilt.
+    """
+    conn = _get_pg_pool()._connect()
+    try:
+        conn.autocommit = True
+        c = conn.cursor()
+        c.execute("SELECT pg_try_advisory_lock(%s)", (SCHEMA_INDEX_LOCK_ID,))
+        if not c.fetchone()[0]:
+            return
+        c.execute("""
+            SELECT i.relname, x.indisvalid
+            FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE i.relname = ANY(%s)
+        """, ([name for name, _, _, _ in SCHEMA_INDEXES],))
+        valid = dict(c.fetchall())
+        for name, table, columns, where in SCHEMA_INDEXES:
+            if valid.get(name):
+                continue
+            try:
+                if name in valid:
+                    c.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                c.execute(_index_sql(name, table, columns, where, 'postgres'))
+                logger.info(f"Built index {name} concurrently")
+            except Exception as e:
+                logger.error(f"Concurrent build of {name} failed: {e}")
+    finally:
+        conn.close()
+
+# Columns behind time-window queries. Postgres stores them as TIMESTAMP;
+# SQLite keeps TEXT normalized to ISO-8601 (YYYY-MM-DDTHH:MM:SS[.fff]) so
+# plain string comparisons against datetime.isoformat() cutoffs order correctly.
+TIMESTAMP_COLUMNS = [
+    ('users', 'created_at'),
+    ('likes', 'timestamp'),
+    ('saves', 'timestamp'),
+    ('daily_actions', 'timestamp'),
+    ('user_presence', 'last_seen'),
+    ('user_notifications', 'created_at'),
+]
+
+def _migration_native_timestamps(conn, c, db_type):
+    if db_type == 'postgres':
+        # Unparseable legacy text becomes NULL instead of failing the ALTER.
+        c.execute("""
+            CREATE OR REPLACE FUNCTION bq_try_timestamp(value TEXT) RETURNS TIMESTAMP AS $$
+            BEGIN
+                RETURN NULLIF(btrim(value), '')::timestamptz AT TIME ZONE 'UTC';
+            EXCEPTION WHEN others THEN
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql STABLE
+        """)
+        for table, column in TIMESTAMP_COLUMNS:
+            c.execute("SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+                      (table, column))
+            row = c.fetchone()
+            if row and row[0] in ('text', 'character varying'):
+                c.execute(f'ALTER TABLE {table} ALTER COLUMN "{column}" TYPE TIMESTAMP USING bq_try_timestamp("{column}")')
+                logger.info(f"Converted {table}.{column} to TIMESTAMP")
+        c.execute("DROP FUNCTION IF EXISTS bq_try_timestamp(TEXT)")
+    else:
+        # CURRENT_TIMESTAMP defaults ('YYYY-MM-DD HH:MM:SS') and offset-suffixed values sort
+        # differently from isoformat() text; rewrite them in UTC with a 'T' separator.
+        for table, column in TIMESTAMP_COLUMNS:
+            c.execute(f"""
+                UPDATE {table} SET "{column}" = strftime('%Y-%m-%dT%H:%M:%f', "{column}")
+                WHERE "{column}" IS NOT NULL
+                  AND (substr("{column}", 11, 1) = ' ' OR length("{column}") > 26)
+                  AND strftime('%Y-%m-%dT%H:%M:%f', "{column}") IS NOT NULL
+            """)
+    _create_indexes('idx_users_created_at', 'idx_likes_user_timestamp', 'idx_saves_user_timestamp')(conn, c, db_type)
+
+def _migration_corpus_keys(conn, c, db_type):
+    if 'corpus_key' not in {col.lower() for col in _table_columns(conn, db_type, 'verses')}:
+        c.execute("ALTER TABLE verses ADD COLUMN corpus_key TEXT")
+        logger.info("Added corpus_key column to verses")
+    # Corpus verses used to be stored under their BBCCCVVV position as verses.id.
+    # Key the rows that really hold that verse; ids that went to another verse stay unkeyed.
+    c.execute("""
+        UPDATE verses SET corpus_key = LOWER(translation) || ':' || CAST(id AS TEXT)
+        WHERE source = 'Local corpus' AND corpus_key IS NULL
+          AND id BETWEEN 1001001 AND 66999999
+          AND reference LIKE '% ' || CAST((id / 1000) % 1000 AS TEXT) || ':' || CAST(id % 1000 AS TEXT)
+    """)
+    # Built here rather than in SCHEMA_INDEXES: ensure_verse_row's ON CONFLICT needs it before
+    # the first insert, and verses is small enough to index inside the migration.
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_verses_corpus_key ON verses (corpus_key)")
+    if db_type == 'postgres':
+        # Explicit ids never advanced the serial; move it past them before it reaches one.
+        c.execute("SELECT setval(pg_get_serial_sequence('verses', 'id'), MAX(id)) FROM verses")
+
+# Ordered, append-only. Each step must be idempotent so a database that
+# predates schema_migrations can be brought under version control safely.
+SCHEMA_MIGRATIONS = [
+    (1, 'create tables', _create_tables(
+        'verses', 'users', 'likes', 'saves', 'comments', 'collections', 'verse_collections',
+        'community_messages', 'comment_reactions', 'comment_replies', 'comment_restrictions',
+        'daily_actions', 'audit_logs', 'bans', 'system_settings', 'direct_messages', 'dm_typing',
+        'user_presence', 'user_notifications', 'admin_announcements', 'admin_chat_messages',
+        'donation_events')),
+    (2, 'add late columns', _add_columns(
+        ('users', 'ban_expires_at'), ('users', 'ban_reason'), ('users', 'custom_picture'),
+        ('users', 'avatar_decoration'), ('comments', 'is_deleted'), ('comment_replies', 'is_deleted'),
+        ('audit_logs', 'admin_id'), ('audit_logs', 'action'), ('audit_logs', 'target_user_id'),
+        ('audit_logs', 'details'), ('audit_logs', 'ip_address'), ('audit_logs', 'timestamp'),
+        ('daily_actions', 'user_id'), ('daily_actions', 'action'), ('daily_actions', 'verse_id'),
+        ('daily_actions', 'event_date'), ('daily_actions', 'timestamp'))),
+    (3, 'backfill audit_logs timestamp', _migration_backfill_audit_timestamp),
+    (4, 'hot path indexes', _create_indexes(
+        'idx_comments_verse_live', 'idx_comments_user', 'idx_comments_timestamp',
+        'idx_comment_replies_parent_live', 'idx_comment_replies_user', 'idx_comment_reactions_item',
+        'idx_community_messages_timestamp', 'idx_community_messages_user', 'idx_direct_messages_pair',
+        'idx_direct_messages_recipient', 'idx_user_notifications_user', 'idx_daily_actions_lookup',
+        'idx_daily_actions_timestamp', 'idx_audit_logs_timestamp', 'idx_audit_logs_action',
+        'idx_verses_reference', 'idx_user_presence_last_seen')),
+    (5, 'native timestamps', _migration_native_timestamps),
+    (6, 'dm conversation key index', _create_indexes('idx_direct_messages_conversation')),
+    (7, 'cache version counters', _create_tables('cache_versions')),
+    (8, 'presence concurrency series', _create_tables('presence_concurrency')),
+    (9, 'structured audit columns', _add_columns(
+        ('audit_logs', 'status'), ('audit_logs', 'target_name'), ('audit_logs', 'target_role'))),
+    (10, 'shared generator state', _create_tables('generator_state')),
+    (11, 'corpus verse keys', _migration_corpus_keys),
+]
+
+def _read_schema_version(conn, db_type):
+    c = conn.cursor()
+    try:
+        c.execute("SELECT MAX(version) FROM schema_migrations")
+        row = c.fetchone()
+        return int(row[0] or 0) if row else 0
+    except Exception:
+        conn.rollback()
+        return None
+
+def run_migrations(conn, db_type):
+    """Apply pending SCHEMA_MIGRATIONS; an up-to-date database costs one SELECT."""
+    latest = SCHEMA_MIGRATIONS[-1][0]
+    current = _read_schema_version(conn, db_type)
+    if current is not None and current >= latest:
+        return current
+
+    c = conn.cursor()
+    # Serialize workers booting at the same time; the lock ends with the transaction.
+    if db_type == 'postgres':
+        c.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+    else:
+        c.execute("BEGIN IMMEDIATE")
+    try:
+        c.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY, name TEXT, applied_at TEXT
+            )
+        """)
+        c.execute("SELECT MAX(version) FROM schema_migrations")
+        row = c.fetchone()
+        current = int(row[0] or 0) if row else 0
+        for version, name, step in SCHEMA_MIGRATIONS:
+            if version <= current:
+                continue
+            step(conn, c, db_type)
+            if db_type == 'postgres':
+                c.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (%s, %s, %s)",
+                          (version, name, utc_now().isoformat()))
+            else:
+                c.execute("INSERT INTO schema_migrations (version, name, applied_at) VALUES (?, ?, ?)",
+                          (version, name, utc_now().isoformat()))
+            logger.info(f"Applied migration {version}: {name}")
+            current = version
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return current
+
+def ensure_schema():
+    """Run migrations once per process; later calls are a flag check."""
+    global SCHEMA_READY, SCHEMA_VERSION
+    if SCHEMA_READY:
+        return True
+    with _schema_lock:
+        if SCHEMA_READY:
+            return True
+        try:
+            with db_connection() as (conn, db_type):
+                SCHEMA_VERSION = run_migrations(conn, db_type)
+            SCHEMA_READY = True
+            logger.info(f"Database schema at version {SCHEMA_VERSION} ({db_type})")
+            if db_type == 'postgres':
+                threading.Thread(target=build_indexes_concurrently, daemon=True).start()
+        except Exception as e:
+            logger.error(f"Migration error: {e}")
+    return SCHEMA_READY
+
+def _plan_hints(db_type, plan_lines):
+    """Flag full scans and sort spills in an EXPLAIN plan."""
+    hints = []
+    for line in plan_lines:
+        text = line.strip()
+        if db_type == 'postgres':
+            if 'Seq Scan on' in text:
+                hints.append(f"sequential scan: {text}")
+        else:
+            if text.startswith('SCAN ') and 'USING' not in text:
+                hints.append(f"full table scan: {text}")
+            elif 'USE TEMP B-TREE' in text:
+                hints.append(f"sort without index: {text}")
+    return hints
+
+def build_index_report(conn, db_type):
+    """Managed index status, usage counters (Postgres only) and EXPLAIN hints for hot queries."""
+    c = conn.cursor()
+    usage = {}
+    if db_type == 'postgres':
+        c.execute("SELECT indexrelname, relname, idx_scan, idx_tup_read FROM pg_stat_user_indexes")
+        for row in c.fetchall():
+            usage[row[0]] = {"table": row[1], "scans": int(row[2] or 0), "tuples_read": int(row[3] or 0)}
+    else:
+        c.execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'")
+        for row in c.fetchall():
+            usage[row[0]] = {"table": row[1], "scans": None, "tuples_read": None}
+
+    indexes = []
+    for name, table, columns, where in SCHEMA_INDEXES:
+        if isinstance(columns, dict):
+            columns = columns[db_type]
+        stats = usage.get(name)
+        indexes.append({
+            "name": name,
+            "table": table,
+            "columns": columns,
+            "partial": where,
+            "present": stats is not None,
+            "scans": stats["scans"] if stats else None,
+            "tuples_read": stats["tuples_read"] if stats else None
+        })
+
+    queries = []
+    for label, sql, params in INDEX_REPORT_QUERIES:
+        if isinstance(sql, dict):
+            sql = sql[db_type]
+        try:
+            if db_type == 'postgres':
+                plan = [row[0] for row in db_query(conn, db_type, "EXPLAIN " + sql, params)]
+            else:
+                plan = [row[3] for row in db_query(conn, db_type, "EXPLAIN QUERY PLAN " + sql, params)]
+            queries.append({"query": label, "plan": plan, "hints": _plan_hints(db_type, plan)})
+        except Exception as e:
+            if db_type == 'postgres':
+                conn.rollback()
+            queries.append({"query": label, "plan": [], "hints": [], "error": str(e)})
+
+    unused = [i["name"] for i in indexes if i["scans"] == 0]
+    return {
+        "db_type": db_type,
+        "schema_version": SCHEMA_VERSION,
+        "indexes": indexes,
+        "missing": [i["name"] for i in indexes if not i["present"]],
+        "unused": unused,
+        "queries": queries
+    }
+
+ensure_schema()
+
+@app.before_request
+def ensure_schema_ready():
+    # Startup may have run while the database was unreachable; retry lazily.
+    if not SCHEMA_READY:
+        ensure_schema()
+
+def get_challenge_period_key():
+    now = datetime.now().astimezone()
+    start = now.replace(minute=0, second=0, microsecond=0)
+    block_hour = (start.hour // 2) * 2
+    start = start.replace(hour=block_hour)
+    return start.strftime("%Y-%m-%d-%H")
+
+def get_hour_window():
+    now = datetime.now().astimezone()
+    start = now.replace(minute=0, second=0, microsecond=0)
+    block_hour = (start.hour // 2) * 2
+    start = start.replace(hour=block_hour)
+    return start, start + timedelta(hours=2)
 
 def get_hourly_xp_reward(user_id, period_key):
     seed = f"{user_id}:{period_key}"
@@ -816,321 +2154,1208 @@ def pick_hourly_challenge(user_id, period_key):
     value = int(hashlib.sha256(seed.encode("utf-8")).hexdigest()[:8], 16)
     return challenges[value % len(challenges)]
 
-def record_daily_action(user_id, action, verse_id=None):
-    """Persist unique per-window user actions used by the challenge."""
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
-    period_key = get_challenge_period_key()
-    now = datetime.now().isoformat()
+EVENT_QUEUE_MAX = max(100, int(os.environ.get('EVENT_QUEUE_MAX', '10000')))
+EVENT_BATCH_SIZE = max(1, int(os.environ.get('EVENT_BATCH_SIZE', '100')))
+EVENT_LINGER = max(0.0, float(os.environ.get('EVENT_LINGER', '0.25')))
+EVENT_ENQUEUE_TIMEOUT = max(0.0, float(os.environ.get('EVENT_ENQUEUE_TIMEOUT', '0.5')))
+EVENT_RETRY_LIMIT = max(0, int(os.environ.get('EVENT_RETRY_LIMIT', '3')))
+EVENT_SPILL_PATH = os.environ.get('EVENT_SPILL_PATH', '').strip()
+
+class EventPipeline:
+    """Bounded in-process queue of insert-only events with one batching writer thread.
+
+    emit(kind, row) returns as soon as the row is queued; the writer drains up
+    to batch_size events (lingering briefly for more), groups them by kind and
+    hands each group to writers[kind](conn, db_type, rows) in one transaction.
+    A full queue makes emit() wait up to EVENT_ENQUEUE_TIMEOUT before the event
+    is spilled or dropped. Failed batches are retried with backoff; a batch
+    the database still rejects is split in halves so only the offending rows
+    are set aside. Those, and whole batches that never reached the database,
+    are appended as JSON lines to '<spill_path>.<name>' (if spill_path is
+    set; one file per pipeline, since replay empties the file it reads) and
+    replayed once the database accepts writes again; rows rejected again on
+    replay are dropped.
+    flush() waits for everything emitted so far and reports whether it was
+    actually written.
+    """
+
+    def __init__(self, name, writers, max_queue=EVENT_QUEUE_MAX, batch_size=EVENT_BATCH_SIZE,
+                 linger=EVENT_LINGER, retry_limit=EVENT_RETRY_LIMIT, spill_path=EVENT_SPILL_PATH):
+        self.name = name
+        self.writers = writers
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.linger = linger
+        self.retry_limit = retry_limit
+        self.spill_path = f"{spill_path}.{name}" if spill_path else None
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.spill_lock = threading.Lock()
+        self.thread = None
+        self.stopping = False
+        self.urgent = False
+        self.seq = 0
+        self.done = 0
+        # Recent sequence numbers that were spilled or dropped, for flush().
+        self.failed = deque(maxlen=max_queue)
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.retries = 0
+        self.batches = 0
+        self.high_water = 0
+        self.last_batch_ms = None
+        self.avg_batch_ms = None
+        self.last_flush_wait_ms = None
+        self.last_error = None
+
+    def emit(self, kind, row):
+        """Queue one row for writers[kind]; returns its sequence number, or None if it did not fit."""
+        with self.cond:
+            if len(self.queue) >= self.max_queue and not self.stopping:
+                self.urgent = True
+                self.cond.notify_all()
+                self.cond.wait_for(lambda: len(self.queue) < self.max_queue, EVENT_ENQUEUE_TIMEOUT)
+            if len(self.queue) < self.max_queue:
+                self.seq += 1
+                seq = self.seq
+                self.queue.append((seq, kind, row))
+                self.high_water = max(self.high_water, len(self.queue))
+                self.cond.notify_all()
+            else:
+                seq = None
+        if seq is None:
+            self._spill([(None, kind, row)], "queue full")
+            return None
+        if self.stopping:
+            # Emitted during shutdown, after the writer has gone.
+            self._drain()
+        else:
+            self.start()
+        return seq
+
+    def flush(self, seq=None, timeout=5.0):
+        """Wait until event seq (default: everything emitted so far) has been handled.
+
+        Returns False on timeout, or if the event was spilled or dropped rather
+        than written.
+        """
+        started = time.perf_counter()
+        with self.cond:
+            target = self.seq if seq is None else seq
+            since = self.done if seq is None else seq - 1
+            self.urgent = True
+            self.cond.notify_all()
+            flushed = self.cond.wait_for(lambda: self.done >= target, timeout)
+            if flushed:
+                flushed = not any(since < failed <= target for failed in self.failed)
+        self.last_flush_wait_ms = round((time.perf_counter() - started) * 1000, 2)
+        return flushed
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.cond:
+            if self.stopping or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.thread = threading.Thread(target=self._writer_loop, name=f"{self.name}-events", daemon=True)
+            self.thread.start()
 
-    try:
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO daily_actions (user_id, action, verse_id, event_date, timestamp)
-                VALUES (%s, %s, %s, %s, %s)
-                ON CONFLICT (user_id, action, verse_id, event_date) DO NOTHING
-            """, (user_id, action, verse_id, period_key, now))
+    def close(self, timeout=10.0):
+        """Stop accepting the slow path and write out whatever is queued (registered atexit)."""
+        with self.cond:
+            self.stopping = True
+            self.cond.notify_all()
+        thread = self.thread
+        if thread is not None and thread.is_alive():
+            thread.join(timeout)
         else:
-            c.execute("""
-                INSERT OR IGNORE INTO daily_actions (user_id, action, verse_id, event_date, timestamp)
-                VALUES (?, ?, ?, ?, ?)
-            """, (user_id, action, verse_id, period_key, now))
-        conn.commit()
-    except Exception as e:
-        logger.warning(f"Daily action record failed: {e}")
-    finally:
-        conn.close()
+            self._drain()
+
+    def _next_batch(self):
+        with self.cond:
+            self.cond.wait_for(lambda: self.queue or self.stopping)
+            if not self.queue:
+                return None
+            if len(self.queue) < self.batch_size and not (self.urgent or self.stopping):
+                self.cond.wait_for(lambda: len(self.queue) >= self.batch_size or self.urgent or self.stopping,
+                                   self.linger)
+            batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.batch_size))]
+            if not self.queue:
+                self.urgent = False
+            self.cond.notify_all()
+            return batch
+
+    def _writer_loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._handle(batch)
+
+    def _drain(self):
+        while True:
+            with self.cond:
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.batch_size))]
+            if not batch:
+                return
+            self._handle(batch)
+
+    def _handle(self, batch):
+        failed = self._write(batch)
+        with self.cond:
+            self.failed.extend(seq for seq, _, _ in failed if seq is not None)
+            self.done += len(batch)
+            self.cond.notify_all()
+        # Only after waking flush() callers: a long replay must not hold up their answer.
+        if len(failed) < len(batch) and self.spill_path:
+            self._replay_spill()
+
+    def _write(self, events, retries=None, replay=False):
+        """Write events, returning the ones that were spilled or dropped instead.
+
+        Once retries are used up, a batch that failed after connecting is split
+        and each half written on its own, so a single bad row does not take the
+        rest of the batch with it. Batches that could not connect at all are
+        spilled whole.
+        """
+        error, connected = self._commit(events, self.retry_limit if retries is None else retries)
+        return [] if error is None else self._set_aside(events, error, connected, replay)
+
+    def _set_aside(self, events, error, connected, replay):
+        if connected and len(events) > 1:
+            middle = len(events) // 2
+            return self._write(events[:middle], 0, replay) + self._write(events[middle:], 0, replay)
+        if connected and replay:
+            self._drop(events, error)
+        else:
+            self._spill(events, error)
+        return events
+
+    def _commit(self, events, retries):
+        """One transaction for events; returns (error or None, whether a connection was obtained)."""
+        groups = {}
+        for _, kind, row in events:
+            groups.setdefault(kind, []).append(row)
+        for attempt in range(retries + 1):
+            started = time.perf_counter()
+            connected = False
+            try:
+                with db_connection() as (conn, db_type):
+                    connected = True
+                    for kind, rows in groups.items():
+                        self.writers[kind](conn, db_type, rows)
+                    conn.commit()
+            except Exception as e:
+                self.last_error = str(e)
+                if attempt < retries and not self.stopping:
+                    self.retries += 1
+                    time.sleep(min(5.0, 0.2 * (2 ** attempt)))
+                    continue
+                return e, connected
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.last_batch_ms = round(elapsed_ms, 2)
+            self.avg_batch_ms = round(elapsed_ms if self.avg_batch_ms is None else
+                                      self.avg_batch_ms * 0.9 + elapsed_ms * 0.1, 2)
+            self.written += len(events)
+            self.batches += 1
+            self.last_error = None
+            return None, True
+
+    def _spill(self, events, reason):
+        if self.spill_path:
+            try:
+                lines = ''.join(json.dumps({"kind": kind, "row": list(row)}, default=str) + '\n' for _, kind, row in events)
+                with self.spill_lock, open(self.spill_path, 'a', encoding='utf-8') as fh:
+                    if fcntl:
+                        fcntl.flock(fh, fcntl.LOCK_EX)
+                    fh.write(lines)
+                self.spilled += len(events)
+                logger.warning(f"{self.name} events: spilled {len(events)} to {self.spill_path} ({reason})")
+                return
+            except Exception as e:
+                reason = f"{reason}; spill failed: {e}"
+        self._drop(events, reason)
+
+    def _drop(self, events, reason):
+        self.dropped += len(events)
+        logger.error(f"{self.name} events: dropped {len(events)} ({reason})")
+
+    def _replay_spill(self):
+        try:
+            if os.path.getsize(self.spill_path) == 0:
+                return
+        except OSError:
+            return
+        try:
+            with self.spill_lock, open(self.spill_path, 'r+', encoding='utf-8') as fh:
+                if fcntl:
+                    fcntl.flock(fh, fcntl.LOCK_EX)
+                lines = fh.readlines()
+                fh.seek(0)
+                fh.truncate()
+        except OSError as e:
+            logger.warning(f"{self.name} events: could not read spill file: {e}")
+            return
+        events, unreadable = [], 0
+        for line in lines:
+            try:
+                item = json.loads(line)
+                if item["kind"] not in self.writers:
+                    raise KeyError(item["kind"])
+                events.append((None, item["kind"], tuple(item["row"])))
+            except (ValueError, TypeError, KeyError):
+                unreadable += 1
+        if unreadable:
+            self.dropped += unreadable
+            logger.error(f"{self.name} events: dropped {unreadable} unreadable spill lines")
+        for start in range(0, len(events), self.batch_size):
+            chunk = events[start:start + self.batch_size]
+            error, connected = self._commit(chunk, self.retry_limit)
+            if error is None:
+                continue
+            if not connected:
+                # The database went away again; keep this chunk and the remainder for next time.
+                self._spill(events[start:], error)
+                return
+            self._set_aside(chunk, error, connected, replay=True)
+        if events:
+            logger.info(f"{self.name} events: replayed {len(events)} spilled events")
+
+    def stats(self):
+        return {
+            "queued": len(self.queue),
+            "high_water": self.high_water,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "retries": self.retries,
+            "last_batch_ms": self.last_batch_ms,
+            "avg_batch_ms": self.avg_batch_ms,
+            "last_flush_wait_ms": self.last_flush_wait_ms,
+            "last_error": self.last_error
+        }
+
+def _insert_daily_actions(conn, db_type, rows):
+    values = ', '.join(['(?, ?, ?, ?, ?)'] * len(rows))
+    params = [value for row in rows for value in row]
+    db_execute(conn, db_type, f"""
+        INSERT INTO daily_actions (user_id, action, verse_id, event_date, timestamp)
+        VALUES {values}
+        ON CONFLICT (user_id, action, verse_id, event_date) DO NOTHING
+    """, params)
+
+def _insert_activity_logs(conn, db_type, rows):
+    db_execute(conn, db_type, f"""
+        INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address, timestamp)
+        VALUES {', '.join(['(?, ?, ?, ?, ?, ?)'] * len(rows))}
+    """, [value for row in rows for value in row])
+
+activity_events = EventPipeline('activity', {
+    'daily_action': _insert_daily_actions,
+    'activity': _insert_activity_logs,
+})
+atexit.register(activity_events.close)
+
+# Admin audit trail: its own queue so moderation records never wait behind user
+# activity, and log_action can flush it before answering security-sensitive calls.
+AUDIT_FLUSH_TIMEOUT = max(0.1, float(os.environ.get('AUDIT_FLUSH_TIMEOUT', '5')))
+
+def _insert_audit_logs(conn, db_type, rows):
+    db_execute(conn, db_type, f"""
+        INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address, timestamp,
+                                status, target_name, target_role)
+        VALUES {', '.join(['(?, ?, ?, ?, ?, ?, ?, ?, ?)'] * len(rows))}
+    """, [value for row in rows for value in row])
+
+audit_events = EventPipeline('audit', {'audit': _insert_audit_logs})
+atexit.register(audit_events.close)
+
+def record_daily_action(user_id, action, verse_id=None):
+    """Queue a unique per-window user action used by the challenge (written by activity_events)."""
+    activity_events.emit('daily_action', (user_id, action, verse_id, get_challenge_period_key(),
+                                          utc_now().isoformat()))
 
 def log_action(admin_id, action, target_user_id=None, details=None):
     """Log admin actions for audit trail"""
     try:
         from flask import request
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        
         try:
             ip = request.remote_addr
         except:
             ip = 'system'
-        
-        if db_type == 'postgres':
-            c.execute("INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address) VALUES (%s, %s, %s, %s, %s)",
-                      (admin_id, action, target_user_id, json.dumps(details) if details else None, ip))
-        else:
-            c.execute("INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address) VALUES (?, ?, ?, ?, ?)",
-                      (admin_id, action, target_user_id, json.dumps(details) if details else None, ip))
-        
-        conn.commit()
-        conn.close()
+        audit_events.emit('audit', (admin_id, action, target_user_id, json.dumps(details) if details else None, ip,
+                                    utc_now().isoformat(), None, None, None))
     except Exception as e:
         logger.error(f"Log error: {e}")
 
-def ensure_comment_social_tables(c, db_type):
-    """Ensure reactions/replies tables exist before use."""
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS comment_reactions (
-                id SERIAL PRIMARY KEY,
-                item_type TEXT NOT NULL,
-                item_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                reaction TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(item_type, item_id, user_id, reaction)
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS comment_replies (
-                id SERIAL PRIMARY KEY,
-                parent_type TEXT NOT NULL,
-                parent_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                text TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                google_name TEXT,
-                google_picture TEXT,
-                is_deleted INTEGER DEFAULT 0
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS comment_reactions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                item_type TEXT NOT NULL,
-                item_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                reaction TEXT NOT NULL,
-                timestamp TEXT,
-                UNIQUE(item_type, item_id, user_id, reaction)
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS comment_replies (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                parent_type TEXT NOT NULL,
-                parent_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                text TEXT NOT NULL,
-                timestamp TEXT,
-                google_name TEXT,
-                google_picture TEXT,
-                is_deleted INTEGER DEFAULT 0
-            )
-        """)
-
-def ensure_dm_tables(c, db_type):
-    """Ensure direct message tables exist before use."""
-    if db_type == 'postgres':
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS direct_messages (
-                id SERIAL PRIMARY KEY,
-                sender_id INTEGER NOT NULL,
-                recipient_id INTEGER NOT NULL,
-                message TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_read INTEGER DEFAULT 0
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS dm_typing (
-                user_id INTEGER NOT NULL,
-                other_id INTEGER NOT NULL,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                PRIMARY KEY (user_id, other_id)
-            )
-        """)
-    else:
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS direct_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                sender_id INTEGER NOT NULL,
-                recipient_id INTEGER NOT NULL,
-                message TEXT NOT NULL,
-                created_at TEXT,
-                is_read INTEGER DEFAULT 0
-            )
-        """)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS dm_typing (
-                user_id INTEGER NOT NULL,
-                other_id INTEGER NOT NULL,
-                updated_at TEXT,
-                PRIMARY KEY (user_id, other_id)
-            )
-        """)
-
-def get_reaction_counts(c, db_type, item_type, item_id):
-    reactions = {"heart": 0, "pray": 0, "cross": 0}
-    if db_type == 'postgres':
-        c.execute("""
-            SELECT reaction, COUNT(*) AS cnt
-            FROM comment_reactions
-            WHERE item_type = %s AND item_id = %s
-            GROUP BY reaction
-        """, (item_type, item_id))
-    else:
-        c.execute("""
-            SELECT reaction, COUNT(*) AS cnt
+ReplyRecord = record_type('ReplyRecord', (
+    'id', 'user_id', 'text', 'timestamp', 'user_name', 'user_picture', 'user_role', 'avatar_decoration'))
+# Verse comments and community messages share one shape.
+PostRecord = record_type('PostRecord', (
+    'id', 'text', 'timestamp', 'user_name', 'user_picture', 'avatar_decoration', 'user_id', 'user_role',
+    'reactions', 'replies', 'reply_count'))
+
+# Batched thread loading: one set-based query per level for any number of
+# parents, chunked so IN lists stay under SQLite's bound-parameter limit.
+THREAD_IN_CHUNK = 500
+
+def _chunks(values, size=THREAD_IN_CHUNK):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def get_reaction_counts_for_items(c, db_type, item_type, item_ids):
+    """{item_id: {"heart": n, "pray": n, "cross": n}} for every id, in one grouped query per chunk."""
+    counts = {item_id: {"heart": 0, "pray": 0, "cross": 0} for item_id in item_ids}
+    for chunk in _chunks(counts):
+        for item_id, reaction, cnt in db_query(c, db_type, f"""
+            SELECT item_id, reaction, COUNT(*) AS cnt
             FROM comment_reactions
-            WHERE item_type = ? AND item_id = ?
-            GROUP BY reaction
-        """, (item_type, item_id))
-    for row in c.fetchall():
-        try:
-            key = str(row['reaction']).lower()
-            cnt = int(row['cnt'])
-        except Exception:
-            key = str(row[0]).lower()
-            cnt = int(row[1])
-        if key in reactions:
-            reactions[key] = cnt
-    return reactions
-
-def get_replies_for_parent(c, db_type, parent_type, parent_id):
-    if db_type == 'postgres':
-        c.execute("""
+            WHERE item_type = ? AND item_id IN ({sql_in(chunk)})
+            GROUP BY item_id, reaction
+        """, [item_type] + chunk):
+            reactions = counts.get(item_id)
+            key = str(reaction).lower()
+            if reactions is not None and key in reactions:
+                reactions[key] = int(cnt)
+    return counts
+
+def get_replies_for_parents(c, db_type, parent_type, parent_ids):
+    """{parent_id: [ReplyRecord, ...]} (oldest first) for every id, authors joined in."""
+    replies = {parent_id: [] for parent_id in parent_ids}
+    for chunk in _chunks(replies):
+        for row in db_query(c, db_type, f"""
             SELECT
-                r.id, r.user_id, r.text, r.timestamp, r.google_name, r.google_picture,
+                r.parent_id, r.id, r.user_id, r.text, r.timestamp, r.google_name, r.google_picture,
                 u.name AS db_name, COALESCE(u.custom_picture, u.picture) AS db_picture, u.role AS db_role,
                 u.avatar_decoration AS db_decor
             FROM comment_replies r
             LEFT JOIN users u ON r.user_id = u.id
-            WHERE r.parent_type = %s AND r.parent_id = %s AND COALESCE(r.is_deleted, 0) = 0
-            ORDER BY r.timestamp ASC
-        """, (parent_type, parent_id))
-    else:
-        c.execute("""
-            SELECT
-                r.id, r.user_id, r.text, r.timestamp, r.google_name, r.google_picture,
-                u.name AS db_name, COALESCE(u.custom_picture, u.picture) AS db_picture, u.role AS db_role,
-                u.avatar_decoration AS db_decor
-            FROM comment_replies r
-            LEFT JOIN users u ON r.user_id = u.id
-            WHERE r.parent_type = ? AND r.parent_id = ? AND COALESCE(r.is_deleted, 0) = 0
-            ORDER BY r.timestamp ASC
-        """, (parent_type, parent_id))
-    rows = c.fetchall()
-    replies = []
-    for row in rows:
-        try:
-            reply_id = row['id']
-            user_id = row['user_id']
-            text = row['text']
-            timestamp = row['timestamp']
-            google_name = row['google_name']
-            google_picture = row['google_picture']
-            db_name = row['db_name']
-            db_picture = row['db_picture']
-            db_role = row['db_role']
-            db_decor = row['db_decor']
-        except Exception:
-            reply_id = row[0]
-            user_id = row[1]
-            text = row[2]
-            timestamp = row[3]
-            google_name = row[4]
-            google_picture = row[5]
-            db_name = row[6] if len(row) > 6 else None
-            db_picture = row[7] if len(row) > 7 else None
-            db_role = row[8] if len(row) > 8 else None
-            db_decor = row[9] if len(row) > 9 else None
-        replies.append({
-            "id": reply_id,
-            "user_id": user_id,
-            "text": text or "",
-            "timestamp": timestamp,
-            "user_name": db_name or google_name or "Anonymous",
-            "user_picture": db_picture or google_picture or "",
-            "user_role": normalize_role(db_role or "user"),
-            "avatar_decoration": db_decor or ""
-        })
+            WHERE r.parent_type = ? AND r.parent_id IN ({sql_in(chunk)}) AND COALESCE(r.is_deleted, 0) = 0
+            ORDER BY r.parent_id, r.timestamp ASC
+        """, [parent_type] + chunk):
+            bucket = replies.get(row.parent_id)
+            if bucket is None:
+                continue
+            bucket.append(ReplyRecord(
+                id=row.id,
+                user_id=row.user_id,
+                text=row.text or "",
+                timestamp=row.timestamp,
+                user_name=row.db_name or row.google_name or "Anonymous",
+                user_picture=row.db_picture or row.google_picture or "",
+                user_role=normalize_role(row.db_role or "user"),
+                avatar_decoration=row.db_decor or ""
+            ))
     return replies
 
-def check_ban_status(user_id):
-    """Check if user is currently banned. Returns (is_banned, reason, expires_at)"""
-    global BAN_SCHEMA_READY
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
-    
+def get_reaction_counts(c, db_type, item_type, item_id):
+    return get_reaction_counts_for_items(c, db_type, item_type, [item_id])[item_id]
+
+def get_replies_for_parent(c, db_type, parent_type, parent_id):
+    return get_replies_for_parents(c, db_type, parent_type, [parent_id])[parent_id]
+
+MODERATION_CACHE_TTL = max(0.0, float(os.environ.get('MODERATION_CACHE_TTL', '30')))
+MODERATION_CACHE_MAX = max(100, int(os.environ.get('MODERATION_CACHE_MAX', '10000')))
+
+def _moderation_deadline(value):
+    """Naive UTC datetime for a ban/restriction expiry column, or None if unset or unreadable."""
+    if value is None or value == '':
+        return None
     try:
-        # Ensure ban columns exist for older databases (only once per process)
-        if not BAN_SCHEMA_READY:
-            try:
-                if db_type == 'postgres':
-                    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ban_expires_at TIMESTAMP")
-                    c.execute("ALTER TABLE users ADD COLUMN IF NOT EXISTS ban_reason TEXT")
-                else:
-                    try:
-                        c.execute("SELECT ban_expires_at FROM users LIMIT 1")
-                    except Exception:
-                        c.execute("ALTER TABLE users ADD COLUMN ban_expires_at TEXT")
-                    try:
-                        c.execute("SELECT ban_reason FROM users LIMIT 1")
-                    except Exception:
-                        c.execute("ALTER TABLE users ADD COLUMN ban_reason TEXT")
-                conn.commit()
-            except Exception:
-                pass
-            BAN_SCHEMA_READY = True
+        dt = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+class ModerationState:
+    """A user's ban and comment restriction as loaded from the database.
+
+    The expiry datetimes are checked on every read, so a temporary ban or
+    timeout lapses on time while the entry is still cached.
+    """
+    __slots__ = ('loaded_at', 'banned', 'ban_reason', 'ban_expires_at', 'ban_until',
+                 'restriction_reason', 'restriction_expires_at', 'restriction_until')
+
+    def __init__(self, loaded_at, banned=False, ban_reason=None, ban_expires_at=None,
+                 restriction_reason=None, restriction_expires_at=None):
+        self.loaded_at = loaded_at
+        self.banned = banned
+        self.ban_reason = ban_reason
+        self.ban_expires_at = ban_expires_at
+        self.ban_until = _moderation_deadline(ban_expires_at)
+        self.restriction_reason = restriction_reason
+        self.restriction_expires_at = restriction_expires_at
+        self.restriction_until = _moderation_deadline(restriction_expires_at)
+
+    def ban(self, now):
+        if self.banned and (self.ban_until is None or now <= self.ban_until):
+            return (True, self.ban_reason, self.ban_expires_at)
+        return (False, None, None)
 
-        if db_type == 'postgres':
-            c.execute("SELECT is_banned, ban_expires_at, ban_reason FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT is_banned, ban_expires_at, ban_reason FROM users WHERE id = ?", (user_id,))
-        
-        row = c.fetchone()
-        conn.close()
-        
+    def restriction(self, now):
+        if self.restriction_until is not None and now < self.restriction_until:
+            return (True, self.restriction_reason, self.restriction_expires_at)
+        return (False, None, None)
+
+class ModerationCache:
+    """Per-process ban/restriction state keyed by user id.
+
+    Entries are reloaded after MODERATION_CACHE_TTL seconds, dropped by
+    invalidate() when an admin changes a user, and cleared wholesale when
+    another worker bumps the 'moderation' cache version. Both advance
+    generation, so a load that raced them is returned but not cached.
+    """
+
+    def __init__(self, ttl=MODERATION_CACHE_TTL, max_entries=MODERATION_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.version = SharedVersion('moderation')
+
+    def get(self, user_id):
+        if self.version.changed():
+            self.clear()
+        entry = self.entries.get(user_id)
+        if entry is not None and time.monotonic() - entry.loaded_at < self.ttl:
+            return entry
+        generation = self.generation
+        entry = self._load(user_id)
+        if self.ttl:
+            with self.lock:
+                if self.generation != generation:
+                    return entry
+                self.entries.pop(user_id, None)
+                while len(self.entries) >= self.max_entries:
+                    self.entries.pop(next(iter(self.entries)))
+                self.entries[user_id] = entry
+        return entry
+
+    def _load(self, user_id):
+        loaded_at = time.monotonic()
+        with db_connection(readonly=True) as (conn, db_type):
+            row = db_query_one(conn, db_type, """
+                SELECT u.is_banned, u.ban_expires_at, u.ban_reason, r.reason AS restriction_reason,
+                       r.expires_at AS restriction_expires_at
+                FROM users u
+                LEFT JOIN comment_restrictions r ON r.user_id = u.id
+                WHERE u.id = ?
+            """, (user_id,))
         if not row:
-            return (False, None, None)
-        
-        try:
-            is_banned = bool(row['is_banned'])
-            expires_at = row['ban_expires_at']
-            reason = row['ban_reason']
-        except (TypeError, KeyError):
-            is_banned = bool(row[0])
-            expires_at = row[1]
-            reason = row[2]
-        
-        # Check if temporary ban expired
-        if is_banned and expires_at:
-            try:
-                expire_dt = datetime.fromisoformat(str(expires_at))
-                if datetime.now() > expire_dt:
-                    # Auto-unban
-                    conn, db_type = get_db()
-                    c = get_cursor(conn, db_type)
-                    if db_type == 'postgres':
-                        c.execute("UPDATE users SET is_banned = FALSE, ban_expires_at = NULL, ban_reason = NULL WHERE id = %s", (user_id,))
-                    else:
-                        c.execute("UPDATE users SET is_banned = 0, ban_expires_at = NULL, ban_reason = NULL WHERE id = ?", (user_id,))
-                    conn.commit()
-                    conn.close()
-                    return (False, None, None)
-            except:
-                pass
-        
-        return (is_banned, reason, expires_at)
+            return ModerationState(loaded_at)
+        entry = ModerationState(loaded_at, bool(row.is_banned), row.ban_reason, row.ban_expires_at,
+                                row.restriction_reason, row.restriction_expires_at)
+        if entry.banned and entry.ban_until is not None and utc_now() > entry.ban_until:
+            # Auto-unban
+            with db_connection() as (conn, db_type):
+                db_execute(conn, db_type, "UPDATE users SET is_banned = ?, ban_expires_at = NULL, ban_reason = NULL WHERE id = ?",
+                           (False, user_id))
+                conn.commit()
+            entry.banned, entry.ban_reason, entry.ban_expires_at, entry.ban_until = False, None, None, None
+        return entry
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.generation += 1
+            self.entries.pop(user_id, None)
+        self.version.bump()
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+_moderation_cache = ModerationCache()
+
+def invalidate_moderation_cache(user_id):
+    """Call after committing a change to a user's ban, restriction or role."""
+    _moderation_cache.invalidate(user_id)
+
+def check_ban_status(user_id):
+    """Check if user is currently banned. Returns (is_banned, reason, expires_at)"""
+    try:
+        return _moderation_cache.get(user_id).ban(utc_now())
     except Exception as e:
         logger.error(f"Ban check error: {e}")
-        conn.close()
         return (False, None, None)
 
 # Register admin blueprint
 from admin import admin_bp
 app.register_blueprint(admin_bp)
 
+BIBLE_CORPUS_DIR = os.environ.get('BIBLE_CORPUS_DIR') or os.path.join(BASE_DIR, 'corpus')
+BIBLE_REMOTE_FALLBACK = str(os.environ.get('BIBLE_REMOTE_FALLBACK', '1')).strip().lower() not in ('0', 'false', 'no', 'off')
+BIBLE_CORPUS_RECHECK = max(1.0, float(os.environ.get('BIBLE_CORPUS_RECHECK', '60')))
+BIBLE_TRANSLATION_NAMES = {'web': 'World English Bible', 'kjv': 'King James Version'}
+BOOK_KEY_ALIASES = {'psalm': 'psalms', 'songofsongs': 'songofsolomon', 'canticles': 'songofsolomon', 'song': 'songofsolomon'}
+
+def _book_key(name):
+    key = re.sub(r'[^0-9a-z]', '', str(name or '').lower())
+    return BOOK_KEY_ALIASES.get(key, key)
+
+CANONICAL_BOOK_INDEX = {}
+for _index, _book in enumerate(FALLBACK_BOOKS):
+    CANONICAL_BOOK_INDEX[_book_key(_book['name'])] = _index
+    CANONICAL_BOOK_INDEX[_book_key(_book['id'])] = _index
+
+class BibleCorpus:
+    """One imported translation, memory-mapped from BIBLE_CORPUS_DIR.
+
+    <id>.txt   every verse's UTF-8 text, concatenated in canonical order
+    <id>.idx   native uint32 offsets into .txt: one per verse plus the end
+    <id>.json  translation name, books with per-chapter verse counts, and the
+               verse numbers of the few chapters that do not run 1..n
+
+    A chapter is a dict lookup plus slices of the mapped text; nothing is
+    parsed or fetched per request.
+    """
+
+    def __init__(self, translation_id, directory=BIBLE_CORPUS_DIR):
+        base = os.path.join(directory, translation_id)
+        with open(base + '.json', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.translation_id = meta['translation_id']
+        self.translation_name = meta['translation_name']
+        self.books = meta['books']
+        self.verse_numbers = meta.get('verse_numbers', {})
+        self.mtime = os.stat(base + '.json').st_mtime
+        with open(base + '.txt', 'rb') as f:
+            self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with open(base + '.idx', 'rb') as f:
+            self._index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = memoryview(self._index).cast('I')
+        self.chapters = {}        # (book key, chapter) -> (book, chapter, first verse index, verse count)
+        self.book_starts = []     # first verse index of each book
+        self.chapter_starts = []  # per book, first verse index of each chapter
+        self._matches = {}
+        first = 0
+        for book in self.books:
+            book['number'] = CANONICAL_BOOK_INDEX[_book_key(book['id'])] + 1
+            self.book_starts.append(first)
+            starts = []
+            for number, count in enumerate(book['chapters'], 1):
+                entry = (book, number, first, count)
+                self.chapters[(_book_key(book['name']), number)] = entry
+                self.chapters[(_book_key(book['id']), number)] = entry
+                starts.append(first)
+                first += count
+            self.chapter_starts.append(starts)
+        self.verse_count = first
+        if len(self.offsets) != self.verse_count + 1:
+            raise ValueError(f"{base}.idx holds {len(self.offsets) - 1} verses, metadata expects {self.verse_count}")
+
+    def chapter(self, book, chapter):
+        """bible-api.com shaped chapter payload, or None if the book/chapter is not in this translation."""
+        entry = self.chapters.get((_book_key(book), chapter))
+        if entry is None:
+            return None
+        book, number, first, count = entry
+        offsets, text = self.offsets, self._text
+        numbers = self.verse_numbers.get(f"{book['id']} {number}") or range(1, count + 1)
+        verses = [{
+            "book_id": book['id'],
+            "book_name": book['name'],
+            "chapter": number,
+            "verse": verse,
+            "text": text[offsets[first + i]:offsets[first + i + 1]].decode('utf-8')
+        } for i, verse in enumerate(numbers)]
+        return {
+            "reference": f"{book['name']} {number}",
+            "translation": self.translation_name,
+            "translation_id": self.translation_id,
+            "verses": verses,
+            "text": ' '.join(v['text'] for v in verses)
+        }
+
+    def book_list(self):
+        return [{"id": b['id'], "name": b['name'], "chapters": len(b['chapters'])} for b in self.books]
+
+    def locate(self, index):
+        """(book, chapter, verse) of the index-th verse."""
+        position = bisect_right(self.book_starts, index) - 1
+        book, starts = self.books[position], self.chapter_starts[position]
+        chapter = bisect_right(starts, index)   # empty chapters share the next one's start
+        offset = index - starts[chapter - 1]
+        numbers = self.verse_numbers.get(f"{book['id']} {chapter}")
+        return book, chapter, numbers[offset] if numbers else offset + 1
+
+    def verse_key(self, index):
+        """Stable verses.corpus_key: '<translation>:BBCCCVVV' from the canonical book number, chapter and verse."""
+        book, chapter, verse = self.locate(index)
+        return f"{self.translation_id}:{book['number'] * 1000000 + chapter * 1000 + verse}"
+
+    def verse_at(self, index):
+        """The index-th verse shaped like the generator's verse data."""
+        book, chapter, verse = self.locate(index)
+        return {
+            "corpus_key": self.verse_key(index),
+            "ref": f"{book['name']} {chapter}:{verse}",
+            "text": self._text[self.offsets[index]:self.offsets[index + 1]].decode('utf-8'),
+            "trans": self.translation_id.upper(),
+            "source": "Local corpus",
+            "book": book['name']
+        }
+
+    def matching(self, keywords):
+        """Indices of verses containing any keyword (case-insensitive substring), cached per keyword list."""
+        key = tuple(keywords)
+        found = self._matches.get(key)
+        if found is None:
+            pattern = re.compile('|'.join(re.escape(k) for k in keywords).encode('utf-8'), re.I)
+            found, last = [], -1
+            for match in pattern.finditer(self._text):
+                index = bisect_right(self.offsets, match.start()) - 1
+                # Verses are packed without separators; skip matches straddling two of them.
+                if index != last and match.end() <= self.offsets[index + 1]:
+                    found.append(index)
+                    last = index
+            self._matches[key] = found
+        return found
+
+_corpora = {}   # translation -> (checked_at, BibleCorpus or None)
+_corpora_lock = threading.Lock()
+
+def get_bible_corpus(translation):
+    """The imported corpus for a translation, or None; new or re-imported files are picked up within BIBLE_CORPUS_RECHECK seconds."""
+    translation = re.sub(r'[^0-9a-z_-]', '', str(translation or '').lower())
+    if not translation:
+        return None
+    now = time.monotonic()
+    cached = _corpora.get(translation)
+    if cached is not None and now - cached[0] < BIBLE_CORPUS_RECHECK:
+        return cached[1]
+    with _corpora_lock:
+        cached = _corpora.get(translation)
+        if cached is not None and now - cached[0] < BIBLE_CORPUS_RECHECK:
+            return cached[1]
+        corpus = cached[1] if cached else None
+        meta_path = os.path.join(BIBLE_CORPUS_DIR, translation + '.json')
+        try:
+            mtime = os.stat(meta_path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime is None:
+            corpus = None
+        elif corpus is None or corpus.mtime != mtime:
+            try:
+                corpus = BibleCorpus(translation)
+                logger.info(f"Loaded Bible corpus {translation}: {corpus.verse_count} verses")
+            except Exception as e:
+                logger.error(f"Failed to load Bible corpus {translation}: {e}")
+                corpus = None
+        _corpora[translation] = (now, corpus)
+        return corpus
+
+GENERATOR_SOURCE = str(os.environ.get('GENERATOR_SOURCE', 'auto')).strip().lower()   # auto | corpus | remote
+# 0 keeps the verse generator thread (and its upstream fetches) off, e.g. for scripts that only import app.
+GENERATOR_THREAD = str(os.environ.get('GENERATOR_THREAD', '1')).strip().lower() in ('1', 'true', 'yes', 'on')
+GENERATOR_CORPUS_TRANSLATION = (os.environ.get('GENERATOR_CORPUS_TRANSLATION') or DEFAULT_TRANSLATION).lower()
+GENERATOR_BOOK_WEIGHTS = os.environ.get('GENERATOR_BOOK_WEIGHTS', '')   # e.g. "NT=2,OT=1,PSA=3"
+GENERATOR_NO_REPEAT = max(0, int(os.environ.get('GENERATOR_NO_REPEAT', '1000')))
+
+def parse_book_weights(spec):
+    """'NT=2,OT=1,PSA=3' -> {'nt': 2.0, 'ot': 1.0, 'psa': 3.0}; books may be given by id or name."""
+    weights = {}
+    for part in str(spec or '').split(','):
+        key, sep, value = part.partition('=')
+        if not sep:
+            continue
+        try:
+            weights[_book_key(key)] = max(0.0, float(value))
+        except ValueError:
+            logger.warning(f"Ignoring book weight {part.strip()!r}")
+    return weights
+
+class CorpusVerseSampler:
+    """Random verses from a BibleCorpus, weighted per book or testament.
+
+    A book's chance is its weight times its verse count, so equal weights
+    make every verse equally likely. The generator's picks are not repeated
+    within the last `window` draws.
+    """
+
+    def __init__(self, corpus, weights=None, window=GENERATOR_NO_REPEAT):
+        self.corpus = corpus
+        self.window = min(window, corpus.verse_count // 2)
+        self.recent = deque()
+        self.recent_set = set()
+        self.lock = threading.Lock()
+        self.book_counts = [sum(book['chapters']) for book in corpus.books]
+        weights = weights or {}
+        self.cumulative, total = [], 0.0
+        for book, count in zip(corpus.books, self.book_counts):
+            total += count * self._weight(book, weights)
+            self.cumulative.append(total)
+        if total <= 0:
+            self.cumulative = list(accumulate(self.book_counts))
+            total = self.cumulative[-1]
+        self.total = total
+        self.samples = 0
+        self.redraws = 0
+
+    @staticmethod
+    def _weight(book, weights):
+        for key in (_book_key(book['id']), _book_key(book['name'])):
+            if key in weights:
+                return weights[key]
+        return weights.get('ot' if book['number'] <= 39 else 'nt', 1.0)
+
+    def book_positions(self, names):
+        keys = {_book_key(name) for name in names if name}
+        return [i for i, book in enumerate(self.corpus.books)
+                if _book_key(book['id']) in keys or _book_key(book['name']) in keys]
+
+    def _draw(self, books):
+        if books:
+            position = random.choice(books)
+        else:
+            position = min(bisect_right(self.cumulative, random.random() * self.total), len(self.cumulative) - 1)
+        return self.corpus.book_starts[position] + random.randrange(self.book_counts[position])
+
+    def sample(self, books=None, exclude=(), remember=True):
+        """One verse; books limits the draw to those corpus book positions.
+
+        exclude holds corpus keys that must not come back; None if every
+        draw hit one. The no-repeat window is best effort.
+        """
+        with self.lock:
+            for _ in range(20):
+                index = self._draw(books)
+                excluded = bool(exclude) and self.corpus.verse_key(index) in exclude
+                if not excluded and index not in self.recent_set:
+                    break
+                self.redraws += 1
+            if excluded:
+                return None
+            self.samples += 1
+            if remember and self.window:
+                self.recent.append(index)
+                self.recent_set.add(index)
+                while len(self.recent) > self.window:
+                    self.recent_set.discard(self.recent.popleft())
+        return self.corpus.verse_at(index)
+
+    def search(self, keywords, exclude=()):
+        """A random verse containing one of the keywords, or None."""
+        found = self.corpus.matching(keywords)
+        if not found:
+            return None
+        for _ in range(20):
+            index = random.choice(found)
+            if not exclude or self.corpus.verse_key(index) not in exclude:
+                return self.corpus.verse_at(index)
+        return None
+
+    def stats(self):
+        return {
+            "translation": self.corpus.translation_id,
+            "verses": self.corpus.verse_count,
+            "window": self.window,
+            "samples": self.samples,
+            "redraws": self.redraws
+        }
+
+_corpus_sampler = None
+
+def corpus_sampler():
+    """Sampler over the generator's corpus translation, or None when that is not imported (or GENERATOR_SOURCE=remote)."""
+    global _corpus_sampler
+    if GENERATOR_SOURCE == 'remote':
+        return None
+    corpus = get_bible_corpus(GENERATOR_CORPUS_TRANSLATION)
+    if corpus is None:
+        return None
+    sampler = _corpus_sampler
+    if sampler is None or sampler.corpus is not corpus:
+        sampler = _corpus_sampler = CorpusVerseSampler(corpus, parse_book_weights(GENERATOR_BOOK_WEIGHTS))
+    return sampler
+
+def ensure_verse_row(conn, db_type, verse):
+    """verses.id for a corpus verse, inserting its row (keyed by corpus_key) on first use.
+
+    The row gets an ordinary id; commits on conn when it inserts.
+    """
+    row = db_query_one(conn, db_type, "SELECT id FROM verses WHERE corpus_key = ?", (verse['corpus_key'],))
+    if row is None:
+        db_execute(conn, db_type, """
+            INSERT INTO verses (reference, text, translation, source, timestamp, book, corpus_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (corpus_key) DO NOTHING
+        """, (verse['ref'], verse['text'], verse['trans'], verse['source'],
+              utc_now().isoformat(), verse['book'], verse['corpus_key']))
+        conn.commit()
+        row = db_query_one(conn, db_type, "SELECT id FROM verses WHERE corpus_key = ?", (verse['corpus_key'],))
+    return row.id if row is not None else None
+
+def corpus_keys_for(conn, db_type, verse_ids):
+    """corpus_key of each of these verses.id that came from the local corpus."""
+    if not verse_ids:
+        return set()
+    return {row.corpus_key for row in db_query(conn, db_type, f"""
+        SELECT corpus_key FROM verses WHERE id IN ({sql_in(verse_ids)}) AND corpus_key IS NOT NULL
+    """, list(verse_ids))}
+
+GENERATOR_LEASE_LOCK_ID = 470114  # pg advisory lock key held by the one fetching process
+GENERATOR_LOCK_PATH = os.environ.get('GENERATOR_LOCK_PATH') or SQLITE_PATH + '.generator.lock'
+GENERATOR_LEASE_RETRY = max(1.0, float(os.environ.get('GENERATOR_LEASE_RETRY', '5')))
+GENERATOR_LEASE_CHECK = max(1.0, float(os.environ.get('GENERATOR_LEASE_CHECK', '15')))
+GENERATOR_FOLLOW_POLL = max(0.5, float(os.environ.get('GENERATOR_FOLLOW_POLL', '5')))
+GENERATOR_PREFETCH_LEAD = max(1.0, float(os.environ.get('GENERATOR_PREFETCH_LEAD', '15')))
+GENERATOR_STATE_KEY = 'current'
+
+class GeneratorLease:
+    """Exclusive right to fetch verses, held until the process exits.
+
+    Postgres deployments take a session advisory lock on a dedicated
+    connection; SQLite ones flock a file next to the database. Both are
+    dropped by the server/kernel when the holder dies, so a follower picks
+    the lease up on its next retry. Without fcntl (Windows) every process leads.
+    """
+
+    def __init__(self, lock_id=GENERATOR_LEASE_LOCK_ID, path=GENERATOR_LOCK_PATH):
+        self.lock_id = lock_id
+        self.path = path
+        self.held = False
+        self.backend = None
+        self.acquired_at = None
+        self.acquired = 0
+        self.lost = 0
+        self._handle = None    # pg connection or lock file, kept open between attempts
+        self._inherited = None
+        self._pid = os.getpid()
+        self._attempted_at = float('-inf')
+        self._checked_at = float('-inf')
+
+    @property
+    def holder(self):
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def acquire(self):
+        """True while this process holds the lease; otherwise retried every GENERATOR_LEASE_RETRY seconds."""
+        if self._pid != os.getpid():
+            # The parent still owns whatever it held; closing its connection here would end its session.
+            self._inherited, self._handle = self._handle, None
+            self.held, self._pid = False, os.getpid()
+            self._attempted_at = float('-inf')
+        now = time.monotonic()
+        if self.held:
+            if now - self._checked_at >= GENERATOR_LEASE_CHECK:
+                self._checked_at = now
+                if not self._alive():
+                    logger.warning(f"Generator lease lost by {self.holder}")
+                    self.held = False
+                    self.lost += 1
+                    self.close()
+            return self.held
+        if now - self._attempted_at < GENERATOR_LEASE_RETRY:
+            return False
+        self._attempted_at = now
+        try:
+            self.held = self._try_lock()
+        except Exception as e:
+            logger.warning(f"Generator lease attempt failed: {e}")
+            self.close()
+        if self.held:
+            self._checked_at = now
+            self.acquired_at = utc_now()
+            self.acquired += 1
+            logger.info(f"Generator lease acquired by {self.holder} ({self.backend})")
+        return self.held
+
+    def _try_lock(self):
+        if self.backend is None:
+            conn, self.backend = get_db(readonly=True)
+            conn.close()
+        if self.backend == 'postgres':
+            if self._handle is None:
+                self._handle = _get_pg_pool()._connect()
+                self._handle.autocommit = True
+            cur = self._handle.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+            return bool(cur.fetchone()[0])
+        if fcntl is None:
+            return True
+        if self._handle is None:
+            self._handle = open(self.path, 'a')
+        try:
+            fcntl.flock(self._handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _alive(self):
+        if self.backend != 'postgres':
+            return True
+        try:
+            cur = self._handle.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        """Give the lease up; exiting closes the handle so a follower can take over right away."""
+        handle, self._handle = self._handle, None
+        self.held = False
+        if handle is not None:
+            try:
+                handle.close()
+            except Exception:
+                pass
+
+    def stats(self):
+        return {
+            "holder": self.holder,
+            "backend": self.backend,
+            "held": self.held,
+            "acquired": self.acquired,
+            "lost": self.lost,
+            "acquired_at": self.acquired_at.isoformat() if self.acquired_at else None
+        }
+
+VERSE_SOURCE_TIMEOUT = max(1.0, float(os.environ.get('VERSE_SOURCE_TIMEOUT', '10')))
+VERSE_SOURCE_EWMA_ALPHA = min(1.0, max(0.01, float(os.environ.get('VERSE_SOURCE_EWMA_ALPHA', '0.2'))))
+VERSE_HEDGE_DEFAULT = max(0.05, float(os.environ.get('VERSE_HEDGE_DEFAULT', '1.5')))
+VERSE_HEDGE_MIN = max(0.05, float(os.environ.get('VERSE_HEDGE_MIN', '0.25')))
+VERSE_HEDGE_MAX = max(VERSE_HEDGE_MIN, float(os.environ.get('VERSE_HEDGE_MAX', '4')))
+VERSE_CIRCUIT_FAILURES = max(1, int(os.environ.get('VERSE_CIRCUIT_FAILURES', '3')))
+VERSE_CIRCUIT_COOLDOWN = max(1.0, float(os.environ.get('VERSE_CIRCUIT_COOLDOWN', '30')))
+VERSE_BUFFER_SIZE = max(0, int(os.environ.get('VERSE_BUFFER_SIZE', '3')))
+
+class VerseSource:
+    """One random-verse API plus its health: latency/error EWMA and circuit state."""
+
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        self.latency = None          # EWMA seconds over successful calls
+        self.error_rate = 0.0        # EWMA of failures, 0..1
+        self.samples = deque(maxlen=64)
+        self.state = 'closed'        # closed -> open -> half_open -> closed/open
+        self.open_until = 0.0
+        self.failures = 0            # consecutive
+        self.trips = 0
+        self.requests = 0
+        self.successes = 0
+        self.last_error = None
+
+    def available(self, now):
+        if self.state == 'closed':
+            return True
+        return self.state == 'open' and now >= self.open_until
+
+    def score(self):
+        latency = self.latency if self.latency is not None else VERSE_HEDGE_DEFAULT
+        return latency * (1 + 4 * self.error_rate)
+
+    def hedge_delay(self):
+        """How long to wait on this source before asking the next one: its recent p95."""
+        if len(self.samples) < 5:
+            return VERSE_HEDGE_DEFAULT
+        samples = sorted(self.samples)
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(VERSE_HEDGE_MAX, max(VERSE_HEDGE_MIN, p95))
+
+    def stats(self):
+        samples = sorted(self.samples)
+        return {
+            "state": self.state,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1) if samples else None,
+            "error_rate": round(self.error_rate, 3),
+            "failures": self.failures,
+            "trips": self.trips,
+            "requests": self.requests,
+            "successes": self.successes,
+            "last_error": self.last_error
+        }
+
+class VerseSourcePool:
+    """Hedged verse fetching across VerseSources, plus a small buffer of ready verses.
+
+    fetch() asks the best-scoring source first and, if it has not answered
+    within that source's p95 latency, the next one in parallel; the first
+    good answer wins and slower calls still finish to update their stats.
+    A source failing VERSE_CIRCUIT_FAILURES times in a row is skipped for a
+    cooldown that doubles on every trip, then gets a single trial call.
+    take() serves from the buffer and tops it up in the background.
+    """
+
+    def __init__(self, networks, parse, buffer_size=VERSE_BUFFER_SIZE, timeout=VERSE_SOURCE_TIMEOUT):
+        self.sources = [VerseSource(network['name'], network['url']) for network in networks]
+        self.parse = parse
+        self.buffer_size = buffer_size
+        self.timeout = timeout
+        self.ready = deque()
+        self.refilling = False
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=2 * len(self.sources), thread_name_prefix='verse-source')
+        self.fetches = 0
+        self.hedged = 0
+        self.failed = 0
+        self.buffer_hits = 0
+        self.buffer_misses = 0
+
+    def _candidates(self):
+        now = time.monotonic()
+        with self.lock:
+            return sorted((s for s in self.sources if s.available(now)), key=VerseSource.score)
+
+    def _call(self, source):
+        with self.lock:
+            if source.state == 'open':
+                source.state = 'half_open'
+        started = time.monotonic()
+        verse, error = None, None
+        try:
+            r = source.session.get(source.url, timeout=self.timeout)
+            if r.status_code == 200:
+                verse = self.parse(r.json(), source.name)
+            else:
+                error = f"HTTP {r.status_code}"
+        except Exception as e:
+            error = str(e)
+        if verse is None and error is None:
+            error = "empty verse"
+        self._record(source, time.monotonic() - started, error)
+        if error:
+            logger.error(f"Fetch error from {source.name}: {error}")
+        return verse
+
+    def _record(self, source, elapsed, error):
+        alpha = VERSE_SOURCE_EWMA_ALPHA
+        with self.lock:
+            source.requests += 1
+            source.error_rate = alpha * (1.0 if error else 0.0) + (1 - alpha) * source.error_rate
+            if error:
+                source.failures += 1
+                source.last_error = error
+                if source.state == 'half_open' or source.failures >= VERSE_CIRCUIT_FAILURES:
+                    source.trips += 1
+                    source.state = 'open'
+                    cooldown = VERSE_CIRCUIT_COOLDOWN * 2 ** min(source.trips - 1, 5)
+                    source.open_until = time.monotonic() + cooldown
+                    logger.warning(f"Verse source {source.name} circuit open for {cooldown:.0f}s")
+                return
+            source.successes += 1
+            source.latency = elapsed if source.latency is None else alpha * elapsed + (1 - alpha) * source.latency
+            source.samples.append(elapsed)
+            source.failures = 0
+            if source.state != 'closed':
+                source.state, source.trips = 'closed', 0
+                logger.info(f"Verse source {source.name} circuit closed")
+
+    def fetch(self):
+        """One verse from the healthiest sources, or None if every available one failed."""
+        remaining = self._candidates()
+        deadline = time.monotonic() + self.timeout
+        pending = {}
+        launch, hedge_at = True, deadline
+        with self.lock:
+            self.fetches += 1
+        while True:
+            if launch and remaining:
+                source = remaining.pop(0)
+                if pending:
+                    with self.lock:
+                        self.hedged += 1
+                pending[self.executor.submit(self._call, source)] = source
+                hedge_at = time.monotonic() + source.hedge_delay()
+                launch = False
+            now = time.monotonic()
+            if not pending or now >= deadline:
+                break
+            timeout = deadline - now
+            if remaining:
+                timeout = min(timeout, max(0.0, hedge_at - now))
+            done, _ = wait_futures(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.pop(future)
+                verse = future.result()
+                if verse is not None:
+                    return verse
+            # A failed answer hands over to the next source right away.
+            launch = bool(done) or time.monotonic() >= hedge_at
+        with self.lock:
+            self.failed += 1
+        return None
+
+    def take(self):
+        """A buffered verse if one is ready, else a live fetch; None if both come up empty."""
+        with self.lock:
+            verse = self.ready.popleft() if self.ready else None
+            if verse is not None:
+                self.buffer_hits += 1
+            else:
+                self.buffer_misses += 1
+        if verse is None:
+            verse = self.fetch()
+        self.refill()
+        return verse
+
+    def refill(self):
+        with self.lock:
+            if self.refilling or len(self.ready) >= self.buffer_size:
+                return
+            self.refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def _refill(self):
+        try:
+            for _ in range(self.buffer_size * 2):
+                verse = self.fetch()
+                if verse is None:
+                    break
+                with self.lock:
+                    if all(v['ref'] != verse['ref'] for v in self.ready):
+                        self.ready.append(verse)
+                    if len(self.ready) >= self.buffer_size:
+                        break
+        except Exception as e:
+            # Also covers interpreter shutdown, when the executor refuses new work.
+            logger.warning(f"Verse buffer refill failed: {e}")
+        finally:
+            with self.lock:
+                self.refilling = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "buffered": len(self.ready),
+                "fetches": self.fetches,
+                "hedged": self.hedged,
+                "failed": self.failed,
+                "buffer_hits": self.buffer_hits,
+                "buffer_misses": self.buffer_misses,
+                "sources": {s.name: s.stats() for s in self.sources}
+            }
+
 class BibleGenerator:
     def __init__(self):
         self.running = True
         self.interval = self._load_interval_from_db()
-        self.time_left = self.interval
+        self.deadline = time.monotonic() + self.interval
         self.current_verse = None
         self.total_verses = 0
         self.session_id = secrets.token_hex(8)
         self.thread = None
         self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.schedule_seq = 0       # bumped whenever the deadline moves for a reason other than time
+        self.prefetched = None
+        self.lease = GeneratorLease()
+        self.leading = False
+        self.state_version = None
+        self.rotates_at = time.time() + self.interval   # wall clock twin of deadline, shared with the other processes
+        self.synced_at = float('-inf')
         
         # Fallback verses in case API fails
         self.fallback_verses = [
@@ -1143,31 +3368,19 @@ class BibleGenerator:
         
         # Try to load most recent verse from database first
         try:
-            conn, db_type = get_db()
-            c = get_cursor(conn, db_type)
-            c.execute("SELECT id, reference, text, translation, source, book FROM verses ORDER BY timestamp DESC LIMIT 1")
-            row = c.fetchone()
-            conn.close()
+            with db_connection(readonly=True) as (conn, db_type):
+                row = db_query_one(conn, db_type, "SELECT id, reference, text, translation, source, book FROM verses ORDER BY timestamp DESC LIMIT 1")
             
             if row:
                 # Use most recent verse from database
-                try:
-                    verse_id = row['id'] if hasattr(row, 'keys') else row[0]
-                    ref = row['reference'] if hasattr(row, 'keys') else row[1]
-                    text = row['text'] if hasattr(row, 'keys') else row[2]
-                    trans = row['translation'] if hasattr(row, 'keys') else row[3]
-                    source = row['source'] if hasattr(row, 'keys') else row[4]
-                    book = row['book'] if hasattr(row, 'keys') else row[5]
-                except:
-                    verse_id, ref, text, trans, source, book = row
-                
+                ref = row.reference
                 self.current_verse = {
-                    "id": verse_id,
+                    "id": row.id,
                     "ref": ref,
-                    "text": text,
-                    "trans": trans,
-                    "source": source,
-                    "book": book,
+                    "text": row.text,
+                    "trans": row.translation,
+                    "source": row.source,
+                    "book": row.book,
                     "is_new": False,
                     "session_id": self.session_id
                 }
@@ -1187,9 +3400,7 @@ class BibleGenerator:
             {"name": "labs.bible.org", "url": "https://labs.bible.org/api/?passage=random&type=json"},
             {"name": "KJV Random", "url": "https://bible-api.com/?random=verse&translation=kjv"}
         ]
-        self.network_idx = 0
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'Mozilla/5.0'})
+        self.sources = VerseSourcePool(self.networks, parse=self.parse_verse)
         
         # Start thread
         self.start_thread()
@@ -1197,26 +3408,12 @@ class BibleGenerator:
     def _load_interval_from_db(self):
         """Load verse interval from database, default to 60 seconds"""
         try:
-            conn, db_type = get_db()
-            c = conn.cursor()
-            
-            # Ensure table exists
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS system_settings (
-                    key TEXT PRIMARY KEY,
-                    value TEXT,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-            
-            # Get verse_interval setting
-            c.execute("SELECT value FROM system_settings WHERE key = 'verse_interval'")
-            row = c.fetchone()
-            conn.close()
+            with db_connection(readonly=True) as (conn, db_type):
+                # Get verse_interval setting
+                row = db_query_one(conn, db_type, "SELECT value FROM system_settings WHERE key = 'verse_interval'")
             
             if row:
-                interval = int(row[0])
+                interval = int(row.value)
                 logger.info(f"Loaded verse interval from database: {interval} seconds")
                 return interval
         except Exception as e:
@@ -1226,6 +3423,8 @@ class BibleGenerator:
     
     def start_thread(self):
         """Start or restart the generator thread"""
+        if not GENERATOR_THREAD:
+            return
         if self.thread is None or not self.thread.is_alive():
             self.thread = threading.Thread(target=self.loop)
             self.thread.daemon = True
@@ -1235,47 +3434,47 @@ class BibleGenerator:
     def set_interval(self, seconds):
         with self.lock:
             self.interval = max(10, min(3600, int(seconds)))
-            self.time_left = min(self.time_left, self.interval)
+            self.deadline = min(self.deadline, time.monotonic() + self.interval)
+            self._deadline_moved()
+            self.schedule_seq += 1
+            self.wakeup.notify_all()
+        if self.leading:
+            self.publish_state()
     
     def extract_book(self, ref):
         match = re.match(r'^([0-9]?\s?[A-Za-z]+)', ref)
         return match.group(1) if match else "Unknown"
     
+    def parse_verse(self, data, source):
+        """Verse data from one API response, or None if it carried no verse"""
+        if isinstance(data, list):
+            data = data[0]
+            ref = f"{data['bookname']} {data['chapter']}:{data['verse']}"
+            text = data['text']
+            trans = "WEB"
+        else:
+            ref = data.get('reference', 'Unknown')
+            text = data.get('text', '').strip()
+            trans = data.get('translation_name', 'KJV')
+        if not (text and ref):
+            return None
+        return {
+            "ref": ref,
+            "text": text,
+            "trans": trans,
+            "source": source,
+            "book": self.extract_book(ref)
+        }
+
     def fetch_verse(self):
-        """Fetch a new verse from API or use fallback"""
-        network = self.networks[self.network_idx]
-        verse_data = None
-        
-        try:
-            r = self.session.get(network["url"], timeout=10)
-            if r.status_code == 200:
-                data = r.json()
-                if isinstance(data, list):
-                    data = data[0]
-                    ref = f"{data['bookname']} {data['chapter']}:{data['verse']}"
-                    text = data['text']
-                    trans = "WEB"
-                else:
-                    ref = data.get('reference', 'Unknown')
-                    text = data.get('text', '').strip()
-                    trans = data.get('translation_name', 'KJV')
-                
-                if text and ref:
-                    book = self.extract_book(ref)
-                    verse_data = {
-                        "ref": ref,
-                        "text": text,
-                        "trans": trans,
-                        "source": network["name"],
-                        "book": book
-                    }
-        except Exception as e:
-            logger.error(f"Fetch error from {network['name']}: {e}")
-        
-        # Rotate network for next time
-        self.network_idx = (self.network_idx + 1) % len(self.networks)
+        """Next verse from the local corpus, the source pool or a fallback; returns it without storing it"""
+        sampler = corpus_sampler()
+        if sampler is not None:
+            return sampler.sample()
+        # GENERATOR_SOURCE=corpus never touches the network, even before the corpus is imported.
+        verse_data = self.sources.take() if GENERATOR_SOURCE != 'corpus' else None
         
-        # If API failed, use fallback
+        # If every source failed and nothing was buffered, use fallback
         if not verse_data:
             logger.warning("Using fallback verse")
             fallback = random.choice(self.fallback_verses)
@@ -1287,123 +3486,277 @@ class BibleGenerator:
                 "book": fallback['book']
             }
         
-        # Store in database
-        try:
-            conn, db_type = get_db()
-            c = get_cursor(conn, db_type)
-            
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO verses (reference, text, translation, source, timestamp, book) 
-                    VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT DO NOTHING
-                """, (verse_data['ref'], verse_data['text'], verse_data['trans'], 
-                      verse_data['source'], datetime.now().isoformat(), verse_data['book']))
-            else:
-                c.execute("INSERT OR IGNORE INTO verses (reference, text, translation, source, timestamp, book) VALUES (?, ?, ?, ?, ?, ?)",
-                          (verse_data['ref'], verse_data['text'], verse_data['trans'], 
-                           verse_data['source'], datetime.now().isoformat(), verse_data['book']))
-            
+        return verse_data
+
+    def store_verse(self, verse_data):
+        """Insert the verse (if new) and return its id"""
+        with db_connection() as (conn, db_type):
+            if verse_data.get('corpus_key'):
+                verse_id = ensure_verse_row(conn, db_type, verse_data)
+                if verse_id is not None:
+                    return verse_id
+            db_execute(conn, db_type, """
+                INSERT INTO verses (reference, text, translation, source, timestamp, book)
+                VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING
+            """, (verse_data['ref'], verse_data['text'], verse_data['trans'],
+                  verse_data['source'], utc_now().isoformat(), verse_data['book']))
             conn.commit()
-            
-            # Get the ID
-            if db_type == 'postgres':
-                c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", 
-                         (verse_data['ref'], verse_data['text']))
-            else:
-                c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", 
-                         (verse_data['ref'], verse_data['text']))
-            
-            result = c.fetchone()
-            try:
-                verse_id = result['id'] if result else random.randint(1000, 9999)
-            except (TypeError, KeyError):
-                verse_id = result[0] if result else random.randint(1000, 9999)
-            
-            # Update session
-            self.session_id = secrets.token_hex(8)
-            
-            conn.close()
-            
-            with self.lock:
-                self.current_verse = {
-                    "id": verse_id,
-                    "ref": verse_data['ref'],
-                    "text": verse_data['text'],
-                    "trans": verse_data['trans'],
-                    "source": verse_data['source'],
-                    "book": verse_data['book'],
-                    "is_new": True,
-                    "session_id": self.session_id
-                }
-                self.total_verses += 1
-                
-            logger.info(f"New verse fetched: {verse_data['ref']}")
-            return True
-            
+            verse_id = db_scalar(conn, db_type, "SELECT id FROM verses WHERE reference = ? AND text = ?",
+                                 (verse_data['ref'], verse_data['text']))
+        return verse_id if verse_id is not None else random.randint(1000, 9999)
+
+    def rotate(self):
+        """Show the prefetched verse (fetching one now if the prefetch never ran) and move the deadline on"""
+        verse_data, self.prefetched = self.prefetched, None
+        if verse_data is None:
+            verse_data = self.fetch_verse()
+        try:
+            verse_id = self.store_verse(verse_data)
         except Exception as e:
-            logger.error(f"Database error in fetch_verse: {e}")
+            logger.error(f"Database error storing verse: {e}")
             # Still update current_verse even if DB fails
-            with self.lock:
-                self.current_verse = {
-                    "id": random.randint(1000, 9999),
-                    "ref": verse_data['ref'],
-                    "text": verse_data['text'],
-                    "trans": verse_data['trans'],
-                    "source": verse_data['source'],
-                    "book": verse_data['book'],
-                    "is_new": True,
-                    "session_id": secrets.token_hex(8)
-                }
-            return True
-    
+            verse_id = random.randint(1000, 9999)
+        with self.lock:
+            self.session_id = secrets.token_hex(8)
+            self.current_verse = {
+                "id": verse_id,
+                "ref": verse_data['ref'],
+                "text": verse_data['text'],
+                "trans": verse_data['trans'],
+                "source": verse_data['source'],
+                "book": verse_data['book'],
+                "is_new": True,
+                "session_id": self.session_id
+            }
+            self.total_verses += 1
+            self.wakeup.notify_all()
+            # Step from the old deadline, not from now, so slow rotations don't accumulate drift.
+            now = time.monotonic()
+            self.deadline += self.interval
+            if self.deadline <= now:
+                self.deadline = now + self.interval
+            self._deadline_moved()
+        logger.info(f"New verse: {verse_data['ref']}")
+
     def get_current_verse(self):
         """Thread-safe get current verse"""
         with self.lock:
             return self.current_verse.copy() if self.current_verse else None
-    
+
+    def _deadline_moved(self):
+        # Caller holds self.lock. rotates_at is only recomputed when the deadline moves,
+        # so every reader (and every follower) sees the same value until the next change.
+        self.rotates_at = time.time() + (self.deadline - time.monotonic())
+
+    def wait_for_change(self, changed, timeout):
+        """Block up to timeout until changed(self) holds; re-checked on every rotation, adoption or interval change."""
+        with self.wakeup:
+            return self.wakeup.wait_for(lambda: not self.running or changed(self), timeout)
+
     def get_time_left(self):
-        """Thread-safe get time left"""
+        """Whole seconds until the next rotation"""
         with self.lock:
-            return self.time_left
-    
-    def reset_timer(self):
-        """Reset the timer after fetching"""
+            return max(0, int(math.ceil(self.deadline - time.monotonic())))
+
+    def publish_state(self):
+        """Leader only: write the current verse and countdown as the next generator_state version."""
+        if not self.lease.held:
+            return
         with self.lock:
-            self.time_left = self.interval
-    
-    def decrement_timer(self):
-        """Decrement timer by 1 second"""
+            verse = dict(self.current_verse or {})
+            total, interval = self.total_verses, self.interval
+            rotates_at = self.rotates_at
+        try:
+            with db_connection() as (conn, db_type):
+                db_execute(conn, db_type, """
+                    INSERT INTO generator_state (name, version, verse, total_verses, verse_interval, rotates_at, leader, updated_at)
+                    VALUES (?, 1, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET
+                        version = generator_state.version + 1, verse = excluded.verse,
+                        total_verses = excluded.total_verses, verse_interval = excluded.verse_interval,
+                        rotates_at = excluded.rotates_at, leader = excluded.leader, updated_at = excluded.updated_at
+                """, (GENERATOR_STATE_KEY, json.dumps(verse), total, interval, rotates_at,
+                      self.lease.holder, utc_now().isoformat()))
+                version = db_scalar(conn, db_type, "SELECT version FROM generator_state WHERE name = ?",
+                                    (GENERATOR_STATE_KEY,))
+                conn.commit()
+            self.state_version = int(version)
+        except Exception as e:
+            logger.error(f"Failed to publish generator state: {e}")
+
+    def follow(self, force=False):
+        """Adopt the leader's latest generator_state; polled every GENERATOR_FOLLOW_POLL seconds."""
+        now = time.monotonic()
+        if not force and now - self.synced_at < GENERATOR_FOLLOW_POLL and self.get_time_left() > 0:
+            return False
+        self.synced_at = now
+        try:
+            with db_connection(readonly=True) as (conn, db_type):
+                row = db_query_one(conn, db_type, """
+                    SELECT version, verse, total_verses, verse_interval, rotates_at
+                    FROM generator_state WHERE name = ?
+                """, (GENERATOR_STATE_KEY,))
+        except Exception as e:
+            logger.warning(f"Generator state read failed: {e}")
+            return False
+        if row is None:
+            return False
+        if row.version != self.state_version:
+            verse = json.loads(row.verse) if row.verse else None
+            with self.lock:
+                if verse:
+                    self.current_verse = verse
+                    self.session_id = verse.get('session_id') or self.session_id
+                self.total_verses = int(row.total_verses or 0)
+                if row.verse_interval:
+                    self.interval = int(row.verse_interval)
+                if row.rotates_at is not None:
+                    self.rotates_at = float(row.rotates_at)
+                    self.deadline = time.monotonic() + (self.rotates_at - time.time())
+                self.schedule_seq += 1
+                self.wakeup.notify_all()
+            self.state_version = row.version
+        return True
+
+    def _sync_interval(self):
+        # Interval changes may land on any worker; they all go through system_settings.
+        try:
+            interval = max(10, min(3600, int(read_system_setting('verse_interval', self.interval))))
+        except (TypeError, ValueError):
+            return
+        if interval != self.interval:
+            self.set_interval(interval)
+
+    def _take_over(self):
+        # Continue the previous leader's schedule instead of starting a fresh countdown.
+        self.leading = True
+        if not self.follow(force=True):
+            self.publish_state()
+
+    def _wait(self, seconds, seen):
+        """Sleep until `seconds` pass or the schedule changes (interval update, new shared state)."""
+        with self.wakeup:
+            self.wakeup.wait_for(lambda: self.schedule_seq != seen or not self.running, max(0.0, seconds))
+
+    def _lead(self):
         with self.lock:
-            self.time_left -= 1
-            return self.time_left
-    
+            due = self.deadline - time.monotonic()
+            lead = min(GENERATOR_PREFETCH_LEAD, self.interval)
+            seen = self.schedule_seq
+        if due <= 0:
+            self.rotate()
+            self.publish_state()
+        elif self.prefetched is None and due <= lead:
+            self.prefetched = self.fetch_verse()
+        else:
+            wake = due if self.prefetched is not None else due - lead
+            # Wake at least every lease check: the lease is re-verified and settings re-read then.
+            self._wait(min(wake, GENERATOR_LEASE_CHECK), seen)
+
+    def _follow(self):
+        self.follow()
+        with self.lock:
+            due = self.deadline - time.monotonic()
+            seen = self.schedule_seq
+        if -GENERATOR_FOLLOW_POLL < due <= 0:
+            wake = 0.5  # the leader's next version is due any moment
+        else:
+            wake = min(max(due, 0.0) + 0.1, GENERATOR_FOLLOW_POLL)
+        self._wait(wake, seen)
+
+    def stats(self):
+        return dict(self.lease.stats(), leading=self.leading, state_version=self.state_version,
+                    rotates_at=self.rotates_at, prefetched=self.prefetched is not None,
+                    sources=self.sources.stats(),
+                    corpus=_corpus_sampler.stats() if _corpus_sampler is not None else None)
+
     def loop(self):
-        """Main loop - runs forever"""
+        """Main loop - sleeps until the next prefetch, rotation or schedule change.
+
+        The lease holder fetches; every other process follows generator_state.
+        """
         while self.running:
             try:
-                current = self.get_time_left()
-                if current <= 0:
-                    self.fetch_verse()
-                    self.reset_timer()
+                if self.lease.acquire():
+                    if not self.leading:
+                        self._take_over()
+                    self._sync_interval()
+                    self._lead()
                 else:
-                    self.decrement_timer()
+                    self.leading = False
+                    self._follow()
             except Exception as e:
                 logger.error(f"Critical error in generator loop: {e}")
                 time.sleep(5)  # Wait before retrying
-                continue
-            time.sleep(1)
 
 # Global generator instance
 generator = BibleGenerator()
-CURRENT_API_CACHE_TTL = max(0.5, float(os.environ.get('API_CURRENT_CACHE_TTL', '2.0')))
-_current_api_cache = {}
-_current_api_cache_lock = threading.Lock()
+atexit.register(generator.lease.close)
+
+class CurrentSnapshot:
+    """The /api/current body for everyone: encoded once per rotation or interval change.
+
+    The countdown is left to clients (rotates_at), so the bytes and their
+    strong ETag stay the same between changes and revalidations get a 304.
+    """
+
+    def __init__(self, generator):
+        self.generator = generator
+        self.current = None   # (key, body, etag)
+        self.lock = threading.Lock()
+        self.builds = 0
+
+    def get(self):
+        """(body, etag) for the generator's present state."""
+        g = self.generator
+        with g.lock:
+            key = (g.session_id, g.interval, g.rotates_at)
+        current = self.current
+        if current is None or current[0] != key:
+            with self.lock:
+                current = self.current
+                if current is None or current[0] != key:
+                    current = self._build()
+                    self.current = current
+        return current[1], current[2]
+
+    def _build(self):
+        g = self.generator
+        with g.lock:
+            key = (g.session_id, g.interval, g.rotates_at)
+            payload = {
+                "verse": dict(g.current_verse) if g.current_verse else None,
+                "total_verses": g.total_verses,
+                "session_id": g.session_id,
+                "interval": g.interval,
+                "rotates_at": round(g.rotates_at, 3)
+            }
+        body = app.json.dumps(payload).encode('utf-8')
+        self.builds += 1
+        return key, body, hashlib.sha1(body).hexdigest()[:20]
+
+current_snapshot = CurrentSnapshot(generator)
+
+def _recommendation_reason(book_name=None, preferred=False):
+    if preferred and book_name:
+        options = [
+            f"Because you like {book_name}",
+            f"A fresh passage from {book_name}",
+            f"Something uplifting from {book_name}",
+            f"More wisdom in {book_name}"
+        ]
+    else:
+        options = [
+            "Recommended for you",
+            "A fresh verse for today",
+            "Something to reflect on",
+            "A new verse to explore"
+        ]
+    return random.choice(options)
 
 # Bind the method to the class
 def generate_smart_recommendation(self, user_id, exclude_ids=None):
     """Generate recommendation based on user likes"""
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     exclude_ids = exclude_ids or []
     cleaned_exclude = []
     for item in exclude_ids:
@@ -1412,140 +3765,75 @@ def generate_smart_recommendation(self, user_id, exclude_ids=None):
         except (TypeError, ValueError):
             continue
     exclude_ids = list(dict.fromkeys(cleaned_exclude))
-    
+
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = %s
-                UNION
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = %s
-            """, (user_id, user_id))
-        else:
-            c.execute("""
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
+        with db_connection() as (conn, db_type):
+            preferred_books = [row.book for row in db_query(conn, db_type, """
+                SELECT DISTINCT v.book FROM verses v
+                JOIN likes l ON v.id = l.verse_id
                 WHERE l.user_id = ?
                 UNION
-                SELECT DISTINCT v.book FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
+                SELECT DISTINCT v.book FROM verses v
+                JOIN saves s ON v.id = s.verse_id
                 WHERE s.user_id = ?
-            """, (user_id, user_id))
-        
-        preferred_books = []
-        for row in c.fetchall():
-            try:
-                preferred_books.append(row['book'])
-            except (TypeError, KeyError):
-                preferred_books.append(row[0])
-        
-        if preferred_books:
-            if db_type == 'postgres':
-                placeholders = ','.join(['%s'] * len(preferred_books))
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND v.id NOT IN ({','.join(['%s'] * len(exclude_ids))})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT v.* FROM verses v
-                    WHERE v.book IN ({placeholders})
-                    AND v.id NOT IN (SELECT verse_id FROM likes WHERE user_id = %s)
-                    AND v.id NOT IN (SELECT verse_id FROM saves WHERE user_id = %s)
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, (*preferred_books, user_id, user_id, *exclude_params))
-            else:
-                placeholders = ','.join('?' for _ in preferred_books)
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND v.id NOT IN ({','.join('?' for _ in exclude_ids)})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT v.* FROM verses v
-                    WHERE v.book IN ({placeholders})
-                    AND v.id NOT IN (SELECT verse_id FROM likes WHERE user_id = ?)
-                    AND v.id NOT IN (SELECT verse_id FROM saves WHERE user_id = ?)
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, (*preferred_books, user_id, user_id, *exclude_params))
-        else:
-            if db_type == 'postgres':
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join(['%s'] * len(exclude_ids))})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT * FROM verses 
-                    WHERE id NOT IN (SELECT verse_id FROM likes WHERE user_id = %s)
-                    AND id NOT IN (SELECT verse_id FROM saves WHERE user_id = %s)
-                    {exclude_clause}
-                    ORDER BY RANDOM() LIMIT 1
-                """, (user_id, user_id, *exclude_params))
-            else:
-                exclude_clause = ''
-                exclude_params = []
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join('?' for _ in exclude_ids)})"
-                    exclude_params = exclude_ids
-                c.execute(f"""
-                    SELECT * FROM verses 
-                    WHERE id NOT IN (SELECT verse_id FROM likes WHERE user_id = ?)
-                    AND id NOT IN (SELECT verse_id FROM saves WHERE user_id = ?)
-                    {exclude_clause}
-                    ORDER BY RANDOM() LIMIT 1
-                """, (user_id, user_id, *exclude_params))
-        
-        row = c.fetchone()
-        
+            """, (user_id, user_id))]
+
+            sampler = corpus_sampler()
+            if sampler is not None:
+                # Draw from the whole local catalog rather than the verses fetched so far.
+                handled = {row.corpus_key for row in db_query(conn, db_type, """
+                    SELECT v.corpus_key FROM verses v
+                    JOIN likes l ON v.id = l.verse_id
+                    WHERE l.user_id = ? AND v.corpus_key IS NOT NULL
+                    UNION
+                    SELECT v.corpus_key FROM verses v
+                    JOIN saves s ON v.id = s.verse_id
+                    WHERE s.user_id = ? AND v.corpus_key IS NOT NULL
+                """, (user_id, user_id))}
+                handled.update(corpus_keys_for(conn, db_type, exclude_ids))
+                books = sampler.book_positions(preferred_books)
+                verse = sampler.sample(books=books or None, exclude=handled, remember=False)
+                verse_id = ensure_verse_row(conn, db_type, verse) if verse is not None else None
+                if verse_id is not None:
+                    return {
+                        "id": verse_id,
+                        "ref": verse['ref'],
+                        "text": verse['text'],
+                        "trans": verse['trans'],
+                        "book": verse['book'],
+                        "reason": _recommendation_reason(verse['book'], bool(books))
+                    }
+
+            clauses = [
+                "v.id NOT IN (SELECT verse_id FROM likes WHERE user_id = ?)",
+                "v.id NOT IN (SELECT verse_id FROM saves WHERE user_id = ?)"
+            ]
+            params = [user_id, user_id]
+            if preferred_books:
+                clauses.insert(0, f"v.book IN ({sql_in(preferred_books)})")
+                params[:0] = preferred_books
+            if exclude_ids:
+                clauses.append(f"v.id NOT IN ({sql_in(exclude_ids)})")
+                params.extend(exclude_ids)
+            row = db_query_one(conn, db_type, f"""
+                SELECT v.id, v.reference, v.text, v.translation, v.book FROM verses v
+                WHERE {' AND '.join(clauses)}
+                ORDER BY RANDOM() LIMIT 1
+            """, params)
+
         if row:
-            def pick_reason(book_name=None, preferred=False):
-                if preferred and book_name:
-                    options = [
-                        f"Because you like {book_name}",
-                        f"A fresh passage from {book_name}",
-                        f"Something uplifting from {book_name}",
-                        f"More wisdom in {book_name}"
-                    ]
-                else:
-                    options = [
-                        "Recommended for you",
-                        "A fresh verse for today",
-                        "Something to reflect on",
-                        "A new verse to explore"
-                    ]
-                return random.choice(options)
-            try:
-                return {
-                    "id": row['id'], 
-                    "ref": row['reference'], 
-                    "text": row['text'],
-                    "trans": row['translation'], 
-                    "book": row['book'],
-                    "reason": pick_reason(row['book'], bool(preferred_books))
-                }
-            except (TypeError, KeyError):
-                return {
-                    "id": row[0], 
-                    "ref": row[1], 
-                    "text": row[2],
-                    "trans": row[3], 
-                    "book": row[6],
-                    "reason": pick_reason(row[6], bool(preferred_books))
-                }
+            return {
+                "id": row.id,
+                "ref": row.reference,
+                "text": row.text,
+                "trans": row.translation,
+                "book": row.book,
+                "reason": _recommendation_reason(row.book, bool(preferred_books))
+            }
         return None
     except Exception as e:
         logger.error(f"Recommendation error: {e}")
         return None
-    finally:
-        conn.close()
 
 BibleGenerator.generate_smart_recommendation = generate_smart_recommendation
 
@@ -1584,50 +3872,8 @@ def check_user_banned():
             """), 503
 
     if 'user_id' in session:
-        # Track user presence for admin analytics.
-        try:
-            last_ping = session.get('last_presence_ping', 0)
-            now_ts = time.time()
-            should_ping = True
-            try:
-                should_ping = (now_ts - float(last_ping)) >= 20
-            except Exception:
-                should_ping = True
-            if should_ping:
-                conn, db_type = get_db()
-                c = get_cursor(conn, db_type)
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS user_presence (
-                        user_id INTEGER PRIMARY KEY,
-                        last_seen TEXT,
-                        last_path TEXT,
-                        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                now_iso = datetime.now().isoformat()
-                if db_type == 'postgres':
-                    c.execute("""
-                        INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                        VALUES (%s, %s, %s, %s)
-                        ON CONFLICT (user_id) DO UPDATE SET
-                            last_seen = EXCLUDED.last_seen,
-                            last_path = EXCLUDED.last_path,
-                            updated_at = EXCLUDED.updated_at
-                    """, (session['user_id'], now_iso, path, now_iso))
-                else:
-                    c.execute("""
-                        INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                        VALUES (?, ?, ?, ?)
-                        ON CONFLICT(user_id) DO UPDATE SET
-                            last_seen = excluded.last_seen,
-                            last_path = excluded.last_path,
-                            updated_at = excluded.updated_at
-                    """, (session['user_id'], now_iso, path, now_iso))
-                conn.commit()
-                conn.close()
-                session['last_presence_ping'] = now_ts
-        except Exception:
-            pass
+        # Track user presence for admin analytics (buffered, see PresenceTracker).
+        presence_tracker.touch(session['user_id'], path)
 
         if endpoint in public_allow:
             return None
@@ -1674,7 +3920,8 @@ def health_check():
             "generator_running": generator.thread.is_alive() if generator.thread else False,
             "current_verse": generator.get_current_verse()['ref'] if generator.get_current_verse() else None,
             "time_left": generator.get_time_left(),
-            "interval": generator.interval
+            "interval": generator.interval,
+            "generator": generator.stats()
         }
         return jsonify(status)
     except Exception as e:
@@ -1748,72 +3995,32 @@ def index():
     # Ensure generator thread is running
     generator.start_thread()
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
-    
+    conn, db_type = get_db(readonly=True)
+
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id, name, email, picture, custom_picture, avatar_decoration, created_at, role FROM users WHERE id = %s", (session['user_id'],))
-        else:
-            c.execute("SELECT id, name, email, picture, custom_picture, avatar_decoration, created_at, role FROM users WHERE id = ?", (session['user_id'],))
-        
-        user = c.fetchone()
-        
-        if db_type == 'postgres':
-            c.execute("SELECT COUNT(*) as count FROM verses")
-            total_verses = c.fetchone()['count']
-            c.execute("SELECT COUNT(*) as count FROM likes WHERE user_id = %s", (session['user_id'],))
-            liked_count = c.fetchone()['count']
-            c.execute("SELECT COUNT(*) as count FROM saves WHERE user_id = %s", (session['user_id'],))
-            saved_count = c.fetchone()['count']
-        else:
-            c.execute("SELECT COUNT(*) as count FROM verses")
-            try:
-                total_verses = c.fetchone()[0]
-            except:
-                total_verses = c.fetchone()['count']
-            c.execute("SELECT COUNT(*) as count FROM likes WHERE user_id = ?", (session['user_id'],))
-            try:
-                liked_count = c.fetchone()[0]
-            except:
-                liked_count = c.fetchone()['count']
-            c.execute("SELECT COUNT(*) as count FROM saves WHERE user_id = ?", (session['user_id'],))
-            try:
-                saved_count = c.fetchone()[0]
-            except:
-                saved_count = c.fetchone()['count']
-        
+        uid = session['user_id']
+        user = db_query_one(conn, db_type, """
+            SELECT id, name, email, picture, custom_picture, avatar_decoration, created_at, role
+            FROM users WHERE id = ?
+        """, (uid,))
+        total_verses = db_scalar(conn, db_type, "SELECT COUNT(*) AS total FROM verses", (), 0)
+        liked_count = db_scalar(conn, db_type, "SELECT COUNT(*) AS total FROM likes WHERE user_id = ?", (uid,), 0)
+        saved_count = db_scalar(conn, db_type, "SELECT COUNT(*) AS total FROM saves WHERE user_id = ?", (uid,), 0)
+
         if not user:
             session.clear()
             return redirect(url_for('login'))
-        
-        try:
-            custom_picture = user['custom_picture']
-            base_picture = user['picture']
-            effective_picture = custom_picture or base_picture or ''
-            user_dict = {
-                "id": user['id'],
-                "name": user['name'],
-                "email": user['email'],
-                "picture": effective_picture,
-                "avatar_decoration": user.get('avatar_decoration') if isinstance(user, dict) else None,
-                "created_at": user.get('created_at') if isinstance(user, dict) else None,
-                "role": user.get('role', 'user') if isinstance(user, dict) else (user[7] if len(user) > 7 else 'user')
-            }
-        except (TypeError, KeyError):
-            custom_picture = user[4] if len(user) > 4 else None
-            base_picture = user[3] if len(user) > 3 else None
-            effective_picture = custom_picture or base_picture or ''
-            user_dict = {
-                "id": user[0],
-                "name": user[1] if len(user) > 1 else '',
-                "email": user[2] if len(user) > 2 else '',
-                "picture": effective_picture,
-                "avatar_decoration": user[5] if len(user) > 5 else None,
-                "created_at": user[6] if len(user) > 6 else None,
-                "role": user[7] if len(user) > 7 else 'user'
-            }
-        
+
+        user_dict = {
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "picture": user.custom_picture or user.picture or '',
+            "avatar_decoration": user.avatar_decoration,
+            "created_at": user.created_at,
+            "role": user.role or 'user'
+        }
+
         created_at_val = user_dict.get("created_at")
         if isinstance(created_at_val, datetime):
             created_at_val = created_at_val.isoformat()
@@ -1908,38 +4115,18 @@ def callback():
         name = userinfo.get('name', email.split('@')[0])
         picture = userinfo.get('picture', '')
         
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        
-        if db_type == 'postgres':
-            c.execute("SELECT * FROM users WHERE google_id = %s", (google_id,))
-        else:
-            c.execute("SELECT * FROM users WHERE google_id = ?", (google_id,))
-        
-        user = c.fetchone()
-        
-        if not user:
-            if db_type == 'postgres':
-                c.execute("INSERT INTO users (google_id, email, name, picture, created_at, is_admin, is_banned, role) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
-                          (google_id, email, name, picture, datetime.now().isoformat(), 0, False, 'user'))
-            else:
-                c.execute("INSERT INTO users (google_id, email, name, picture, created_at, is_admin, is_banned, role) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                          (google_id, email, name, picture, datetime.now().isoformat(), 0, 0, 'user'))
-            conn.commit()
-            
-            if db_type == 'postgres':
-                c.execute("SELECT * FROM users WHERE google_id = %s", (google_id,))
-            else:
-                c.execute("SELECT * FROM users WHERE google_id = ?", (google_id,))
-            user = c.fetchone()
-        
-        conn.close()
-        
+        with db_connection() as (conn, db_type):
+            user = db_query_one(conn, db_type, "SELECT * FROM users WHERE google_id = ?", (google_id,))
+            if not user:
+                db_execute(conn, db_type, """
+                    INSERT INTO users (google_id, email, name, picture, created_at, is_admin, is_banned, role)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (google_id, email, name, picture, utc_now().isoformat(), 0, False, 'user'))
+                conn.commit()
+                user = db_query_one(conn, db_type, "SELECT * FROM users WHERE google_id = ?", (google_id,))
+
         # Check if banned
-        try:
-            user_id = user['id'] if isinstance(user, dict) else user[0]
-        except (TypeError, KeyError):
-            user_id = user[0]
+        user_id = user.id
         
         is_banned, reason, _ = check_ban_status(user_id)
         if is_banned:
@@ -1969,23 +4156,12 @@ def callback():
             """, reason=reason), 403
         
         session['user_id'] = user_id
-        session['user_name'] = user['name'] if isinstance(user, dict) else user[3]
+        session['user_name'] = user.name
         session['user_email'] = email
-        try:
-            custom_pic = user.get('custom_picture') if isinstance(user, dict) else (user[11] if len(user) > 11 else None)
-        except Exception:
-            custom_pic = None
-        session['user_picture'] = (custom_pic or (user['picture'] if isinstance(user, dict) else user[4]))
-        try:
-            session['avatar_decoration'] = user.get('avatar_decoration') if isinstance(user, dict) else (user[12] if len(user) > 12 else None)
-        except Exception:
-            session['avatar_decoration'] = None
-        session['is_admin'] = bool(user['is_admin']) if isinstance(user, dict) else bool(user[6])
-        
-        try:
-            session_role = user['role'] if isinstance(user, dict) else (user[10] if len(user) > 10 else 'user')
-        except (TypeError, KeyError):
-            session_role = user[10] if len(user) > 10 else 'user'
+        session['user_picture'] = user.custom_picture or user.picture
+        session['avatar_decoration'] = user.avatar_decoration
+        session['is_admin'] = bool(user.is_admin)
+        session_role = user.role or 'user'
         session['role'] = session_role
         # Persist admin session based on stored role so admin code is not required each login.
         if session_role in ('owner', 'co_owner', 'mod', 'host'):
@@ -2030,37 +4206,217 @@ def restriction_status():
         "expires_at": expires_at
     })
 
+# Each open stream (or held long-poll) occupies one worker thread until the
+# verse changes, so they are capped per process below the gthread pool size.
+SSE_HEARTBEAT = max(1.0, float(os.environ.get('SSE_HEARTBEAT', '15')))
+SSE_MAX_STREAM = max(10.0, float(os.environ.get('SSE_MAX_STREAM', '300')))
+SSE_MAX_STREAMS = max(1, int(os.environ.get('SSE_MAX_STREAMS', '32')))
+SSE_RETRY_MS = max(500, int(os.environ.get('SSE_RETRY_MS', '3000')))
+LONG_POLL_TIMEOUT = max(1.0, float(os.environ.get('LONG_POLL_TIMEOUT', '25')))
+_stream_slots = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+def current_snapshot_response():
+    body, etag = current_snapshot.get()
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
 @app.route('/api/current')
 def get_current():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
 
-    user_id = session['user_id']
-    now = time.time()
-    is_banned, reason, _ = check_ban_status(user_id)
+    is_banned, reason, _ = check_ban_status(session['user_id'])
     if is_banned:
         return jsonify({"error": "banned", "message": "Account banned", "reason": reason}), 403
-    with _current_api_cache_lock:
-        cached = _current_api_cache.get(user_id)
-        if cached and (now - cached['timestamp']) < CURRENT_API_CACHE_TTL:
-            return jsonify(cached['payload'])
 
     # Ensure thread is running
     generator.start_thread()
 
-    payload = {
-        "verse": generator.get_current_verse(),
-        "countdown": generator.get_time_left(),
-        "total_verses": generator.total_verses,
-        "session_id": generator.session_id,
-        "interval": generator.interval
-    }
-    with _current_api_cache_lock:
-        _current_api_cache[user_id] = {
-            "timestamp": now,
-            "payload": payload
-        }
-    return jsonify(payload)
+    # Long-poll fallback for clients without EventSource: hold the request until the verse changes.
+    wait_for = request.args.get('wait_for')
+    if wait_for and wait_for == generator.session_id and _stream_slots.acquire(blocking=False):
+        try:
+            generator.wait_for_change(lambda g: g.session_id != wait_for, LONG_POLL_TIMEOUT)
+        finally:
+            _stream_slots.release()
+    return current_snapshot_response()
+
+def _verse_event_id(g):
+    # Interval changes are pushed too, so the id covers both.
+    return f"{g.session_id}-{g.interval}"
+
+@app.route('/api/current/stream')
+def current_stream():
+    """Server-Sent Events: one 'verse' event per rotation or interval change, ':' heartbeats between.
+
+    A reconnecting EventSource sends Last-Event-ID; it only gets an event
+    straight away if the verse moved on while it was away. Streams end after
+    SSE_MAX_STREAM seconds and the browser reconnects on its own.
+    """
+    if 'user_id' not in session:
+        return jsonify({"error": "Not logged in"}), 401
+
+    user_id = session['user_id']
+    is_banned, reason, _ = check_ban_status(user_id)
+    if is_banned:
+        return jsonify({"error": "banned", "message": "Account banned", "reason": reason}), 403
+    if not _stream_slots.acquire(blocking=False):
+        return jsonify({"error": "busy", "retry_after": 5}), 503, {'Retry-After': '5'}
+
+    generator.start_thread()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+
+    def events():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        seen = last_event_id
+        ends = time.monotonic() + SSE_MAX_STREAM
+        while True:
+            if _verse_event_id(generator) != seen:
+                if check_ban_status(user_id)[0]:
+                    yield "event: banned\ndata: {}\n\n"
+                    return
+                seen = _verse_event_id(generator)
+                body, _ = current_snapshot.get()
+                # Same bytes as /api/current plus the server clock, for the client's countdown.
+                yield f"id: {seen}\nevent: verse\ndata: {{\"now\": {time.time():.3f}, {body.decode('utf-8')[1:]}\n\n"
+                continue
+            remaining = ends - time.monotonic()
+            if remaining <= 0:
+                return
+            if not generator.wait_for_change(lambda g: _verse_event_id(g) != seen, min(SSE_HEARTBEAT, remaining)):
+                yield ": ping\n\n"
+
+    response = Response(events(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # close() runs even if the client goes away before the first chunk is sent.
+    response.call_on_close(_stream_slots.release)
+    return response
+
+def write_bible_corpus(translation_id, translation_name, verses, directory=BIBLE_CORPUS_DIR):
+    """Pack (book index, chapter, verse, text) tuples into the BibleCorpus files; returns the verse count."""
+    rows = sorted(verses, key=lambda row: (row[0], row[1], row[2]))
+    if not rows:
+        raise ValueError("no verses to import")
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, translation_id)
+    offsets = array('I', [0])
+    books, verse_numbers = [], {}
+    chapter_key, chapter_numbers = None, []
+    with open(base + '.txt.tmp', 'wb') as out:
+        position = 0
+        for book_index, chapter, verse, text in rows:
+            canonical = FALLBACK_BOOKS[book_index]
+            if not books or books[-1]['id'] != canonical['id']:
+                books.append({"id": canonical['id'], "name": canonical['name'], "chapters": []})
+            chapters = books[-1]['chapters']
+            while len(chapters) < chapter:
+                chapters.append(0)
+            chapters[chapter - 1] += 1
+            if (canonical['id'], chapter) != chapter_key:
+                chapter_key, chapter_numbers = (canonical['id'], chapter), []
+            chapter_numbers.append(verse)
+            if chapter_numbers != list(range(1, len(chapter_numbers) + 1)):
+                verse_numbers[f"{canonical['id']} {chapter}"] = list(chapter_numbers)
+            data = ' '.join(str(text).split()).encode('utf-8')
+            out.write(data)
+            position += len(data)
+            offsets.append(position)
+    with open(base + '.idx.tmp', 'wb') as out:
+        offsets.tofile(out)
+    meta = {"translation_id": translation_id, "translation_name": translation_name,
+            "books": books, "verse_numbers": verse_numbers}
+    with open(base + '.json.tmp', 'w', encoding='utf-8') as out:
+        json.dump(meta, out, separators=(',', ':'))
+    # Metadata last: readers key their reload off its mtime.
+    for suffix in ('.txt', '.idx', '.json'):
+        os.replace(base + suffix + '.tmp', base + suffix)
+    return len(rows)
+
+def _canonical_book_index(value):
+    value = str(value).strip()
+    if value.isdigit() and 1 <= int(value) <= len(FALLBACK_BOOKS):
+        return int(value) - 1
+    index = CANONICAL_BOOK_INDEX.get(_book_key(value))
+    if index is None:
+        raise ValueError(f"unknown book {value!r}")
+    return index
+
+def _read_corpus_file(path):
+    """Verses from a JSON (books -> chapters -> verse strings, canonical order) or CSV/TSV (book, chapter, verse, text) file."""
+    with open(path, encoding='utf-8-sig') as f:
+        if path.lower().endswith('.json'):
+            data = json.load(f)
+            books = data.get('books', data) if isinstance(data, dict) else data
+            for book_index, book in enumerate(books):
+                for chapter, verses in enumerate(book['chapters'], 1):
+                    for verse, text in enumerate(verses, 1):
+                        yield book_index, chapter, verse, text
+            return
+        sample = f.read(4096)
+        f.seek(0)
+        dialect = csv.Sniffer().sniff(sample, delimiters=',\t|')
+        for row in csv.reader(f, dialect):
+            if len(row) == 5:
+                row = row[1:]  # leading verse id column
+            if len(row) != 4 or not row[1].strip().isdigit():
+                continue  # header or blank line
+            yield _canonical_book_index(row[0]), int(row[1]), int(row[2]), row[3]
+
+def _download_chapter(url, retries=4):
+    """bible-api.com JSON for one chapter, or None if the chapter doesn't exist; raises once retries run out."""
+    for attempt in range(retries + 1):
+        try:
+            return outbound_cache.get_json(url, timeout=30)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                return None
+            error = e
+        except (requests.RequestException, ValueError) as e:
+            error = e
+        if attempt < retries:
+            wait = 5 * 2 ** attempt
+            logger.warning(f"Fetch of {url} failed ({error}); retrying in {wait}s")
+            time.sleep(wait)
+    raise click.ClickException(f"Giving up on {url} after {retries + 1} attempts: {error}")
+
+def _download_corpus(translation, delay):
+    """Verses fetched chapter by chapter from bible-api.com, politely spaced out.
+
+    A chapter that keeps failing aborts the import; write_bible_corpus reads
+    everything before writing, so no partial corpus is left behind.
+    """
+    for book_index, book in enumerate(FALLBACK_BOOKS):
+        chapter = 1
+        while True:
+            data = _download_chapter(f"{BIBLE_API_BASE}/{quote(book['name'] + ' ' + str(chapter))}?translation={translation}")
+            verses = (data or {}).get('verses') or []
+            if not verses or int(verses[0].get('chapter') or 0) != chapter:
+                break
+            for verse in verses:
+                yield book_index, chapter, int(verse['verse']), verse.get('text', '')
+            logger.info(f"Downloaded {book['name']} {chapter}")
+            chapter += 1
+            time.sleep(delay)
+
+@app.cli.command('import-bible')
+@click.argument('translation')
+@click.argument('source', required=False)
+@click.option('--name', help="Translation name shown to readers.")
+@click.option('--delay', default=2.0, show_default=True, help="Seconds between bible-api.com requests when downloading.")
+def import_bible_command(translation, source, name, delay):
+    """Import a public-domain translation (e.g. web, kjv) into the offline corpus.
+
+    SOURCE is a JSON or CSV/TSV file; without it the translation is
+    downloaded from bible-api.com, which takes a while at its rate limit.
+    """
+    translation = translation.lower()
+    verses = _read_corpus_file(source) if source else _download_corpus(translation, delay)
+    name = name or BIBLE_TRANSLATION_NAMES.get(translation, translation.upper())
+    count = write_bible_corpus(translation, name, verses)
+    click.echo(f"Imported {count} verses of {name} into {BIBLE_CORPUS_DIR}")
 
 @app.route('/api/bible/books')
 def bible_books():
@@ -2068,7 +4424,14 @@ def bible_books():
         return jsonify({"error": "Not logged in"}), 401
 
     translation = (request.args.get('translation') or DEFAULT_TRANSLATION).lower()
-    data = _fetch_json(f"{BIBLE_API_BASE}/data/{translation}")
+    corpus = get_bible_corpus(translation)
+    if corpus is not None:
+        return jsonify({
+            "translation": corpus.translation_name,
+            "translation_id": corpus.translation_id,
+            "books": corpus.book_list()
+        })
+    data = _fetch_json(f"{BIBLE_API_BASE}/data/{translation}") if BIBLE_REMOTE_FALLBACK else None
     if data and isinstance(data, dict) and "books" in data:
         return jsonify({
             "translation": data.get("translation", translation),
@@ -2095,6 +4458,15 @@ def bible_chapter():
     if not chapter.isdigit():
         return jsonify({"error": "chapter must be a number"}), 400
 
+    corpus = get_bible_corpus(translation)
+    if corpus is not None:
+        passage = corpus.chapter(book, int(chapter))
+        if passage is None:
+            return jsonify({"error": f"{book} {chapter} is not in {corpus.translation_name}"}), 404
+        return jsonify(passage)
+    if not BIBLE_REMOTE_FALLBACK:
+        return jsonify({"error": "Translation not available"}), 404
+
     query = f"{book} {chapter}"
     encoded = quote(query)
     data = _fetch_json(f"{BIBLE_API_BASE}/{encoded}?translation={translation}")
@@ -2154,11 +4526,296 @@ def _strip_gutenberg_boilerplate(text):
     cleaned = re.sub(r'\n{3,}', '\n\n', cleaned).strip()
     return cleaned
 
+OUTBOUND_CACHE_MAX_BYTES = max(0, int(os.environ.get('OUTBOUND_CACHE_MAX_BYTES', str(32 * 1024 * 1024))))
+OUTBOUND_CACHE_MAX_ENTRY = max(0, int(os.environ.get('OUTBOUND_CACHE_MAX_ENTRY', str(OUTBOUND_CACHE_MAX_BYTES // 8))))
+OUTBOUND_CACHE_DEFAULT_TTL = max(0.0, float(os.environ.get('OUTBOUND_CACHE_DEFAULT_TTL', '300')))
+OUTBOUND_CACHE_TTLS = os.environ.get('OUTBOUND_CACHE_TTLS', 'bible-api.com=86400,gutendex.com=3600,www.gutenberg.org=604800')
+OUTBOUND_CACHE_STALE = max(0.0, float(os.environ.get('OUTBOUND_CACHE_STALE', '86400')))
+OUTBOUND_CACHE_DIR = (os.environ.get('OUTBOUND_CACHE_DIR') or '').strip()
+OUTBOUND_CACHE_DISK_MAX_BYTES = max(0, int(os.environ.get('OUTBOUND_CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024))))
+
+def parse_host_ttls(spec):
+    """'bible-api.com=86400,gutendex.com=3600' -> {'bible-api.com': 86400.0, 'gutendex.com': 3600.0}"""
+    ttls = {}
+    for part in str(spec or '').split(','):
+        host, sep, value = part.partition('=')
+        if not sep:
+            continue
+        try:
+            ttls[host.strip().lower()] = max(0.0, float(value))
+        except ValueError:
+            logger.warning(f"Ignoring cache TTL {part.strip()!r}")
+    return ttls
+
+class _Flight:
+    """One upstream request that concurrent callers for the same key wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entry = None
+        self.error = None
+
+class OutboundCache:
+    """Cache for outbound GETs (bible-api, gutendex, gutenberg): byte-budgeted LRU plus optional disk tier.
+
+    Entries live for their host's TTL. Past that they are still served for
+    OUTBOUND_CACHE_STALE seconds while one background request refreshes them,
+    and they are what callers get if the refresh fails. Concurrent misses for
+    the same URL share one upstream request. Bodies over the per-entry cap
+    only go to disk, which keeps large book texts from evicting everything.
+    """
+
+    def __init__(self, max_bytes=OUTBOUND_CACHE_MAX_BYTES, max_entry=OUTBOUND_CACHE_MAX_ENTRY,
+                 ttls=None, default_ttl=OUTBOUND_CACHE_DEFAULT_TTL, stale=OUTBOUND_CACHE_STALE,
+                 directory=OUTBOUND_CACHE_DIR, disk_max_bytes=OUTBOUND_CACHE_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry = min(max_entry, max_bytes)
+        self.ttls = parse_host_ttls(OUTBOUND_CACHE_TTLS) if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.stale = stale
+        self.directory = directory or None
+        self.disk_max_bytes = disk_max_bytes
+        self.session = requests.Session()
+        self.entries = OrderedDict()   # key -> (body, encoding, fetched_at)
+        self.bytes = 0
+        self.flights = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.coalesced = 0
+        self.revalidations = 0
+        self.disk_hits = 0
+        self.disk_writes = 0
+        self.upstream_errors = 0
+        self.stale_on_error = 0
+        self.evictions = 0
+        if self.directory:
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+            except OSError as e:
+                logger.warning(f"Outbound cache directory unavailable, disk tier off: {e}")
+                self.directory = None
+
+    def ttl_for(self, url):
+        host = (urlsplit(url).hostname or '').lower()
+        while host:
+            if host in self.ttls:
+                return self.ttls[host]
+            host = host.partition('.')[2]
+        return self.default_ttl
+
+    def get_json(self, url, params=None, timeout=12):
+        body, encoding = self.fetch(url, params, timeout)
+        try:
+            return json.loads(body.decode(encoding or 'utf-8'))
+        except ValueError:
+            # A 200 that isn't JSON (maintenance page, truncated body) must not stick for the TTL.
+            self.forget(url, params)
+            raise
+
+    def get_text(self, url, params=None, timeout=12):
+        body, encoding = self.fetch(url, params, timeout)
+        return body.decode(encoding or 'utf-8', errors='replace')
+
+    def _key(self, url, params):
+        if params:
+            return requests.Request('GET', url, params=sorted(params.items())).prepare().url
+        return url
+
+    def forget(self, url, params=None):
+        """Drop url from both tiers so the next request goes upstream."""
+        url = self._key(url, params)
+        with self.lock:
+            entry = self.entries.pop(url, None)
+            if entry is not None:
+                self.bytes -= len(entry[0])
+        if self.directory:
+            try:
+                os.remove(self._disk_path(url))
+            except OSError:
+                pass
+
+    def fetch(self, url, params=None, timeout=12):
+        """(body bytes, encoding) for a successful GET; raises what requests raised, HTTPError included."""
+        url = self._key(url, params)
+        ttl = self.ttl_for(url)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(url)
+            if entry is not None:
+                self.entries.move_to_end(url)
+        if entry is None:
+            entry = self._read_disk(url, ttl, now)
+        if entry is not None:
+            age = now - entry[2]
+            if age < ttl:
+                with self.lock:
+                    self.hits += 1
+                return entry[0], entry[1]
+            if age < ttl + self.stale:
+                with self.lock:
+                    self.stale_hits += 1
+                    refresh = url not in self.flights
+                    if refresh:
+                        self.flights[url] = _Flight()
+                        self.revalidations += 1
+                if refresh:
+                    threading.Thread(target=self._revalidate, args=(url, timeout), daemon=True).start()
+                return entry[0], entry[1]
+        with self.lock:
+            flight = self.flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = self.flights[url] = _Flight()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if leader:
+            self._run(url, timeout, flight)
+        else:
+            flight.done.wait(timeout + 1)
+        if flight.entry is not None:
+            return flight.entry[0], flight.entry[1]
+        raise flight.error or requests.Timeout(f"Timed out waiting on shared fetch of {url}")
+
+    def _run(self, url, timeout, flight):
+        try:
+            response = self.session.get(url, timeout=timeout)
+            response.raise_for_status()
+            flight.entry = (response.content, response.encoding, time.time())
+            self._store(url, flight.entry)
+        except Exception as e:
+            flight.error = e
+            with self.lock:
+                self.upstream_errors += 1
+        finally:
+            with self.lock:
+                self.flights.pop(url, None)
+            flight.done.set()
+
+    def _revalidate(self, url, timeout):
+        with self.lock:
+            flight = self.flights.get(url)
+        if flight is None:
+            return
+        self._run(url, timeout, flight)
+        if flight.error is not None:
+            # Keep serving what we have until the stale window runs out.
+            with self.lock:
+                self.stale_on_error += 1
+            logger.warning(f"Outbound cache refresh failed for {url}: {flight.error}")
+
+    def _store(self, url, entry):
+        self._remember(url, entry)
+        self._write_disk(url, entry)
+
+    def _remember(self, url, entry, replace=True):
+        """Put entry in the memory tier (if it fits the per-entry cap) and evict down to max_bytes."""
+        size = len(entry[0])
+        if size > self.max_entry:
+            return
+        with self.lock:
+            old = self.entries.get(url)
+            if old is not None:
+                if not replace:
+                    return
+                del self.entries[url]
+                self.bytes -= len(old[0])
+            self.entries[url] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= len(evicted[0])
+                self.evictions += 1
+
+    def _disk_path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+
+    def _read_disk(self, url, ttl, now):
+        if not self.directory:
+            return None
+        try:
+            with open(self._disk_path(url), 'rb') as f:
+                header = json.loads(f.readline())
+                if header.get('url') != url or now - header['fetched_at'] >= ttl + self.stale:
+                    return None
+                entry = (f.read(), header.get('encoding'), header['fetched_at'])
+        except (OSError, ValueError, KeyError):
+            return None
+        with self.lock:
+            self.disk_hits += 1
+        # A fresher copy stored meanwhile by another request wins.
+        self._remember(url, entry, replace=False)
+        return entry
+
+    def _write_disk(self, url, entry):
+        if not self.directory:
+            return
+        path = self._disk_path(url)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        header = {"url": url, "encoding": entry[1], "fetched_at": entry[2]}
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(header).encode('utf-8') + b'\n')
+                f.write(entry[0])
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Outbound cache disk write failed: {e}")
+            return
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes % 50 == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop the least recently written files once the directory is over its budget."""
+        try:
+            files = []
+            for item in os.scandir(self.directory):
+                if item.is_file():
+                    st = item.stat()
+                    files.append((st.st_mtime, st.st_size, item.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.disk_max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+        except OSError as e:
+            logger.warning(f"Outbound cache disk prune failed: {e}")
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+            return {
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "stale_hits": self.stale_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else None,
+                "revalidations": self.revalidations,
+                "stale_on_error": self.stale_on_error,
+                "upstream_errors": self.upstream_errors,
+                "evictions": self.evictions,
+                "in_flight": len(self.flights),
+                "disk": {
+                    "directory": self.directory,
+                    "hits": self.disk_hits,
+                    "writes": self.disk_writes
+                } if self.directory else None,
+                "ttls": dict(self.ttls, default=self.default_ttl)
+            }
+
+outbound_cache = OutboundCache()
+
 def _fetch_json(url, timeout=12):
     try:
-        response = requests.get(url, timeout=timeout)
-        response.raise_for_status()
-        return response.json()
+        return outbound_cache.get_json(url, timeout=timeout)
     except Exception:
         return None
 
@@ -2329,10 +4986,10 @@ def books_search():
             params['search'] = q
         if popular:
             params['sort'] = 'popular'
-        resp = requests.get('https://gutendex.com/books', params=params, timeout=15)
-        if not resp.ok:
+        try:
+            payload = outbound_cache.get_json('https://gutendex.com/books', params=params, timeout=15) or {}
+        except requests.HTTPError:
             return jsonify({"error": "book_search_failed"}), 502
-        payload = resp.json() or {}
         results = payload.get('results') or []
 
         if popular and not raw_q:
@@ -2390,17 +5047,13 @@ def books_content(book_id):
         return jsonify({"error": "Not logged in"}), 401
 
     key = str(book_id)
-    cached = BOOK_TEXT_CACHE.get(key)
-    if cached:
-        return jsonify(cached)
-
     try:
         meta = BOOK_META_CACHE.get(key)
         if not meta:
-            meta_resp = requests.get(f'https://gutendex.com/books/{book_id}', timeout=15)
-            if not meta_resp.ok:
+            try:
+                b = outbound_cache.get_json(f'https://gutendex.com/books/{book_id}', timeout=15) or {}
+            except requests.HTTPError:
                 return jsonify({"error": "book_not_found"}), 404
-            b = meta_resp.json() or {}
             formats = b.get('formats') or {}
             meta = {
                 "id": book_id,
@@ -2415,11 +5068,11 @@ def books_content(book_id):
         if not text_url:
             return jsonify({"error": "book_text_unavailable"}), 404
 
-        text_resp = requests.get(text_url, timeout=20)
-        if not text_resp.ok:
+        try:
+            raw = outbound_cache.get_text(text_url, timeout=20) or ''
+        except requests.HTTPError:
             return jsonify({"error": "book_text_fetch_failed"}), 502
 
-        raw = text_resp.text or ''
         cleaned = _strip_gutenberg_boilerplate(raw)
         if len(cleaned) < 200:
             return jsonify({"error": "book_text_too_short"}), 422
@@ -2434,7 +5087,7 @@ def books_content(book_id):
             "cover": meta.get('cover') or '',
             "text": cleaned
         }
-        BOOK_TEXT_CACHE[key] = payload
+        # The raw text is already held by outbound_cache under its byte budget.
         return jsonify(payload)
     except Exception as e:
         logger.error(f"Book content error: {e}")
@@ -2472,38 +5125,16 @@ def set_interval():
     
     # Save to database for persistence
     try:
-        conn, db_type = get_db()
-        c = conn.cursor()
-        
-        # Ensure table exists
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Save interval
-        if db_type == 'postgres':
-            c.execute("""
+        with db_connection() as (conn, db_type):
+            db_execute(conn, db_type, """
                 INSERT INTO system_settings (key, value, updated_at)
-                VALUES ('verse_interval', %s, CURRENT_TIMESTAMP)
+                VALUES ('verse_interval', ?, CURRENT_TIMESTAMP)
                 ON CONFLICT (key) DO UPDATE SET
                     value = EXCLUDED.value,
                     updated_at = EXCLUDED.updated_at
             """, (str(interval),))
-        else:
-            c.execute("""
-                INSERT INTO system_settings (key, value, updated_at)
-                VALUES ('verse_interval', ?, CURRENT_TIMESTAMP)
-                ON CONFLICT(key) DO UPDATE SET
-                    value = excluded.value,
-                    updated_at = excluded.updated_at
-            """, (str(interval),))
-        
-        conn.commit()
-        conn.close()
+            conn.commit()
+        system_settings_changed({'verse_interval': interval})
         logger.info(f"Verse interval saved to database: {interval} seconds")
     except Exception as e:
         logger.error(f"Failed to save interval to DB: {e}")
@@ -2516,7 +5147,6 @@ def get_user_info():
         return jsonify({"error": "Not logged in"}), 401
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     user_id = session['user_id']
 
     def parse_dt(value):
@@ -2544,13 +5174,7 @@ def get_user_info():
         ]
         for table in tables:
             try:
-                if db_type == 'postgres':
-                    c.execute(f"SELECT MIN(timestamp) FROM {table} WHERE user_id = %s", (user_id,))
-                else:
-                    c.execute(f"SELECT MIN(timestamp) FROM {table} WHERE user_id = ?", (user_id,))
-                row = c.fetchone()
-                value = row[0] if row else None
-                dt = parse_dt(value)
+                dt = parse_dt(db_scalar(conn, db_type, f"SELECT MIN(timestamp) FROM {table} WHERE user_id = ?", (user_id,)))
                 if dt and (earliest is None or dt < earliest):
                     earliest = dt
             except Exception:
@@ -2558,34 +5182,21 @@ def get_user_info():
         return earliest
     
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT created_at, is_admin, is_banned, role, name, email, picture, custom_picture, avatar_decoration FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT created_at, is_admin, is_banned, role, name, email, picture, custom_picture, avatar_decoration FROM users WHERE id = ?", (user_id,))
-        
-        row = c.fetchone()
-        
+        row = db_query_one(conn, db_type, """
+            SELECT created_at, is_admin, is_banned, role, name, email, picture, custom_picture, avatar_decoration
+            FROM users WHERE id = ?
+        """, (user_id,))
+
         if row:
-            if isinstance(row, dict) or hasattr(row, 'keys'):
-                created_at_val = row['created_at']
-                is_admin_val = bool(row['is_admin'])
-                is_banned_val = bool(row['is_banned'])
-                role_val = row['role'] or 'user'
-                name_val = row['name'] or session.get('user_name')
-                email_val = row_value(row, 'email', session.get('user_email')) or session.get('user_email')
-                base_picture = row_value(row, 'picture')
-                custom_picture = row_value(row, 'custom_picture')
-                avatar_decoration = row_value(row, 'avatar_decoration')
-            else:
-                created_at_val = row[0]
-                is_admin_val = bool(row[1])
-                is_banned_val = bool(row[2])
-                role_val = row[3] if row[3] else 'user'
-                name_val = row[4] if len(row) > 4 else session.get('user_name')
-                email_val = row[5] if len(row) > 5 else session.get('user_email')
-                base_picture = row[6] if len(row) > 6 else None
-                custom_picture = row[7] if len(row) > 7 else None
-                avatar_decoration = row[8] if len(row) > 8 else None
+            created_at_val = row.created_at
+            is_admin_val = bool(row.is_admin)
+            is_banned_val = bool(row.is_banned)
+            role_val = row.role or 'user'
+            name_val = row.name or session.get('user_name')
+            email_val = row.email or session.get('user_email')
+            base_picture = row.picture
+            custom_picture = row.custom_picture
+            avatar_decoration = row.avatar_decoration
 
             parsed_created = parse_dt(created_at_val)
             created_at_val = parsed_created.isoformat() if parsed_created else None
@@ -2595,12 +5206,9 @@ def get_user_info():
                 if earliest:
                     created_at_val = earliest.isoformat()
                 else:
-                    created_at_val = datetime.now().isoformat()
+                    created_at_val = utc_now().isoformat()
                 try:
-                    if db_type == 'postgres':
-                        c.execute("UPDATE users SET created_at = %s WHERE id = %s", (created_at_val, user_id))
-                    else:
-                        c.execute("UPDATE users SET created_at = ? WHERE id = ?", (created_at_val, user_id))
+                    db_execute(conn, db_type, "UPDATE users SET created_at = ? WHERE id = ?", (created_at_val, user_id))
                     conn.commit()
                 except Exception:
                     conn.rollback()
@@ -2612,10 +5220,7 @@ def get_user_info():
                 if role_priority(session_role) > role_priority(db_role):
                     is_admin_val = True
                     role_val = session_role
-                    if db_type == 'postgres':
-                        c.execute("UPDATE users SET role = %s, is_admin = %s WHERE id = %s", (role_val, 1, user_id))
-                    else:
-                        c.execute("UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (role_val, 1, user_id))
+                    db_execute(conn, db_type, "UPDATE users SET role = ?, is_admin = ? WHERE id = ?", (role_val, 1, user_id))
                     conn.commit()
             except Exception:
                 conn.rollback()
@@ -2662,12 +5267,8 @@ def update_user_name():
         return jsonify({"error": "Name must be 40 characters or less"}), 400
 
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        if db_type == 'postgres':
-            c.execute("UPDATE users SET name = %s WHERE id = %s", (new_name, session['user_id']))
-        else:
-            c.execute("UPDATE users SET name = ? WHERE id = ?", (new_name, session['user_id']))
+        db_execute(conn, db_type, "UPDATE users SET name = ? WHERE id = ?", (new_name, session['user_id']))
         conn.commit()
         session['user_name'] = new_name
         return jsonify({"success": True, "name": new_name})
@@ -2719,16 +5320,10 @@ def verify_role_code():
     
     if role:
         conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
         
         try:
             is_admin = 1 if role in ['owner', 'co_owner', 'mod', 'host'] else 0
-            
-            if db_type == 'postgres':
-                c.execute("UPDATE users SET is_admin = %s, role = %s WHERE id = %s", (is_admin, role, session['user_id']))
-            else:
-                c.execute("UPDATE users SET is_admin = ?, role = ? WHERE id = ?", (is_admin, role, session['user_id']))
-            
+            db_execute(conn, db_type, "UPDATE users SET is_admin = ?, role = ? WHERE id = ?", (is_admin, role, session['user_id']))
             conn.commit()
             
             session['is_admin'] = bool(is_admin)
@@ -2755,84 +5350,40 @@ def get_stats():
     if is_banned:
         return jsonify({"error": "banned"}), 403
     
-    conn, db_type = get_db()
-    c = conn.cursor()  # Use regular cursor for better compatibility
+    conn, db_type = get_db(readonly=True)
     
     try:
-        # Ensure comments table has is_deleted column
-        try:
-            if db_type == 'postgres':
-                c.execute("ALTER TABLE comments ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-                c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            else:
-                c.execute("SELECT is_deleted FROM comments LIMIT 1")
-                try:
-                    c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-                except Exception:
-                    c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-        except:
-            try:
-                c.execute("ALTER TABLE comments ADD COLUMN is_deleted INTEGER DEFAULT 0")
-                c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            except:
-                pass
-        conn.commit()
-        
+        uid = session['user_id']
+
         # Helper to get count safely
-        def safe_count(query, params=None):
+        def safe_count(query, params=()):
             try:
-                if params:
-                    c.execute(query, params)
-                else:
-                    c.execute(query)
-                row = c.fetchone()
-                return row[0] if row else 0
+                return int(db_scalar(conn, db_type, query, params, 0))
             except Exception as e:
                 logger.error(f"Query failed: {query}, error: {e}")
                 return 0
         
-        if db_type == 'postgres':
-            total = safe_count("SELECT COUNT(*) FROM verses")
-            liked = safe_count("SELECT COUNT(*) FROM likes WHERE user_id = %s", (session['user_id'],))
-            saved = safe_count("SELECT COUNT(*) FROM saves WHERE user_id = %s", (session['user_id'],))
-            # Count all comments by this user
-            comments = safe_count("SELECT COUNT(*) FROM comments WHERE user_id = %s AND COALESCE(is_deleted, 0) = 0", (session['user_id'],))
-            # Also count community messages
-            community = safe_count("SELECT COUNT(*) FROM community_messages WHERE user_id = %s", (session['user_id'],))
-            replies = safe_count("""
-                SELECT COUNT(*)
-                FROM comment_replies r
-                LEFT JOIN comments c
-                    ON r.parent_type = 'comment' AND r.parent_id = c.id
-                LEFT JOIN community_messages m
-                    ON r.parent_type = 'community' AND r.parent_id = m.id
-                WHERE r.user_id = %s
-                  AND COALESCE(r.is_deleted, 0) = 0
-                  AND (
-                      (r.parent_type = 'comment' AND COALESCE(c.is_deleted, 0) = 0)
-                      OR (r.parent_type = 'community' AND m.id IS NOT NULL)
-                  )
-            """, (session['user_id'],))
-        else:
-            total = safe_count("SELECT COUNT(*) FROM verses")
-            liked = safe_count("SELECT COUNT(*) FROM likes WHERE user_id = ?", (session['user_id'],))
-            saved = safe_count("SELECT COUNT(*) FROM saves WHERE user_id = ?", (session['user_id'],))
-            comments = safe_count("SELECT COUNT(*) FROM comments WHERE user_id = ? AND COALESCE(is_deleted, 0) = 0", (session['user_id'],))
-            community = safe_count("SELECT COUNT(*) FROM community_messages WHERE user_id = ?", (session['user_id'],))
-            replies = safe_count("""
-                SELECT COUNT(*)
-                FROM comment_replies r
-                LEFT JOIN comments c
-                    ON r.parent_type = 'comment' AND r.parent_id = c.id
-                LEFT JOIN community_messages m
-                    ON r.parent_type = 'community' AND r.parent_id = m.id
-                WHERE r.user_id = ?
-                  AND COALESCE(r.is_deleted, 0) = 0
-                  AND (
-                      (r.parent_type = 'comment' AND COALESCE(c.is_deleted, 0) = 0)
-                      OR (r.parent_type = 'community' AND m.id IS NOT NULL)
-                  )
-            """, (session['user_id'],))
+        total = safe_count("SELECT COUNT(*) AS total FROM verses")
+        liked = safe_count("SELECT COUNT(*) AS total FROM likes WHERE user_id = ?", (uid,))
+        saved = safe_count("SELECT COUNT(*) AS total FROM saves WHERE user_id = ?", (uid,))
+        # Count all comments by this user
+        comments = safe_count("SELECT COUNT(*) AS total FROM comments WHERE user_id = ? AND COALESCE(is_deleted, 0) = 0", (uid,))
+        # Also count community messages
+        community = safe_count("SELECT COUNT(*) AS total FROM community_messages WHERE user_id = ?", (uid,))
+        replies = safe_count("""
+            SELECT COUNT(*) AS total
+            FROM comment_replies r
+            LEFT JOIN comments c
+                ON r.parent_type = 'comment' AND r.parent_id = c.id
+            LEFT JOIN community_messages m
+                ON r.parent_type = 'community' AND r.parent_id = m.id
+            WHERE r.user_id = ?
+              AND COALESCE(r.is_deleted, 0) = 0
+              AND (
+                  (r.parent_type = 'comment' AND COALESCE(c.is_deleted, 0) = 0)
+                  OR (r.parent_type = 'community' AND m.id IS NOT NULL)
+              )
+        """, (uid,))
         
         logger.info(f"Stats for user {session['user_id']}: verses={total}, liked={liked}, saved={saved}, comments={comments}, community={community}, replies={replies}")
         
@@ -2857,8 +5408,6 @@ def get_daily_challenge():
     if is_banned:
         return jsonify({"error": "banned"}), 403
 
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     period_key = get_challenge_period_key()
     period_start, period_end = get_hour_window()
     hide_at = period_start + timedelta(hours=2)
@@ -2867,46 +5416,13 @@ def get_daily_challenge():
     action = challenge.get('action', 'save')
 
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS daily_actions (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    verse_id INTEGER,
-                    event_date TEXT NOT NULL,
-                    timestamp TEXT,
-                    UNIQUE(user_id, action, verse_id, event_date)
-                )
-            """)
-            c.execute("""
-                SELECT COUNT(*) AS count
-                FROM daily_actions
-                WHERE user_id = %s AND action = %s AND event_date = %s
-            """, (session['user_id'], action, period_key))
-            row = c.fetchone()
-            progress = int(row['count'] if row and isinstance(row, dict) else (row[0] if row else 0))
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS daily_actions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    action TEXT NOT NULL,
-                    verse_id INTEGER,
-                    event_date TEXT NOT NULL,
-                    timestamp TEXT,
-                    UNIQUE(user_id, action, verse_id, event_date)
-                )
-            """)
-            c.execute("""
+        with db_connection(readonly=True) as (conn, db_type):
+            progress = int(db_scalar(conn, db_type, """
                 SELECT COUNT(*)
                 FROM daily_actions
                 WHERE user_id = ? AND action = ? AND event_date = ?
-            """, (session['user_id'], action, period_key))
-            row = c.fetchone()
-            progress = int(row[0] if row else 0)
+            """, (session['user_id'], action, period_key), default=0))
 
-        conn.commit()
         progress = min(progress, goal)
         xp_reward = get_hourly_xp_reward(session['user_id'], period_key)
         now_ts = datetime.now().astimezone()
@@ -2928,8 +5444,6 @@ def get_daily_challenge():
     except Exception as e:
         logger.error(f"Daily challenge error: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
 
 @app.route('/api/debug/comments')
 def debug_comments():
@@ -2937,41 +5451,26 @@ def debug_comments():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
     
-    conn, db_type = get_db()
-    c = conn.cursor()
+    conn, db_type = get_db(readonly=True)
     
     try:
         # Get total comments count
-        c.execute("SELECT COUNT(*) FROM comments")
-        total_comments = c.fetchone()[0]
+        total_comments = db_scalar(conn, db_type, "SELECT COUNT(*) AS total FROM comments", (), 0)
         
         # Get comments by current user
-        if db_type == 'postgres':
-            c.execute("SELECT COUNT(*) FROM comments WHERE user_id = %s", (session['user_id'],))
-        else:
-            c.execute("SELECT COUNT(*) FROM comments WHERE user_id = ?", (session['user_id'],))
-        user_comments = c.fetchone()[0]
+        user_comments = db_scalar(conn, db_type, "SELECT COUNT(*) AS total FROM comments WHERE user_id = ?", (session['user_id'],), 0)
         
         # Get sample comments (last 5)
-        if db_type == 'postgres':
-            c.execute("SELECT id, user_id, verse_id, text, timestamp FROM comments ORDER BY timestamp DESC LIMIT 5")
-        else:
-            c.execute("SELECT id, user_id, verse_id, text, timestamp FROM comments ORDER BY timestamp DESC LIMIT 5")
-        sample = c.fetchall()
+        sample = db_query(conn, db_type, "SELECT id, user_id, verse_id, text, timestamp FROM comments ORDER BY timestamp DESC LIMIT 5")
         
         # Get table schema info
-        if db_type == 'postgres':
-            c.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'comments'")
-            columns = [row[0] for row in c.fetchall()]
-        else:
-            c.execute("PRAGMA table_info(comments)")
-            columns = [row[1] for row in c.fetchall()]
+        columns = _table_columns(conn, db_type, 'comments')
         
         return jsonify({
             "total_comments": total_comments,
             "user_comments": user_comments,
             "current_user_id": session['user_id'],
-            "sample_comments": [{"id": r[0], "user_id": r[1], "verse_id": r[2], "text": r[3][:50] if r[3] else None, "timestamp": r[4]} for r in sample],
+            "sample_comments": [{"id": r.id, "user_id": r.user_id, "verse_id": r.verse_id, "text": r.text[:50] if r.text else None, "timestamp": r.timestamp} for r in sample],
             "table_columns": columns,
             "db_type": db_type
         })
@@ -2995,46 +5494,30 @@ def like_verse():
     data = request.get_json()
     verse_id = data.get('verse_id')
     verse_payload = data.get('verse') if isinstance(data, dict) else None
-    
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    user_id = session['user_id']
     
     try:
-        verse_id = ensure_verse_id(c, db_type, verse_id, verse_payload)
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM likes WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
-            if c.fetchone():
-                c.execute("DELETE FROM likes WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
-                liked = False
-            else:
-                c.execute("INSERT INTO likes (user_id, verse_id, timestamp) VALUES (%s, %s, %s)",
-                          (session['user_id'], verse_id, datetime.now().isoformat()))
-                liked = True
-        else:
-            c.execute("SELECT id FROM likes WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
-            if c.fetchone():
-                c.execute("DELETE FROM likes WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
+        with db_connection() as (conn, db_type):
+            verse_id = ensure_verse_id(conn, db_type, verse_id, verse_payload)
+            if db_query_one(conn, db_type, "SELECT id FROM likes WHERE user_id = ? AND verse_id = ?", (user_id, verse_id)):
+                db_execute(conn, db_type, "DELETE FROM likes WHERE user_id = ? AND verse_id = ?", (user_id, verse_id))
                 liked = False
             else:
-                c.execute("INSERT INTO likes (user_id, verse_id, timestamp) VALUES (?, ?, ?)",
-                          (session['user_id'], verse_id, datetime.now().isoformat()))
+                db_execute(conn, db_type, "INSERT INTO likes (user_id, verse_id, timestamp) VALUES (?, ?, ?)",
+                           (user_id, verse_id, utc_now().isoformat()))
                 liked = True
-        
-        conn.commit()
-
-        if liked:
-            record_daily_action(session['user_id'], 'like', verse_id)
-        
-        if liked:
-            rec = generator.generate_smart_recommendation(session['user_id'])
-            return jsonify({"liked": liked, "recommendation": rec})
-        
-        return jsonify({"liked": liked})
+            conn.commit()
     except Exception as e:
         logger.error(f"Like error: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+
+    if liked:
+        record_daily_action(user_id, 'like', verse_id)
+        # Runs on its own connection, so ours goes back to the pool first.
+        rec = generator.generate_smart_recommendation(user_id)
+        return jsonify({"liked": liked, "recommendation": rec})
+
+    return jsonify({"liked": liked})
 
 @app.route('/api/save', methods=['POST'])
 def save_verse():
@@ -3048,49 +5531,34 @@ def save_verse():
     data = request.get_json()
     verse_id = data.get('verse_id')
     verse_payload = data.get('verse') if isinstance(data, dict) else None
-    
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    user_id = session['user_id']
     
     try:
-        verse_id = ensure_verse_id(c, db_type, verse_id, verse_payload)
-        now = datetime.now().isoformat()
-        period_key = get_challenge_period_key()
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM saves WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
-            if c.fetchone():
-                c.execute("DELETE FROM saves WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
+        with db_connection() as (conn, db_type):
+            verse_id = ensure_verse_id(conn, db_type, verse_id, verse_payload)
+            now = utc_now().isoformat()
+            if db_query_one(conn, db_type, "SELECT id FROM saves WHERE user_id = ? AND verse_id = ?", (user_id, verse_id)):
+                db_execute(conn, db_type, "DELETE FROM saves WHERE user_id = ? AND verse_id = ?", (user_id, verse_id))
                 saved = False
             else:
-                c.execute("INSERT INTO saves (user_id, verse_id, timestamp) VALUES (%s, %s, %s)",
-                          (session['user_id'], verse_id, now))
-                c.execute("""
+                db_execute(conn, db_type, "INSERT INTO saves (user_id, verse_id, timestamp) VALUES (?, ?, ?)",
+                           (user_id, verse_id, now))
+                db_execute(conn, db_type, """
                     INSERT INTO daily_actions (user_id, action, verse_id, event_date, timestamp)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (user_id, action, verse_id, event_date) DO NOTHING
-                """, (session['user_id'], 'save', verse_id, period_key, now))
-                saved = True
-        else:
-            c.execute("SELECT id FROM saves WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
-            if c.fetchone():
-                c.execute("DELETE FROM saves WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
-                saved = False
-            else:
-                c.execute("INSERT INTO saves (user_id, verse_id, timestamp) VALUES (?, ?, ?)",
-                          (session['user_id'], verse_id, now))
-                c.execute("""
-                    INSERT OR IGNORE INTO daily_actions (user_id, action, verse_id, event_date, timestamp)
                     VALUES (?, ?, ?, ?, ?)
-                """, (session['user_id'], 'save', verse_id, period_key, now))
+                    ON CONFLICT (user_id, action, verse_id, event_date) DO NOTHING
+                """, (user_id, 'save', verse_id, get_challenge_period_key(), now))
                 saved = True
-        
-        conn.commit()
+            conn.commit()
         return jsonify({"saved": saved})
     except Exception as e:
         logger.error(f"Save error: {e}")
         return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+
+LibraryVerseRecord = record_type('LibraryVerseRecord', (
+    'id', 'ref', 'text', 'trans', 'source', 'book', 'liked_at', 'saved_at'))
+CollectionVerseRecord = record_type('CollectionVerseRecord', ('id', 'ref', 'text'))
+CollectionRecord = record_type('CollectionRecord', ('id', 'name', 'color', 'count', 'verses'))
 
 @app.route('/api/library')
 def get_library():
@@ -3101,130 +5569,61 @@ def get_library():
     if is_banned:
         return jsonify({"error": "banned"}), 403
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
+    user_id = session['user_id']
     
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp as liked_at
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = %s 
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-            liked = [{"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                      "source": row['source'], "book": row['book'], "liked_at": row['liked_at'], "saved_at": None} for row in c.fetchall()]
-            
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, s.timestamp as saved_at
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = %s 
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-            saved = [{"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                      "source": row['source'], "book": row['book'], "liked_at": None, "saved_at": row['saved_at']} for row in c.fetchall()]
-            
-            # GET COLLECTIONS
-            c.execute("""
-                SELECT c.id, c.name, c.color, COUNT(vc.verse_id) as count 
-                FROM collections c
-                LEFT JOIN verse_collections vc ON c.id = vc.collection_id
-                WHERE c.user_id = %s
-                GROUP BY c.id
-            """, (session['user_id'],))
-        else:
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp as liked_at
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = ? 
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-            rows = c.fetchall()
-            liked = []
-            for row in rows:
-                try:
-                    liked.append({"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                              "source": row['source'], "book": row['book'], "liked_at": row['liked_at'], "saved_at": None})
-                except (TypeError, KeyError):
-                    liked.append({"id": row[0], "ref": row[1], "text": row[2], "trans": row[3], 
-                              "source": row[4], "book": row[6], "liked_at": row[7], "saved_at": None})
-            
-            c.execute("""
-                SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, s.timestamp as saved_at
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = ? 
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-            rows = c.fetchall()
-            saved = []
-            for row in rows:
-                try:
-                    saved.append({"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'], 
-                              "source": row['source'], "book": row['book'], "liked_at": None, "saved_at": row['saved_at']})
-                except (TypeError, KeyError):
-                    saved.append({"id": row[0], "ref": row[1], "text": row[2], "trans": row[3], 
-                              "source": row[4], "book": row[6], "liked_at": None, "saved_at": row[7]})
-            
-            # GET COLLECTIONS
-            c.execute("""
-                SELECT c.id, c.name, c.color, COUNT(vc.verse_id) as count 
-                FROM collections c
-                LEFT JOIN verse_collections vc ON c.id = vc.collection_id
-                WHERE c.user_id = ?
-                GROUP BY c.id
-            """, (session['user_id'],))
+        liked = [LibraryVerseRecord(row.id, row.reference, row.text, row.translation, row.source, row.book,
+                                    row.liked_at, None)
+                 for row in db_query(conn, db_type, """
+            SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp as liked_at
+            FROM verses v 
+            JOIN likes l ON v.id = l.verse_id 
+            WHERE l.user_id = ? 
+            ORDER BY l.timestamp DESC
+        """, (user_id,))]
         
-        # Build collections list with verses
-        collections = []
-        for row in c.fetchall():
-            try:
-                col_id = row['id']
-                col_name = row['name']
-                col_color = row['color']
-                col_count = row['count']
-            except (TypeError, KeyError):
-                col_id = row[0]
-                col_name = row[1]
-                col_color = row[2]
-                col_count = row[3]
-            
-            if db_type == 'postgres':
-                c.execute("""
-                    SELECT v.id, v.reference, v.text FROM verses v
-                    JOIN verse_collections vc ON v.id = vc.verse_id
-                    WHERE vc.collection_id = %s
-                """, (col_id,))
-                verses = [{"id": v['id'], "ref": v['reference'], "text": v['text']} for v in c.fetchall()]
-            else:
-                c.execute("""
-                    SELECT v.id, v.reference, v.text FROM verses v
-                    JOIN verse_collections vc ON v.id = vc.verse_id
-                    WHERE vc.collection_id = ?
-                """, (col_id,))
-                verses = []
-                for v in c.fetchall():
-                    try:
-                        verses.append({"id": v['id'], "ref": v['reference'], "text": v['text']})
-                    except (TypeError, KeyError):
-                        verses.append({"id": v[0], "ref": v[1], "text": v[2]})
-            
-            collections.append({
-                "id": col_id, "name": col_name, "color": col_color, 
-                "count": col_count, "verses": verses
-            })
+        saved = [LibraryVerseRecord(row.id, row.reference, row.text, row.translation, row.source, row.book,
+                                    None, row.saved_at)
+                 for row in db_query(conn, db_type, """
+            SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, s.timestamp as saved_at
+            FROM verses v 
+            JOIN saves s ON v.id = s.verse_id 
+            WHERE s.user_id = ? 
+            ORDER BY s.timestamp DESC
+        """, (user_id,))]
+        
+        # GET COLLECTIONS
+        collection_rows = db_query(conn, db_type, """
+            SELECT c.id, c.name, c.color, COUNT(vc.verse_id) AS verse_count
+            FROM collections c
+            LEFT JOIN verse_collections vc ON c.id = vc.collection_id
+            WHERE c.user_id = ?
+            GROUP BY c.id
+        """, (user_id,))
+        
+        # One query for the verses of every collection instead of one per collection
+        verses_by_collection = {row.id: [] for row in collection_rows}
+        if verses_by_collection:
+            ids = list(verses_by_collection)
+            for v in db_query(conn, db_type, f"""
+                SELECT vc.collection_id, v.id, v.reference, v.text FROM verses v
+                JOIN verse_collections vc ON v.id = vc.verse_id
+                WHERE vc.collection_id IN ({sql_in(ids)})
+            """, ids):
+                verses_by_collection[v.collection_id].append(CollectionVerseRecord(v.id, v.reference, v.text))
+        
+        collections = [CollectionRecord(row.id, row.name, row.color, row.verse_count, verses_by_collection[row.id])
+                       for row in collection_rows]
         
-        favorites = next((c for c in collections if (c.get("name") or "").lower() == "favorites"), None)
+        favorites = next((c for c in collections if (c.name or "").lower() == "favorites"), None)
         return jsonify({
             "liked": liked,
             "saved": saved,
             "collections": collections,
             "liked_count": len(liked),
             "saved_count": len(saved),
-            "favorites_count": len(favorites.get("verses", [])) if favorites else 0
+            "favorites_count": len(favorites.verses) if favorites else 0
         })
     except Exception as e:
         logger.error(f"Library error: {e}")
@@ -3249,34 +5648,19 @@ def add_to_collection():
         return jsonify({"success": False, "error": "Missing collection_id or verse_id"}), 400
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     try:
         # Verify collection belongs to user
-        if db_type == 'postgres':
-            c.execute("SELECT user_id FROM collections WHERE id = %s", (collection_id,))
-        else:
-            c.execute("SELECT user_id FROM collections WHERE id = ?", (collection_id,))
-        
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, "SELECT user_id FROM collections WHERE id = ?", (collection_id,))
         if not row:
             return jsonify({"success": False, "error": "Collection not found"}), 404
         
-        try:
-            owner_id = row['user_id'] if isinstance(row, dict) else row[0]
-        except (TypeError, KeyError):
-            owner_id = row[0]
-        
-        if owner_id != session['user_id']:
+        if row.user_id != session['user_id']:
             return jsonify({"success": False, "error": "Not your collection"}), 403
         
         # Add verse to collection
-        if db_type == 'postgres':
-            c.execute("INSERT INTO verse_collections (collection_id, verse_id) VALUES (%s, %s)",
-                      (collection_id, verse_id))
-        else:
-            c.execute("INSERT INTO verse_collections (collection_id, verse_id) VALUES (?, ?)",
-                      (collection_id, verse_id))
+        db_execute(conn, db_type, "INSERT INTO verse_collections (collection_id, verse_id) VALUES (?, ?)",
+                   (collection_id, verse_id))
         conn.commit()
         return jsonify({"success": True})
     except Exception as e:
@@ -3303,18 +5687,10 @@ def create_collection():
         return jsonify({"error": "Name required"}), 400
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     try:
-        if db_type == 'postgres':
-            c.execute("INSERT INTO collections (user_id, name, color, created_at) VALUES (%s, %s, %s, %s) RETURNING id",
-                      (session['user_id'], name, color, datetime.now().isoformat()))
-            new_id = c.fetchone()['id']
-        else:
-            c.execute("INSERT INTO collections (user_id, name, color, created_at) VALUES (?, ?, ?, ?)",
-                      (session['user_id'], name, color, datetime.now().isoformat()))
-            new_id = c.lastrowid
-        
+        new_id = db_insert(conn, db_type, "INSERT INTO collections (user_id, name, color, created_at) VALUES (?, ?, ?, ?)",
+                           (session['user_id'], name, color, utc_now().isoformat()))
         conn.commit()
         return jsonify({"id": new_id, "name": name, "color": color, "count": 0, "verses": []})
     except Exception as e:
@@ -3347,7 +5723,6 @@ def get_mood_recommendation(mood):
         return jsonify({"error": "banned"}), 403
 
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
         mood_key = str(mood or '').strip().lower()
         keywords = MOOD_KEYWORDS.get(mood_key) or MOOD_KEYWORDS.get('peace', [])
@@ -3358,82 +5733,50 @@ def get_mood_recommendation(mood):
             if raw.isdigit():
                 exclude_ids.append(int(raw))
         exclude_ids = list(dict.fromkeys(exclude_ids))
+        sampler = corpus_sampler()
+        verse = None
+        if sampler is not None and keywords:
+            verse = sampler.search(keywords, exclude=corpus_keys_for(conn, db_type, exclude_ids))
+        verse_id = ensure_verse_row(conn, db_type, verse) if verse is not None else None
+        if verse_id is not None:
+            return jsonify({
+                "id": verse_id,
+                "ref": verse['ref'],
+                "text": verse['text'],
+                "trans": verse['trans'],
+                "book": verse['book']
+            })
+        exclude_clause = f"id NOT IN ({sql_in(exclude_ids)})" if exclude_ids else "1 = 1"
         row = None
         if keywords:
-            if db_type == 'postgres':
-                clauses = " OR ".join(["text ILIKE %s"] * len(keywords))
-                params = [f"%{k}%" for k in keywords]
-                exclude_clause = ''
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join(['%s'] * len(exclude_ids))})"
-                    params.extend(exclude_ids)
-                c.execute(f"""
-                    SELECT id, reference, text, translation, book
-                    FROM verses
-                    WHERE {clauses}
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, params)
-            else:
-                clauses = " OR ".join(["text LIKE ?"] * len(keywords))
-                params = [f"%{k}%" for k in keywords]
-                exclude_clause = ''
-                if exclude_ids:
-                    exclude_clause = f" AND id NOT IN ({','.join('?' for _ in exclude_ids)})"
-                    params.extend(exclude_ids)
-                c.execute(f"""
-                    SELECT id, reference, text, translation, book
-                    FROM verses
-                    WHERE {clauses}
-                    {exclude_clause}
-                    ORDER BY RANDOM()
-                    LIMIT 1
-                """, params)
-            row = c.fetchone()
+            clauses = " OR ".join([f"text {sql_like(db_type)} ?"] * len(keywords))
+            row = db_query_one(conn, db_type, f"""
+                SELECT id, reference, text, translation, book
+                FROM verses
+                WHERE ({clauses})
+                AND {exclude_clause}
+                ORDER BY RANDOM()
+                LIMIT 1
+            """, [f"%{k}%" for k in keywords] + exclude_ids)
 
         if not row:
-            if db_type == 'postgres':
-                if exclude_ids:
-                    c.execute(f"""
-                        SELECT id, reference, text, translation, book
-                        FROM verses
-                        WHERE id NOT IN ({','.join(['%s'] * len(exclude_ids))})
-                        ORDER BY RANDOM() LIMIT 1
-                    """, exclude_ids)
-                else:
-                    c.execute("SELECT id, reference, text, translation, book FROM verses ORDER BY RANDOM() LIMIT 1")
-            else:
-                if exclude_ids:
-                    c.execute(f"""
-                        SELECT id, reference, text, translation, book
-                        FROM verses
-                        WHERE id NOT IN ({','.join('?' for _ in exclude_ids)})
-                        ORDER BY RANDOM() LIMIT 1
-                    """, exclude_ids)
-                else:
-                    c.execute("SELECT id, reference, text, translation, book FROM verses ORDER BY RANDOM() LIMIT 1")
-            row = c.fetchone()
+            row = db_query_one(conn, db_type, f"""
+                SELECT id, reference, text, translation, book
+                FROM verses
+                WHERE {exclude_clause}
+                ORDER BY RANDOM() LIMIT 1
+            """, exclude_ids)
 
         if not row:
             return jsonify({"error": "No verses found"}), 404
 
-        try:
-            return jsonify({
-                "id": row['id'],
-                "ref": row['reference'],
-                "text": row['text'],
-                "trans": row['translation'],
-                "book": row['book']
-            })
-        except (TypeError, KeyError):
-            return jsonify({
-                "id": row[0],
-                "ref": row[1],
-                "text": row[2],
-                "trans": row[3],
-                "book": row[4] if len(row) > 4 else ''
-            })
+        return jsonify({
+            "id": row.id,
+            "ref": row.reference,
+            "text": row.text,
+            "trans": row.translation,
+            "book": row.book or ''
+        })
     except Exception as e:
         logger.error(f"Mood recommendation error: {e}")
         return jsonify({"error": str(e)}), 500
@@ -3454,47 +5797,30 @@ def update_user_avatar():
     if kind not in ('picture', 'decoration'):
         return jsonify({"error": "Invalid kind"}), 400
 
+    uid = session['user_id']
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
         if kind == 'picture':
             if reset:
-                if db_type == 'postgres':
-                    c.execute("UPDATE users SET custom_picture = NULL WHERE id = %s", (session['user_id'],))
-                else:
-                    c.execute("UPDATE users SET custom_picture = NULL WHERE id = ?", (session['user_id'],))
+                db_execute(conn, db_type, "UPDATE users SET custom_picture = NULL WHERE id = ?", (uid,))
                 try:
-                    if db_type == 'postgres':
-                        c.execute("SELECT picture FROM users WHERE id = %s", (session['user_id'],))
-                    else:
-                        c.execute("SELECT picture FROM users WHERE id = ?", (session['user_id'],))
-                    base_row = c.fetchone()
-                    base_pic = base_row['picture'] if isinstance(base_row, dict) else (base_row[0] if base_row else '')
+                    base_pic = db_scalar(conn, db_type, "SELECT picture FROM users WHERE id = ?", (uid,), '')
                 except Exception:
                     base_pic = session.get('user_picture') or ''
                 session['user_picture'] = base_pic
             else:
                 if len(url) < 6:
                     return jsonify({"error": "Invalid URL"}), 400
-                if db_type == 'postgres':
-                    c.execute("UPDATE users SET custom_picture = %s WHERE id = %s", (url, session['user_id']))
-                else:
-                    c.execute("UPDATE users SET custom_picture = ? WHERE id = ?", (url, session['user_id']))
+                db_execute(conn, db_type, "UPDATE users SET custom_picture = ? WHERE id = ?", (url, uid))
                 session['user_picture'] = url
         else:
             if reset:
-                if db_type == 'postgres':
-                    c.execute("UPDATE users SET avatar_decoration = NULL WHERE id = %s", (session['user_id'],))
-                else:
-                    c.execute("UPDATE users SET avatar_decoration = NULL WHERE id = ?", (session['user_id'],))
+                db_execute(conn, db_type, "UPDATE users SET avatar_decoration = NULL WHERE id = ?", (uid,))
                 session['avatar_decoration'] = None
             else:
                 if len(url) < 6:
                     return jsonify({"error": "Invalid URL"}), 400
-                if db_type == 'postgres':
-                    c.execute("UPDATE users SET avatar_decoration = %s WHERE id = %s", (url, session['user_id']))
-                else:
-                    c.execute("UPDATE users SET avatar_decoration = ? WHERE id = ?", (url, session['user_id']))
+                db_execute(conn, db_type, "UPDATE users SET avatar_decoration = ? WHERE id = ?", (url, uid))
                 session['avatar_decoration'] = url
 
         conn.commit()
@@ -3550,19 +5876,12 @@ def upload_user_avatar():
 
     url = f"/static/uploads/{subdir}/{filename}"
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
         if kind == 'picture':
-            if db_type == 'postgres':
-                c.execute("UPDATE users SET custom_picture = %s WHERE id = %s", (url, session['user_id']))
-            else:
-                c.execute("UPDATE users SET custom_picture = ? WHERE id = ?", (url, session['user_id']))
+            db_execute(conn, db_type, "UPDATE users SET custom_picture = ? WHERE id = ?", (url, session['user_id']))
             session['user_picture'] = url
         else:
-            if db_type == 'postgres':
-                c.execute("UPDATE users SET avatar_decoration = %s WHERE id = %s", (url, session['user_id']))
-            else:
-                c.execute("UPDATE users SET avatar_decoration = ? WHERE id = ?", (url, session['user_id']))
+            db_execute(conn, db_type, "UPDATE users SET avatar_decoration = ? WHERE id = ?", (url, session['user_id']))
             session['avatar_decoration'] = url
         conn.commit()
     finally:
@@ -3604,7 +5923,11 @@ def db_status():
             "render_env": RENDER_ENV,
             "sqlite_path": SQLITE_PATH if db_type == 'sqlite' else None,
             "database_url": _redact_db_url(DATABASE_URL) if db_type == 'postgres' else None,
-            "counts": counts
+            "counts": counts,
+            "schema_version": SCHEMA_VERSION,
+            "pool": get_db_pool_stats(),
+            "presence": presence_tracker.stats(),
+            "events": activity_events.stats()
         }
         conn.close()
         return jsonify(info)
@@ -3623,33 +5946,22 @@ def db_status_page():
 def public_profile(user_id):
     if 'user_id' not in session:
         return redirect('/login')
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, created_at, avatar_decoration FROM users WHERE id = %s", (user_id,))
-        else:
-            c.execute("SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, created_at, avatar_decoration FROM users WHERE id = ?", (user_id,))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, """
+            SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, created_at, avatar_decoration
+            FROM users WHERE id = ?
+        """, (user_id,))
         if not row:
             conn.close()
             return "User not found", 404
-        if hasattr(row, 'keys'):
-            name = row['name'] or 'User'
-            email = row['email'] or ''
-            picture = row['picture'] or ''
-            role = normalize_role(row['role'] or 'user')
-            created_at = row['created_at'] or ''
-            avatar_decoration = row_value(row, 'avatar_decoration')
-            uid = row['id']
-        else:
-            uid = row[0]
-            name = row[1] or 'User'
-            email = row[2] or ''
-            picture = row[3] or ''
-            role = normalize_role(row[4] if len(row) > 4 else 'user')
-            created_at = row[5] if len(row) > 5 else ''
-            avatar_decoration = row[6] if len(row) > 6 else None
+        uid = row.id
+        name = row.name or 'User'
+        email = row.email or ''
+        picture = row.picture or ''
+        role = normalize_role(row.role or 'user')
+        created_at = row.created_at or ''
+        avatar_decoration = row.avatar_decoration
         viewer_role = normalize_role(session.get('admin_role') or session.get('role') or 'user')
         show_email = role_priority(viewer_role) >= role_priority('host')
         can_dm = session.get('user_id') != uid
@@ -3714,7 +6026,8 @@ def db_check():
             "sqlite_path": SQLITE_PATH if db_type == 'sqlite' else None,
             "database_url": _redact_db_url(DATABASE_URL) if db_type == 'postgres' else None,
             "missing_tables": missing_tables,
-            "tables": table_info
+            "tables": table_info,
+            "presence": presence_tracker.stats()
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -3731,34 +6044,8 @@ def _request_location_snapshot():
     }
 
 def log_user_activity(action, user_id=None, message=None, extras=None):
-    """Write user activity into audit_logs for admin dashboards."""
+    """Queue user activity for audit_logs (admin dashboards); the request context is captured here."""
     try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id SERIAL PRIMARY KEY,
-                    admin_id TEXT,
-                    action TEXT,
-                    target_user_id INTEGER,
-                    details TEXT,
-                    ip_address TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS audit_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    admin_id TEXT,
-                    action TEXT,
-                    target_user_id INTEGER,
-                    details TEXT,
-                    ip_address TEXT,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
         payload = {
             "message": str(message or ""),
             "status": "success",
@@ -3766,34 +6053,19 @@ def log_user_activity(action, user_id=None, message=None, extras=None):
             "extras": extras if isinstance(extras, dict) else {},
             "target": {"user_id": user_id} if user_id is not None else {}
         }
-        details_json = json.dumps(payload, ensure_ascii=False)
         admin_id = str(user_id) if user_id is not None else "system"
-        now_ts = datetime.now().isoformat()
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address, timestamp)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (admin_id, action, user_id, details_json, payload["location"].get("ip"), now_ts))
-        else:
-            c.execute("""
-                INSERT INTO audit_logs (admin_id, action, target_user_id, details, ip_address, timestamp)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (admin_id, action, user_id, details_json, payload["location"].get("ip"), now_ts))
-        conn.commit()
-        conn.close()
+        activity_events.emit('activity', (admin_id, action, user_id, json.dumps(payload, ensure_ascii=False),
+                                          payload["location"].get("ip"), utc_now().isoformat()))
     except Exception:
         pass
+
 def ensure_verse_id(c, db_type, verse_id, verse_payload=None):
     """Ensure a verse exists in DB and return a valid verse_id."""
     try:
         if verse_id:
-            if db_type == 'postgres':
-                c.execute("SELECT id FROM verses WHERE id = %s", (verse_id,))
-            else:
-                c.execute("SELECT id FROM verses WHERE id = ?", (verse_id,))
-            row = c.fetchone()
-            if row:
-                return row['id'] if hasattr(row, 'keys') else row[0]
+            found = db_scalar(c, db_type, "SELECT id FROM verses WHERE id = ?", (verse_id,))
+            if found is not None:
+                return found
     except Exception:
         pass
 
@@ -3808,35 +6080,23 @@ def ensure_verse_id(c, db_type, verse_id, verse_payload=None):
     trans = (verse_payload.get('translation') or verse_payload.get('trans') or '').strip()
     source = (verse_payload.get('source') or '').strip()
     book = (verse_payload.get('book') or '').strip()
-    now = datetime.now().isoformat()
+    now = utc_now().isoformat()
 
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", (ref, text))
-        else:
-            c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
-        row = c.fetchone()
-        if row:
-            return row['id'] if hasattr(row, 'keys') else row[0]
+        found = db_scalar(c, db_type, "SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
+        if found is not None:
+            return found
     except Exception:
         pass
 
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO verses (reference, text, translation, source, timestamp, book)
-                VALUES (%s, %s, %s, %s, %s, %s)
-            """, (ref, text, trans, source, now, book))
-            c.execute("SELECT id FROM verses WHERE reference = %s AND text = %s", (ref, text))
-        else:
-            c.execute("""
-                INSERT INTO verses (reference, text, translation, source, timestamp, book)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (ref, text, trans, source, now, book))
-            c.execute("SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
-        row = c.fetchone()
-        if row:
-            return row['id'] if hasattr(row, 'keys') else row[0]
+        db_execute(c, db_type, """
+            INSERT INTO verses (reference, text, translation, source, timestamp, book)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (ref, text, trans, source, now, book))
+        found = db_scalar(c, db_type, "SELECT id FROM verses WHERE reference = ? AND text = ?", (ref, text))
+        if found is not None:
+            return found
     except Exception:
         pass
     return verse_id
@@ -3857,132 +6117,57 @@ def generate_rec():
         return jsonify({"success": True, "recommendation": rec})
     return jsonify({"success": False})
 
+COMMENTS_PAGE_MAX = 200
+
 @app.route('/api/comments/<int:verse_id>')
 def get_comments(verse_id):
-    logger.info(f"[DEBUG] get_comments called for verse_id={verse_id}")
-    
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    """Comment thread for a verse, newest first, in three queries regardless of size.
+
+    Optional paging: ?limit=N (max COMMENTS_PAGE_MAX) and ?before=<comment id>,
+    where the cursor is the id of the last comment on the previous page.
+    """
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        # Ensure table exists
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comments (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER,
-                    verse_id INTEGER,
-                    text TEXT,
-                    timestamp TIMESTAMP,
-                    google_name TEXT,
-                    google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    verse_id INTEGER,
-                    text TEXT,
-                    timestamp TIMESTAMP,
-                    google_name TEXT,
-                    google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            """)
-        conn.commit()
-        
-        # Count total comments first
-        if db_type == 'postgres':
-            c.execute("SELECT COUNT(*) as count FROM comments")
-        else:
-            c.execute("SELECT COUNT(*) as count FROM comments")
-        count_row = c.fetchone()
-        try:
-            total_count = count_row['count'] if isinstance(count_row, dict) else count_row[0]
-        except:
-            total_count = 0
-        logger.info(f"[DEBUG] Total comments in database: {total_count}")
-        
-        ensure_comment_social_tables(c, db_type)
-        conn.commit()
-
-        # Query comments for this verse
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, user_id, text, timestamp, google_name
-                FROM comments
-                WHERE verse_id = %s AND COALESCE(is_deleted, 0) = 0
-                ORDER BY timestamp DESC
-            """, (verse_id,))
-        else:
-            c.execute("""
-                SELECT id, user_id, text, timestamp, google_name
-                FROM comments
-                WHERE verse_id = ? AND COALESCE(is_deleted, 0) = 0
-                ORDER BY timestamp DESC
-            """, (verse_id,))
-        
-        rows = c.fetchall()
+        where = "cm.verse_id = ? AND COALESCE(cm.is_deleted, 0) = 0"
+        params = [verse_id]
+        if before is not None:
+            where += " AND (cm.timestamp, cm.id) < (SELECT b.timestamp, b.id FROM comments b WHERE b.id = ?)"
+            params.append(before)
+        page = ""
+        if limit is not None:
+            page = "LIMIT ?"
+            params.append(min(COMMENTS_PAGE_MAX, max(1, limit)))
+        rows = db_query(conn, db_type, f"""
+            SELECT
+                cm.id, cm.user_id, cm.text, cm.timestamp, cm.google_name,
+                u.name AS db_name, COALESCE(u.custom_picture, u.picture) AS db_picture, u.role AS db_role,
+                u.avatar_decoration AS db_decor
+            FROM comments cm
+            LEFT JOIN users u ON cm.user_id = u.id
+            WHERE {where}
+            ORDER BY cm.timestamp DESC, cm.id DESC
+            {page}
+        """, params)
         
-        comments = []
-        for row in rows:
-            try:
-                comment_id = row['id']
-                user_id = row['user_id']
-                text = row['text']
-                timestamp = row['timestamp']
-                google_name = row['google_name']
-            except (TypeError, KeyError):
-                comment_id = row[0]
-                user_id = row[1]
-                text = row[2]
-                timestamp = row[3]
-                google_name = row[4]
-            
-            # Get user info if available
-            user_name = google_name or "Anonymous"
-            user_picture = ""
-            user_role = "user"
-            user_decor = ""
-            
-            if user_id:
-                try:
-                    if db_type == 'postgres':
-                        c.execute("SELECT name, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration FROM users WHERE id = %s", (user_id,))
-                    else:
-                        c.execute("SELECT name, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration FROM users WHERE id = ?", (user_id,))
-                    user_row = c.fetchone()
-                    if user_row:
-                        try:
-                            user_name = user_row['name'] or google_name or "Anonymous"
-                            user_picture = user_row['picture'] or ""
-                            user_role = normalize_role(user_row['role'] or "user")
-                            user_decor = row_value(user_row, 'avatar_decoration') or ""
-                        except (TypeError, KeyError):
-                            user_name = user_row[0] or google_name or "Anonymous"
-                            user_picture = user_row[1] or ""
-                            user_role = normalize_role(user_row[2] if len(user_row) > 2 and user_row[2] else "user")
-                            user_decor = user_row[3] if len(user_row) > 3 else ""
-                except Exception as user_err:
-                    logger.error(f"Error getting user info: {user_err}")
-            
-            replies = get_replies_for_parent(c, db_type, "comment", comment_id)
-            comments.append({
-                "id": comment_id,
-                "text": text or "",
-                "timestamp": timestamp,
-                "user_name": user_name,
-                "user_picture": user_picture,
-                "avatar_decoration": user_decor or "",
-                "user_id": user_id,
-                "user_role": user_role,
-                "reactions": get_reaction_counts(c, db_type, "comment", comment_id),
-                "replies": replies,
-                "reply_count": len(replies)
-            })
+        ids = [row.id for row in rows]
+        replies = get_replies_for_parents(conn, db_type, "comment", ids)
+        reactions = get_reaction_counts_for_items(conn, db_type, "comment", ids)
+        comments = [PostRecord(
+            id=row.id,
+            text=row.text or "",
+            timestamp=row.timestamp,
+            user_name=row.db_name or row.google_name or "Anonymous",
+            user_picture=row.db_picture or "",
+            avatar_decoration=row.db_decor or "",
+            user_id=row.user_id,
+            user_role=normalize_role(row.db_role or "user"),
+            reactions=reactions[row.id],
+            replies=replies[row.id],
+            reply_count=len(replies[row.id])
+        ) for row in rows]
         
         return jsonify(comments)
     except Exception as e:
@@ -3993,69 +6178,12 @@ def get_comments(verse_id):
     finally:
         conn.close()
 
-def check_comment_restriction(user_id):
-    """Check if user is restricted from commenting. Returns (is_restricted, reason, expires_at)"""
-    global RESTRICTION_SCHEMA_READY
-    try:
-        logger.info(f"[DEBUG] check_comment_restriction called for user_id={user_id}")
-        
-        conn, db_type = get_db()
-        c = conn.cursor()
-        
-        logger.info(f"[DEBUG] db_type={db_type}")
-        
-        if not RESTRICTION_SCHEMA_READY:
-            # Ensure table exists with appropriate syntax (once per process)
-            if db_type == 'postgres':
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_restrictions (
-                        id SERIAL PRIMARY KEY,
-                        user_id INTEGER UNIQUE,
-                        reason TEXT,
-                        restricted_by TEXT,
-                        restricted_at TIMESTAMP,
-                        expires_at TIMESTAMP
-                    )
-                """)
-            else:
-                c.execute("""
-                    CREATE TABLE IF NOT EXISTS comment_restrictions (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE,
-                        reason TEXT,
-                        restricted_by TEXT,
-                        restricted_at TIMESTAMP,
-                        expires_at TIMESTAMP
-                    )
-                """)
-            conn.commit()
-            RESTRICTION_SCHEMA_READY = True
-        
-        # Check for active restriction
-        now = datetime.now().isoformat()
-        logger.info(f"[DEBUG] Checking restriction: user_id={user_id}, now={now}")
-        
-        if db_type == 'postgres':
-            c.execute("SELECT reason, expires_at FROM comment_restrictions WHERE user_id = %s AND expires_at > %s",
-                     (user_id, now))
-        else:
-            c.execute("SELECT reason, expires_at FROM comment_restrictions WHERE user_id = ? AND expires_at > ?",
-                     (user_id, now))
-        row = c.fetchone()
-        conn.close()
-        
-        logger.info(f"[DEBUG] Restriction query result: {row}")
-        
-        if row:
-            logger.info(f"[DEBUG] User {user_id} is RESTRICTED: reason={row[0]}, expires={row[1]}")
-            return (True, row[0], row[1])
-        
-        logger.info(f"[DEBUG] User {user_id} is NOT restricted")
-        return (False, None, None)
+def check_comment_restriction(user_id):
+    """Check if user is restricted from commenting. Returns (is_restricted, reason, expires_at)"""
+    try:
+        return _moderation_cache.get(user_id).restriction(utc_now())
     except Exception as e:
         logger.error(f"Check restriction error: {e}")
-        import traceback
-        traceback.print_exc()
         return (False, None, None)
 
 @app.route('/api/comments', methods=['POST'])
@@ -4090,51 +6218,15 @@ def post_comment():
         return jsonify({"error": "Empty comment"}), 400
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     logger.info(f"[DEBUG] Using db_type={db_type}")
     
     try:
-        # Ensure comments table exists
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comments (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER,
-                    verse_id INTEGER,
-                    text TEXT,
-                    timestamp TIMESTAMP,
-                    google_name TEXT,
-                    google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS comments (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    verse_id INTEGER,
-                    text TEXT,
-                    timestamp TIMESTAMP,
-                    google_name TEXT,
-                    google_picture TEXT,
-                    is_deleted INTEGER DEFAULT 0
-                )
-            """)
-        conn.commit()
-        
-        if db_type == 'postgres':
-            c.execute("INSERT INTO comments (user_id, verse_id, text, timestamp, google_name, google_picture) VALUES (%s, %s, %s, %s, %s, %s) RETURNING id",
-                      (session['user_id'], verse_id, text, datetime.now().isoformat(), 
-                       session.get('user_name'), session.get('user_picture')))
-            result = c.fetchone()
-            comment_id = result['id'] if result else None
-        else:
-            c.execute("INSERT INTO comments (user_id, verse_id, text, timestamp, google_name, google_picture) VALUES (?, ?, ?, ?, ?, ?)",
-                      (session['user_id'], verse_id, text, datetime.now().isoformat(), 
-                       session.get('user_name'), session.get('user_picture')))
-            comment_id = c.lastrowid
+        comment_id = db_insert(conn, db_type, """
+            INSERT INTO comments (user_id, verse_id, text, timestamp, google_name, google_picture)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (session['user_id'], verse_id, text, utc_now().isoformat(),
+              session.get('user_name'), session.get('user_picture')))
         
         conn.commit()
         if comment_id:
@@ -4155,80 +6247,51 @@ def post_comment():
     finally:
         conn.close()
 
+COMMUNITY_PAGE_SIZE = 100
+
 @app.route('/api/community')
 def get_community_messages():
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    """Latest COMMUNITY_PAGE_SIZE messages, newest first; ?before_id=<message id> pages back.
+
+    Replies and reaction counts for the whole page are loaded with one query each.
+    """
+    before_id = request.args.get('before_id', type=int)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        ensure_comment_social_tables(c, db_type)
-        conn.commit()
-
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT
-                    cm.id, cm.user_id, cm.text, cm.timestamp, cm.google_name, cm.google_picture,
-                    u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
-                FROM community_messages cm
-                LEFT JOIN users u ON cm.user_id = u.id
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """)
-        else:
-            c.execute("""
-                SELECT
-                    cm.id, cm.user_id, cm.text, cm.timestamp, cm.google_name, cm.google_picture,
-                    u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
-                FROM community_messages cm
-                LEFT JOIN users u ON cm.user_id = u.id
-                ORDER BY timestamp DESC
-                LIMIT 100
-            """)
-        
-        rows = c.fetchall()
+        where = ""
+        params = []
+        if before_id is not None:
+            where = "WHERE (cm.timestamp, cm.id) < (SELECT b.timestamp, b.id FROM community_messages b WHERE b.id = ?)"
+            params.append(before_id)
+        params.append(COMMUNITY_PAGE_SIZE)
+        rows = db_query(conn, db_type, f"""
+            SELECT
+                cm.id, cm.user_id, cm.text, cm.timestamp, cm.google_name, cm.google_picture,
+                u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
+            FROM community_messages cm
+            LEFT JOIN users u ON cm.user_id = u.id
+            {where}
+            ORDER BY cm.timestamp DESC, cm.id DESC
+            LIMIT ?
+        """, params)
         
-        messages = []
-        for row in rows:
-            try:
-                msg_id = row['id']
-                user_id = row['user_id']
-                text = row['text']
-                timestamp = row['timestamp']
-                google_name = row['google_name']
-                google_picture = row['google_picture']
-                db_name = row['name']
-                db_picture = row['picture']
-                db_role = row['role']
-                db_decor = row_value(row, 'avatar_decoration') or ""
-            except (TypeError, KeyError):
-                msg_id = row[0]
-                user_id = row[1]
-                text = row[2]
-                timestamp = row[3]
-                google_name = row[4]
-                google_picture = row[5]
-                db_name = row[6] if len(row) > 6 else None
-                db_picture = row[7] if len(row) > 7 else None
-                db_role = row[8] if len(row) > 8 else None
-                db_decor = row[9] if len(row) > 9 else None
-            
-            user_name = db_name or google_name or "Anonymous"
-            user_picture = db_picture or google_picture or ""
-            
-            replies = get_replies_for_parent(c, db_type, "community", msg_id)
-            messages.append({
-                "id": msg_id,
-                "text": text or "",
-                "timestamp": timestamp,
-                "user_name": user_name,
-                "user_picture": user_picture,
-                "avatar_decoration": db_decor or "",
-                "user_id": user_id,
-                "user_role": db_role or "user",
-                "reactions": get_reaction_counts(c, db_type, "community", msg_id),
-                "replies": replies,
-                "reply_count": len(replies)
-            })
+        ids = [row.id for row in rows]
+        replies = get_replies_for_parents(conn, db_type, "community", ids)
+        reactions = get_reaction_counts_for_items(conn, db_type, "community", ids)
+        messages = [PostRecord(
+            id=row.id,
+            text=row.text or "",
+            timestamp=row.timestamp,
+            user_name=row.name or row.google_name or "Anonymous",
+            user_picture=row.picture or row.google_picture or "",
+            avatar_decoration=row.avatar_decoration or "",
+            user_id=row.user_id,
+            user_role=row.role or "user",
+            reactions=reactions[row.id],
+            replies=replies[row.id],
+            reply_count=len(replies[row.id])
+        ) for row in rows]
         
         return jsonify(messages)
     except Exception as e:
@@ -4264,20 +6327,13 @@ def post_community_message():
         return jsonify({"error": "Empty message"}), 400
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     try:
-        if db_type == 'postgres':
-            c.execute("INSERT INTO community_messages (user_id, text, timestamp, google_name, google_picture) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                      (session['user_id'], text, datetime.now().isoformat(), 
-                       session.get('user_name'), session.get('user_picture')))
-            result = c.fetchone()
-            message_id = result['id'] if result else None
-        else:
-            c.execute("INSERT INTO community_messages (user_id, text, timestamp, google_name, google_picture) VALUES (?, ?, ?, ?, ?)",
-                      (session['user_id'], text, datetime.now().isoformat(), 
-                       session.get('user_name'), session.get('user_picture')))
-            message_id = c.lastrowid
+        message_id = db_insert(conn, db_type, """
+            INSERT INTO community_messages (user_id, text, timestamp, google_name, google_picture)
+            VALUES (?, ?, ?, ?, ?)
+        """, (session['user_id'], text, utc_now().isoformat(),
+              session.get('user_name'), session.get('user_picture')))
         
         conn.commit()
         if message_id:
@@ -4302,55 +6358,29 @@ def search_users():
     q = (request.args.get('q') or '').strip()
     if len(q) < 2:
         return jsonify([])
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     try:
         token = f"%{q}%"
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration
-                FROM users
-                WHERE id <> %s AND (
-                    COALESCE(name,'') ILIKE %s
-                    OR COALESCE(email,'') ILIKE %s
-                    OR CAST(id AS TEXT) ILIKE %s
-                )
-                ORDER BY id DESC
-                LIMIT 10
-            """, (session['user_id'], token, token, token))
-        else:
-            c.execute("""
-                SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration
-                FROM users
-                WHERE id <> ? AND (
-                    LOWER(COALESCE(name,'')) LIKE LOWER(?)
-                    OR LOWER(COALESCE(email,'')) LIKE LOWER(?)
-                    OR CAST(id AS TEXT) LIKE ?
-                )
-                ORDER BY id DESC
-                LIMIT 10
-            """, (session['user_id'], token, token, token))
-        rows = c.fetchall()
-        results = []
-        for row in rows:
-            try:
-                results.append({
-                    "id": row['id'],
-                    "name": row['name'] or "User",
-                    "email": row_value(row, 'email') or "",
-                    "picture": row['picture'] or "",
-                    "role": normalize_role(row['role'] or 'user'),
-                    "avatar_decoration": row_value(row, 'avatar_decoration') or ""
-                })
-            except Exception:
-                results.append({
-                    "id": row[0],
-                    "name": row[1] or "User",
-                    "email": row[2] or "",
-                    "picture": row[3] or "",
-                    "role": normalize_role(row[4] if len(row) > 4 else 'user'),
-                    "avatar_decoration": row[5] if len(row) > 5 else ""
-                })
+        like = sql_like(db_type)
+        rows = db_query(conn, db_type, f"""
+            SELECT id, name, email, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration
+            FROM users
+            WHERE id <> ? AND (
+                COALESCE(name,'') {like} ?
+                OR COALESCE(email,'') {like} ?
+                OR CAST(id AS TEXT) LIKE ?
+            )
+            ORDER BY id DESC
+            LIMIT 10
+        """, (session['user_id'], token, token, token))
+        results = [{
+            "id": row.id,
+            "name": row.name or "User",
+            "email": row.email or "",
+            "picture": row.picture or "",
+            "role": normalize_role(row.role or 'user'),
+            "avatar_decoration": row.avatar_decoration or ""
+        } for row in rows]
         return jsonify(results)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -4361,159 +6391,101 @@ def search_users():
 def recent_users():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     try:
         limit = max(1, min(12, int(request.args.get('limit', 8))))
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute(f"""
-                SELECT u.id, u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
-                FROM users u
-                WHERE u.id <> %s AND u.id IN (
-                    SELECT user_id FROM comments ORDER BY timestamp DESC LIMIT {limit * 5}
-                    UNION
-                    SELECT user_id FROM community_messages ORDER BY timestamp DESC LIMIT {limit * 5}
-                )
-                ORDER BY u.id DESC
-                LIMIT {limit}
-            """, (uid,))
-        else:
-            c.execute(f"""
-                SELECT u.id, u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
-                FROM users u
-                WHERE u.id <> ? AND u.id IN (
-                    SELECT user_id FROM comments ORDER BY timestamp DESC LIMIT {limit * 5}
-                    UNION
-                    SELECT user_id FROM community_messages ORDER BY timestamp DESC LIMIT {limit * 5}
-                )
-                ORDER BY u.id DESC
-                LIMIT {limit}
-            """, (uid,))
-        rows = c.fetchall()
-        results = []
-        for row in rows:
-            try:
-                results.append({
-                    "id": row['id'],
-                    "name": row['name'] or "User",
-                    "picture": row['picture'] or "",
-                    "role": normalize_role(row['role'] or 'user'),
-                    "avatar_decoration": row_value(row, 'avatar_decoration') or ""
-                })
-            except Exception:
-                results.append({
-                    "id": row[0],
-                    "name": row[1] or "User",
-                    "picture": row[2] or "",
-                    "role": normalize_role(row[3] if len(row) > 3 else 'user'),
-                    "avatar_decoration": row[4] if len(row) > 4 else ""
-                })
+        rows = db_query(conn, db_type, f"""
+            SELECT u.id, u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
+            FROM users u
+            WHERE u.id <> ? AND u.id IN (
+                SELECT user_id FROM comments ORDER BY timestamp DESC LIMIT {limit * 5}
+                UNION
+                SELECT user_id FROM community_messages ORDER BY timestamp DESC LIMIT {limit * 5}
+            )
+            ORDER BY u.id DESC
+            LIMIT {limit}
+        """, (uid,))
+        results = [{
+            "id": row.id,
+            "name": row.name or "User",
+            "picture": row.picture or "",
+            "role": normalize_role(row.role or 'user'),
+            "avatar_decoration": row.avatar_decoration or ""
+        } for row in rows]
         return jsonify(results)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         conn.close()
 
+DmThreadRecord = record_type('DmThreadRecord', (
+    'user_id', 'name', 'picture', 'role', 'avatar_decoration', 'last_message', 'last_message_id', 'last_at',
+    'last_sender', 'unread'))
+DM_THREADS_PAGE_MAX = 100
+
 @app.route('/api/dm/threads')
 def dm_threads():
+    """Inbox: one row per conversation partner, most recent first, from a single query.
+
+    Optional paging: ?limit=N (max DM_THREADS_PAGE_MAX) and ?before=<last_message_id>
+    of the last thread on the previous page.
+    """
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
     is_banned, _, _ = check_ban_status(session['user_id'])
     if is_banned:
         return jsonify({"error": "banned"}), 403
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    conn, db_type = get_db(readonly=True)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT recipient_id AS other_id FROM direct_messages WHERE sender_id = %s
-                UNION
-                SELECT sender_id AS other_id FROM direct_messages WHERE recipient_id = %s
-            """, (uid, uid))
-        else:
-            c.execute("""
-                SELECT recipient_id AS other_id FROM direct_messages WHERE sender_id = ?
-                UNION
-                SELECT sender_id AS other_id FROM direct_messages WHERE recipient_id = ?
-            """, (uid, uid))
-        ids = [row['other_id'] if hasattr(row, 'keys') else row[0] for row in c.fetchall()]
-        threads = []
-        for other_id in ids:
-            if other_id is None:
-                continue
-            # user info
-            if db_type == 'postgres':
-                c.execute("SELECT name, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration FROM users WHERE id = %s", (other_id,))
-            else:
-                c.execute("SELECT name, COALESCE(custom_picture, picture) AS picture, role, avatar_decoration FROM users WHERE id = ?", (other_id,))
-            urow = c.fetchone()
-            if urow:
-                try:
-                    name = urow['name'] or 'User'
-                    picture = urow['picture'] or ''
-                    role = normalize_role(urow['role'] or 'user')
-                    decor = row_value(urow, 'avatar_decoration') or ''
-                except Exception:
-                    name = urow[0] or 'User'
-                    picture = urow[1] or ''
-                    role = normalize_role(urow[2] if len(urow) > 2 else 'user')
-                    decor = urow[3] if len(urow) > 3 else ''
-            else:
-                name, picture, role, decor = 'User', '', 'user', ''
-            # last message
-            if db_type == 'postgres':
-                c.execute("""
-                    SELECT message, created_at, sender_id
-                    FROM direct_messages
-                    WHERE (sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s)
-                    ORDER BY created_at DESC, id DESC
-                    LIMIT 1
-                """, (uid, other_id, other_id, uid))
-            else:
-                c.execute("""
-                    SELECT message, created_at, sender_id
-                    FROM direct_messages
-                    WHERE (sender_id = ? AND recipient_id = ?) OR (sender_id = ? AND recipient_id = ?)
-                    ORDER BY created_at DESC, id DESC
-                    LIMIT 1
-                """, (uid, other_id, other_id, uid))
-            last = c.fetchone()
-            if last:
-                try:
-                    last_msg = last['message']
-                    last_at = last['created_at']
-                    last_sender = last['sender_id']
-                except Exception:
-                    last_msg = last[0]
-                    last_at = last[1]
-                    last_sender = last[2]
-            else:
-                last_msg = ''
-                last_at = None
-                last_sender = None
-            # unread count
-            if db_type == 'postgres':
-                c.execute("SELECT COUNT(*) FROM direct_messages WHERE sender_id = %s AND recipient_id = %s AND COALESCE(is_read,0) = 0", (other_id, uid))
-            else:
-                c.execute("SELECT COUNT(*) FROM direct_messages WHERE sender_id = ? AND recipient_id = ? AND COALESCE(is_read,0) = 0", (other_id, uid))
-            unread = c.fetchone()
-            unread_count = unread[0] if unread else 0
-            threads.append({
-                "user_id": other_id,
-                "name": name,
-                "picture": picture,
-                "role": role,
-                "avatar_decoration": decor,
-                "last_message": last_msg,
-                "last_at": last_at,
-                "last_sender": last_sender,
-                "unread": unread_count
-            })
-        threads.sort(key=lambda t: t.get('last_at') or '', reverse=True)
+        low, high = DM_CONVERSATION_KEY[db_type]
+        params = [uid, uid, uid, uid]
+        page_where = ""
+        if before is not None:
+            page_where = "AND (t.created_at, t.id) < (SELECT b.created_at, b.id FROM direct_messages b WHERE b.id = ?)"
+            params.append(before)
+        page = ""
+        if limit is not None:
+            page = "LIMIT ?"
+            params.append(min(DM_THREADS_PAGE_MAX, max(1, limit)))
+        rows = db_query(conn, db_type, f"""
+            WITH mine AS (
+                SELECT id, sender_id, message, created_at,
+                       CASE WHEN sender_id = ? THEN recipient_id ELSE sender_id END AS other_id,
+                       CASE WHEN recipient_id = ? AND COALESCE(is_read, 0) = 0 THEN 1 ELSE 0 END AS is_unread,
+                       {low} AS key_low, {high} AS key_high
+                FROM direct_messages
+                WHERE sender_id = ? OR recipient_id = ?
+            ),
+            threads AS (
+                SELECT mine.*,
+                       ROW_NUMBER() OVER (PARTITION BY key_low, key_high ORDER BY created_at DESC, id DESC) AS rn,
+                       SUM(is_unread) OVER (PARTITION BY key_low, key_high) AS unread
+                FROM mine
+            )
+            SELECT t.other_id, t.id, t.message, t.created_at, t.sender_id, t.unread,
+                   u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
+            FROM threads t
+            LEFT JOIN users u ON u.id = t.other_id
+            WHERE t.rn = 1 AND t.other_id IS NOT NULL {page_where}
+            ORDER BY CASE WHEN t.created_at IS NULL THEN 1 ELSE 0 END, t.created_at DESC, t.id DESC
+            {page}
+        """, params)
+        threads = [DmThreadRecord(
+            user_id=row.other_id,
+            name=row.name or 'User',
+            picture=row.picture or '',
+            role=normalize_role(row.role or 'user'),
+            avatar_decoration=row.avatar_decoration or '',
+            last_message=row.message,
+            last_message_id=row.id,
+            last_at=row.created_at,
+            last_sender=row.sender_id,
+            unread=int(row.unread or 0)
+        ) for row in rows]
         return jsonify(threads)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -4530,53 +6502,19 @@ def dm_messages(other_id):
     if other_id == session['user_id']:
         return jsonify({"error": "Invalid target"}), 400
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, sender_id, recipient_id, message, created_at, is_read
-                FROM direct_messages
-                WHERE (sender_id = %s AND recipient_id = %s) OR (sender_id = %s AND recipient_id = %s)
-                ORDER BY created_at ASC, id ASC
-                LIMIT 200
-            """, (uid, other_id, other_id, uid))
-        else:
-            c.execute("""
-                SELECT id, sender_id, recipient_id, message, created_at, is_read
-                FROM direct_messages
-                WHERE (sender_id = ? AND recipient_id = ?) OR (sender_id = ? AND recipient_id = ?)
-                ORDER BY created_at ASC, id ASC
-                LIMIT 200
-            """, (uid, other_id, other_id, uid))
-        rows = c.fetchall()
-        messages = []
-        for row in rows:
-            try:
-                messages.append({
-                    "id": row['id'],
-                    "sender_id": row['sender_id'],
-                    "recipient_id": row['recipient_id'],
-                    "message": row['message'],
-                    "created_at": row['created_at'],
-                    "is_read": row['is_read']
-                })
-            except Exception:
-                messages.append({
-                    "id": row[0],
-                    "sender_id": row[1],
-                    "recipient_id": row[2],
-                    "message": row[3],
-                    "created_at": row[4],
-                    "is_read": row[5] if len(row) > 5 else 0
-                })
+        low, high = DM_CONVERSATION_KEY[db_type]
+        rows = db_query(conn, db_type, f"""
+            SELECT id, sender_id, recipient_id, message, created_at, is_read
+            FROM direct_messages
+            WHERE {low} = ? AND {high} = ?
+            ORDER BY created_at ASC, id ASC
+            LIMIT 200
+        """, (min(uid, other_id), max(uid, other_id)))
+        messages = [row.as_dict() for row in rows]
         # mark read
-        if db_type == 'postgres':
-            c.execute("UPDATE direct_messages SET is_read = 1 WHERE sender_id = %s AND recipient_id = %s", (other_id, uid))
-        else:
-            c.execute("UPDATE direct_messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ?", (other_id, uid))
+        db_execute(conn, db_type, "UPDATE direct_messages SET is_read = 1 WHERE sender_id = ? AND recipient_id = ?", (other_id, uid))
         conn.commit()
         return jsonify(messages)
     except Exception as e:
@@ -4608,21 +6546,12 @@ def dm_send():
     if not message:
         return jsonify({"error": "Empty message"}), 400
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
-        now = datetime.now().isoformat()
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO direct_messages (sender_id, recipient_id, message, created_at, is_read)
-                VALUES (%s, %s, %s, %s, 0)
-            """, (session['user_id'], recipient_id, message, now))
-        else:
-            c.execute("""
-                INSERT INTO direct_messages (sender_id, recipient_id, message, created_at, is_read)
-                VALUES (?, ?, ?, ?, 0)
-            """, (session['user_id'], recipient_id, message, now))
+        now = utc_now().isoformat()
+        db_execute(conn, db_type, """
+            INSERT INTO direct_messages (sender_id, recipient_id, message, created_at, is_read)
+            VALUES (?, ?, ?, ?, 0)
+        """, (session['user_id'], recipient_id, message, now))
         conn.commit()
         return jsonify({"success": True})
     except Exception as e:
@@ -4640,25 +6569,15 @@ def dm_delete_thread(other_id):
     if other_id == session['user_id']:
         return jsonify({"error": "Invalid target"}), 400
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute("""
-                DELETE FROM direct_messages
-                WHERE (sender_id = %s AND recipient_id = %s)
-                   OR (sender_id = %s AND recipient_id = %s)
-            """, (uid, other_id, other_id, uid))
-            c.execute("DELETE FROM dm_typing WHERE (user_id = %s AND other_id = %s) OR (user_id = %s AND other_id = %s)", (uid, other_id, other_id, uid))
-        else:
-            c.execute("""
-                DELETE FROM direct_messages
-                WHERE (sender_id = ? AND recipient_id = ?)
-                   OR (sender_id = ? AND recipient_id = ?)
-            """, (uid, other_id, other_id, uid))
-            c.execute("DELETE FROM dm_typing WHERE (user_id = ? AND other_id = ?) OR (user_id = ? AND other_id = ?)", (uid, other_id, other_id, uid))
+        db_execute(conn, db_type, """
+            DELETE FROM direct_messages
+            WHERE (sender_id = ? AND recipient_id = ?)
+               OR (sender_id = ? AND recipient_id = ?)
+        """, (uid, other_id, other_id, uid))
+        db_execute(conn, db_type, "DELETE FROM dm_typing WHERE (user_id = ? AND other_id = ?) OR (user_id = ? AND other_id = ?)",
+                   (uid, other_id, other_id, uid))
         conn.commit()
         return jsonify({"success": True})
     except Exception as e:
@@ -4675,23 +6594,14 @@ def dm_typing():
     if not other_id or other_id == session['user_id']:
         return jsonify({"error": "Invalid target"}), 400
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
-        now = datetime.now().isoformat()
+        now = utc_now().isoformat()
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO dm_typing (user_id, other_id, updated_at)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, other_id) DO UPDATE SET updated_at = EXCLUDED.updated_at
-            """, (uid, other_id, now))
-        else:
-            c.execute("""
-                INSERT OR REPLACE INTO dm_typing (user_id, other_id, updated_at)
-                VALUES (?, ?, ?)
-            """, (uid, other_id, now))
+        db_execute(conn, db_type, """
+            INSERT INTO dm_typing (user_id, other_id, updated_at)
+            VALUES (?, ?, ?)
+            ON CONFLICT (user_id, other_id) DO UPDATE SET updated_at = EXCLUDED.updated_at
+        """, (uid, other_id, now))
         conn.commit()
         return jsonify({"success": True})
     except Exception as e:
@@ -4705,28 +6615,18 @@ def dm_typing_status(other_id):
         return jsonify({"error": "Not logged in"}), 401
     if other_id == session['user_id']:
         return jsonify({"typing": False})
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     try:
-        ensure_dm_tables(c, db_type)
-        conn.commit()
         uid = session['user_id']
-        if db_type == 'postgres':
-            c.execute("SELECT updated_at FROM dm_typing WHERE user_id = %s AND other_id = %s", (other_id, uid))
-        else:
-            c.execute("SELECT updated_at FROM dm_typing WHERE user_id = ? AND other_id = ?", (other_id, uid))
-        row = c.fetchone()
+        row = db_query_one(conn, db_type, "SELECT updated_at FROM dm_typing WHERE user_id = ? AND other_id = ?", (other_id, uid))
         if not row:
             return jsonify({"typing": False})
-        try:
-            ts = row['updated_at']
-        except Exception:
-            ts = row[0]
+        ts = row.updated_at
         try:
             ts_dt = datetime.fromisoformat(str(ts).replace('Z', ''))
         except Exception:
             return jsonify({"typing": False})
-        delta = (datetime.now() - ts_dt).total_seconds()
+        delta = (utc_now() - ts_dt).total_seconds()
         return jsonify({"typing": delta <= 6})
     except Exception:
         return jsonify({"typing": False})
@@ -4751,51 +6651,30 @@ def add_comment_reaction():
         return jsonify({"error": "item_id required"}), 400
 
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_comment_social_tables(c, db_type)
-        now = datetime.now().isoformat()
-
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id FROM comment_reactions
-                WHERE item_type = %s AND item_id = %s AND user_id = %s AND reaction = %s
-            """, (item_type, item_id, session['user_id'], reaction))
-        else:
-            c.execute("""
-                SELECT id FROM comment_reactions
-                WHERE item_type = ? AND item_id = ? AND user_id = ? AND reaction = ?
-            """, (item_type, item_id, session['user_id'], reaction))
-        exists = c.fetchone()
+        now = utc_now().isoformat()
+        key = (item_type, item_id, session['user_id'], reaction)
+        exists = db_query_one(conn, db_type, """
+            SELECT id FROM comment_reactions
+            WHERE item_type = ? AND item_id = ? AND user_id = ? AND reaction = ?
+        """, key)
 
         if exists:
-            if db_type == 'postgres':
-                c.execute("""
-                    DELETE FROM comment_reactions
-                    WHERE item_type = %s AND item_id = %s AND user_id = %s AND reaction = %s
-                """, (item_type, item_id, session['user_id'], reaction))
-            else:
-                c.execute("""
-                    DELETE FROM comment_reactions
-                    WHERE item_type = ? AND item_id = ? AND user_id = ? AND reaction = ?
-                """, (item_type, item_id, session['user_id'], reaction))
+            db_execute(conn, db_type, """
+                DELETE FROM comment_reactions
+                WHERE item_type = ? AND item_id = ? AND user_id = ? AND reaction = ?
+            """, key)
             active = False
         else:
-            if db_type == 'postgres':
-                c.execute("""
-                    INSERT INTO comment_reactions (item_type, item_id, user_id, reaction, timestamp)
-                    VALUES (%s, %s, %s, %s, %s)
-                    ON CONFLICT (item_type, item_id, user_id, reaction) DO NOTHING
-                """, (item_type, item_id, session['user_id'], reaction, now))
-            else:
-                c.execute("""
-                    INSERT OR IGNORE INTO comment_reactions (item_type, item_id, user_id, reaction, timestamp)
-                    VALUES (?, ?, ?, ?, ?)
-                """, (item_type, item_id, session['user_id'], reaction, now))
+            db_execute(conn, db_type, """
+                INSERT INTO comment_reactions (item_type, item_id, user_id, reaction, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (item_type, item_id, user_id, reaction) DO NOTHING
+            """, key + (now,))
             active = True
 
         conn.commit()
-        counts = get_reaction_counts(c, db_type, item_type, int(item_id))
+        counts = get_reaction_counts(conn, db_type, item_type, int(item_id))
         return jsonify({"success": True, "active": active, "reactions": counts})
     except Exception as e:
         logger.error(f"Add reaction error: {e}")
@@ -4834,22 +6713,14 @@ def post_comment_reply():
         }), 403
 
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     try:
-        ensure_comment_social_tables(c, db_type)
-        now = datetime.now().isoformat()
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO comment_replies (parent_type, parent_id, user_id, text, timestamp, google_name, google_picture)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (parent_type, parent_id, session['user_id'], text, now, session.get('user_name'), session.get('user_picture')))
-        else:
-            c.execute("""
-                INSERT INTO comment_replies (parent_type, parent_id, user_id, text, timestamp, google_name, google_picture)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (parent_type, parent_id, session['user_id'], text, now, session.get('user_name'), session.get('user_picture')))
+        now = utc_now().isoformat()
+        db_execute(conn, db_type, """
+            INSERT INTO comment_replies (parent_type, parent_id, user_id, text, timestamp, google_name, google_picture)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (parent_type, parent_id, session['user_id'], text, now, session.get('user_name'), session.get('user_picture')))
         conn.commit()
-        replies = get_replies_for_parent(c, db_type, parent_type, int(parent_id))
+        replies = get_replies_for_parent(conn, db_type, parent_type, int(parent_id))
         return jsonify({"success": True, "replies": replies, "reply_count": len(replies)})
     except Exception as e:
         logger.error(f"Post reply error: {e}")
@@ -4862,16 +6733,11 @@ def check_like(verse_id):
     if 'user_id' not in session:
         return jsonify({"liked": False})
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM likes WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
-        else:
-            c.execute("SELECT id FROM likes WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
-        
-        liked = c.fetchone() is not None
+        liked = db_query_one(conn, db_type, "SELECT id FROM likes WHERE user_id = ? AND verse_id = ?",
+                             (session['user_id'], verse_id)) is not None
         return jsonify({"liked": liked})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -4883,16 +6749,11 @@ def check_save(verse_id):
     if 'user_id' not in session:
         return jsonify({"saved": False})
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        if db_type == 'postgres':
-            c.execute("SELECT id FROM saves WHERE user_id = %s AND verse_id = %s", (session['user_id'], verse_id))
-        else:
-            c.execute("SELECT id FROM saves WHERE user_id = ? AND verse_id = ?", (session['user_id'], verse_id))
-        
-        saved = c.fetchone() is not None
+        saved = db_query_one(conn, db_type, "SELECT id FROM saves WHERE user_id = ? AND verse_id = ?",
+                             (session['user_id'], verse_id)) is not None
         return jsonify({"saved": saved})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -4911,27 +6772,12 @@ def delete_comment_api(comment_id):
         return jsonify({"error": "Admin required"}), 403
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     try:
         # Soft delete by setting is_deleted = 1
-        if db_type == 'postgres':
-            c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            c.execute("UPDATE comments SET is_deleted = 1 WHERE id = %s", (comment_id,))
-            c.execute(
-                "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = %s AND parent_id = %s",
-                ('comment', comment_id)
-            )
-        else:
-            try:
-                c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-            except Exception:
-                c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            c.execute("UPDATE comments SET is_deleted = 1 WHERE id = ?", (comment_id,))
-            c.execute(
-                "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
-                ('comment', comment_id)
-            )
+        db_execute(conn, db_type, "UPDATE comments SET is_deleted = 1 WHERE id = ?", (comment_id,))
+        db_execute(conn, db_type, "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
+                   ('comment', comment_id))
         conn.commit()
         
         # Log the action
@@ -4955,27 +6801,12 @@ def delete_community_api(message_id):
         return jsonify({"error": "Admin required"}), 403
     
     conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
     
     try:
         # Hard delete community messages (no is_deleted column)
-        if db_type == 'postgres':
-            c.execute("ALTER TABLE comment_replies ADD COLUMN IF NOT EXISTS is_deleted INTEGER DEFAULT 0")
-            c.execute("DELETE FROM community_messages WHERE id = %s", (message_id,))
-            c.execute(
-                "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = %s AND parent_id = %s",
-                ('community', message_id)
-            )
-        else:
-            try:
-                c.execute("SELECT is_deleted FROM comment_replies LIMIT 1")
-            except Exception:
-                c.execute("ALTER TABLE comment_replies ADD COLUMN is_deleted INTEGER DEFAULT 0")
-            c.execute("DELETE FROM community_messages WHERE id = ?", (message_id,))
-            c.execute(
-                "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
-                ('community', message_id)
-            )
+        db_execute(conn, db_type, "DELETE FROM community_messages WHERE id = ?", (message_id,))
+        db_execute(conn, db_type, "UPDATE comment_replies SET is_deleted = 1 WHERE parent_type = ? AND parent_id = ?",
+                   ('community', message_id))
         conn.commit()
         
         # Log the action
@@ -4994,42 +6825,17 @@ def get_liked_verses():
     if 'user_id' not in session:
         return jsonify([]), 401
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT v.id, v.reference, v.book 
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = %s
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-        else:
-            c.execute("""
-                SELECT v.id, v.reference, v.book 
-                FROM verses v 
-                JOIN likes l ON v.id = l.verse_id 
-                WHERE l.user_id = ?
-                ORDER BY l.timestamp DESC
-            """, (session['user_id'],))
-        
-        rows = c.fetchall()
-        verses = []
-        for row in rows:
-            try:
-                verses.append({
-                    "id": row['id'],
-                    "ref": row['reference'],
-                    "book": row['book']
-                })
-            except (TypeError, KeyError):
-                verses.append({
-                    "id": row[0],
-                    "ref": row[1],
-                    "book": row[2]
-                })
+        rows = db_query(conn, db_type, """
+            SELECT v.id, v.reference, v.book
+            FROM verses v
+            JOIN likes l ON v.id = l.verse_id
+            WHERE l.user_id = ?
+            ORDER BY l.timestamp DESC
+        """, (session['user_id'],))
+        verses = [{"id": row.id, "ref": row.reference, "book": row.book} for row in rows]
         return jsonify(verses)
     except Exception as e:
         logger.error(f"Liked verses error: {e}")
@@ -5044,42 +6850,17 @@ def get_saved_verses():
     if 'user_id' not in session:
         return jsonify([]), 401
     
-    conn, db_type = get_db()
-    c = get_cursor(conn, db_type)
+    conn, db_type = get_db(readonly=True)
     
     try:
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT v.id, v.reference, v.book 
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = %s
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-        else:
-            c.execute("""
-                SELECT v.id, v.reference, v.book 
-                FROM verses v 
-                JOIN saves s ON v.id = s.verse_id 
-                WHERE s.user_id = ?
-                ORDER BY s.timestamp DESC
-            """, (session['user_id'],))
-        
-        rows = c.fetchall()
-        verses = []
-        for row in rows:
-            try:
-                verses.append({
-                    "id": row['id'],
-                    "ref": row['reference'],
-                    "book": row['book']
-                })
-            except (TypeError, KeyError):
-                verses.append({
-                    "id": row[0],
-                    "ref": row[1],
-                    "book": row[2]
-                })
+        rows = db_query(conn, db_type, """
+            SELECT v.id, v.reference, v.book
+            FROM verses v
+            JOIN saves s ON v.id = s.verse_id
+            WHERE s.user_id = ?
+            ORDER BY s.timestamp DESC
+        """, (session['user_id'],))
+        verses = [{"id": row.id, "ref": row.reference, "book": row.book} for row in rows]
         return jsonify(verses)
     except Exception as e:
         logger.error(f"Saved verses error: {e}")
@@ -5087,100 +6868,233 @@ def get_saved_verses():
     finally:
         conn.close()
 
+PRESENCE_FLUSH_INTERVAL = max(1.0, float(os.environ.get('PRESENCE_FLUSH_INTERVAL', '10')))
+PRESENCE_FLUSH_BATCH = max(1, int(os.environ.get('PRESENCE_FLUSH_BATCH', '200')))
+PRESENCE_PENDING_MAX = max(100, int(os.environ.get('PRESENCE_PENDING_MAX', '20000')))
+
+class PresenceTracker:
+    """Write-behind heartbeats for user_presence.
+
+    touch() only records each user's latest (last_seen, path) in memory. A
+    background thread upserts the pending set in multi-row statements every
+    PRESENCE_FLUSH_INTERVAL seconds (sooner once PRESENCE_PENDING_MAX users
+    are waiting) and once more at interpreter exit. Callables in after_flush
+    run on that thread after each pass (see OnlineCounter).
+    """
+
+    def __init__(self, interval=PRESENCE_FLUSH_INTERVAL, batch_size=PRESENCE_FLUSH_BATCH,
+                 pending_max=PRESENCE_PENDING_MAX):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending_max = pending_max
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.after_flush = []
+        self.flushed = 0
+        self.last_flush = None
+        self.last_error = None
+
+    def touch(self, user_id, path):
+        with self.lock:
+            self.pending[user_id] = (utc_now().isoformat(), path)
+            backlog = len(self.pending)
+        if backlog >= self.pending_max:
+            self.wake.set()
+        self.start()
+
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.thread.start()
+
+    def _flush_loop(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+            for hook in self.after_flush:
+                try:
+                    hook()
+                except Exception as e:
+                    logger.warning(f"Presence after-flush hook failed: {e}")
+
+    def flush(self):
+        """Upsert everything pending; returns the number of users written."""
+        # Serialized so a caller that flushes before reading user_presence also waits out an in-flight pass.
+        with self.flush_lock:
+            return self._flush()
+
+    def _flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, {}
+        if not batch:
+            return 0
+        try:
+            with db_connection() as (conn, db_type):
+                for chunk in _chunks(batch.items(), self.batch_size):
+                    params = []
+                    for user_id, (last_seen, path) in chunk:
+                        params.extend((user_id, last_seen, path, last_seen))
+                    # Another worker may have flushed a newer heartbeat for the same user.
+                    db_execute(conn, db_type, f"""
+                        INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
+                        VALUES {', '.join(['(?, ?, ?, ?)'] * len(chunk))}
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            last_seen = excluded.last_seen,
+                            last_path = excluded.last_path,
+                            updated_at = excluded.updated_at
+                        WHERE user_presence.last_seen IS NULL OR user_presence.last_seen < excluded.last_seen
+                    """, params)
+                conn.commit()
+        except Exception as e:
+            with self.lock:
+                for user_id, entry in batch.items():
+                    self.pending.setdefault(user_id, entry)
+            self.last_error = str(e)
+            logger.warning(f"Presence flush failed, {len(batch)} heartbeats kept for retry: {e}")
+            return 0
+        self.flushed += len(batch)
+        self.last_flush = utc_now().isoformat()
+        self.last_error = None
+        return len(batch)
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "flushed": self.flushed,
+            "last_flush": self.last_flush,
+            "last_error": self.last_error,
+            "interval": self.interval
+        }
+
+presence_tracker = PresenceTracker()
+atexit.register(presence_tracker.flush)
+
+PRESENCE_ONLINE_MINUTES = 3
+PRESENCE_BUCKET_SECONDS = max(1, int(os.environ.get('PRESENCE_BUCKET_SECONDS', '10')))
+PRESENCE_WINDOW_MINUTES = max(5, int(os.environ.get('PRESENCE_WINDOW_MINUTES', '15')))
+PRESENCE_COUNTER_REFRESH = max(1.0, float(os.environ.get('PRESENCE_COUNTER_REFRESH', '15')))
+PRESENCE_SERIES_DAYS = max(1, int(os.environ.get('PRESENCE_SERIES_DAYS', '7')))
+
+class OnlineCounter:
+    """Online-user counts from time buckets of user_presence.last_seen.
+
+    Every PRESENCE_COUNTER_REFRESH seconds one grouped query over the
+    last_seen index rebuilds {bucket: users whose latest heartbeat fell in it}
+    for the last PRESENCE_WINDOW_MINUTES. Each user sits in exactly one
+    bucket, so online(n) is a sum over n * 60 / PRESENCE_BUCKET_SECONDS
+    buckets, exact to within one bucket. Every worker flushes to
+    user_presence, so the counts are global. They lag by at most
+    PRESENCE_FLUSH_INTERVAL plus the refresh interval.
+
+    Each refresh also records the current count in presence_concurrency, the
+    per-minute series behind admin insights. Refreshes run on the presence
+    flusher thread, right after its own writes. online() normally only reads
+    the in-memory buckets; when this worker has unflushed heartbeats and the
+    snapshot is older than one bucket, it flushes and refreshes first so a
+    user who just pinged is counted.
+    """
+
+    def __init__(self, tracker, bucket_seconds=PRESENCE_BUCKET_SECONDS, window_minutes=PRESENCE_WINDOW_MINUTES,
+                 refresh_interval=PRESENCE_COUNTER_REFRESH, series_days=PRESENCE_SERIES_DAYS):
+        self.tracker = tracker
+        self.bucket_seconds = bucket_seconds
+        self.window_minutes = window_minutes
+        self.refresh_interval = refresh_interval
+        self.series_days = series_days
+        self.buckets = {}
+        self.refreshed_at = float('-inf')
+        self.pruned_at = float('-inf')
+        self.lock = threading.Lock()
+        tracker.after_flush.append(self.refresh)
+
+    def online(self, minutes=PRESENCE_ONLINE_MINUTES):
+        # A worker that has not seen a heartbeat yet still needs the flusher to refresh counts.
+        self.tracker.start()
+        if self.tracker.pending and time.monotonic() - self.refreshed_at >= self.bucket_seconds:
+            self.tracker.flush()
+            self.refresh(max_age=self.bucket_seconds)
+        elif self.refreshed_at == float('-inf'):
+            self.tracker.wake.set()
+        return self._count(self.buckets, epoch_seconds(utc_now()), minutes)
+
+    def _count(self, buckets, now_epoch, minutes):
+        first = (now_epoch - minutes * 60) // self.bucket_seconds
+        last = now_epoch // self.bucket_seconds
+        return sum(buckets.get(bucket, 0) for bucket in range(first, last + 1))
+
+    def refresh(self, max_age=None):
+        with self.lock:
+            if time.monotonic() - self.refreshed_at < (self.refresh_interval if max_age is None else max_age):
+                return
+            now = utc_now()
+            since = now - timedelta(minutes=self.window_minutes)
+            try:
+                with db_connection() as (conn, db_type):
+                    bucket = f"{sql_epoch(db_type, 'last_seen')} / {int(self.bucket_seconds)}"
+                    rows = db_query(conn, db_type, f"""
+                        SELECT {bucket} AS bucket, COUNT(*) AS users
+                        FROM user_presence
+                        WHERE last_seen >= ?
+                        GROUP BY {bucket}
+                    """, (since.isoformat(),))
+                    buckets = {int(row.bucket): int(row.users) for row in rows if row.bucket is not None}
+                    # Workers sampling the same minute keep the peak.
+                    db_execute(conn, db_type, """
+                        INSERT INTO presence_concurrency (minute, online) VALUES (?, ?)
+                        ON CONFLICT (minute) DO UPDATE SET online = CASE
+                            WHEN excluded.online > presence_concurrency.online THEN excluded.online
+                            ELSE presence_concurrency.online END
+                    """, (now.replace(second=0, microsecond=0).isoformat(),
+                          self._count(buckets, epoch_seconds(now), PRESENCE_ONLINE_MINUTES)))
+                    if time.monotonic() - self.pruned_at >= 3600:
+                        db_execute(conn, db_type, "DELETE FROM presence_concurrency WHERE minute < ?",
+                                   ((now - timedelta(days=self.series_days)).isoformat(),))
+                        self.pruned_at = time.monotonic()
+                    conn.commit()
+                self.buckets = buckets
+            except Exception as e:
+                logger.warning(f"Online counter refresh failed: {e}")
+            self.refreshed_at = time.monotonic()
+
+    def series(self, conn, db_type, minutes=60):
+        """[{"minute": 'YYYY-MM-DDTHH:MM', "count": n}] for the last `minutes` minutes, zero-filled."""
+        now = utc_now().replace(second=0, microsecond=0)
+        start = now - timedelta(minutes=minutes - 1)
+        rows = db_query(conn, db_type, "SELECT minute, online FROM presence_concurrency WHERE minute >= ?",
+                        (start.isoformat(),))
+        samples = {}
+        for row in rows:
+            key = minute_key(row.minute) if isinstance(row.minute, datetime) else str(row.minute)[:16]
+            samples[key] = int(row.online or 0)
+        return [{"minute": key, "count": samples.get(key, 0)}
+                for key in (minute_key(start + timedelta(minutes=step)) for step in range(minutes))]
+
+online_counter = OnlineCounter(presence_tracker)
+
 @app.route('/api/presence/ping', methods=['POST'])
 def presence_ping():
     if 'user_id' not in session:
         return jsonify({"error": "Not logged in"}), 401
-    conn = None
-    try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TEXT,
-                last_path TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        now_iso = datetime.now().isoformat()
-        path = request.json.get('path') if request.is_json else request.path
-        if db_type == 'postgres':
-            c.execute("""
-                INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                VALUES (%s, %s, %s, %s)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    last_seen = EXCLUDED.last_seen,
-                    last_path = EXCLUDED.last_path,
-                    updated_at = EXCLUDED.updated_at
-            """, (session['user_id'], now_iso, path, now_iso))
-        else:
-            c.execute("""
-                INSERT INTO user_presence (user_id, last_seen, last_path, updated_at)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(user_id) DO UPDATE SET
-                    last_seen = excluded.last_seen,
-                    last_path = excluded.last_path,
-                    updated_at = excluded.updated_at
-            """, (session['user_id'], now_iso, path, now_iso))
-        conn.commit()
-        conn.close()
-        return jsonify({"success": True})
-    except Exception as e:
-        logger.error(f"Presence ping error: {e}")
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
-        return jsonify({"error": str(e)}), 500
+    path = request.json.get('path') if request.is_json else request.path
+    presence_tracker.touch(session['user_id'], path)
+    return jsonify({"success": True})
 
 @app.route('/api/presence/online')
 def presence_online():
     if 'user_id' not in session:
         return jsonify({"count": 0}), 401
-    conn = None
-    try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        c.execute("""
-            CREATE TABLE IF NOT EXISTS user_presence (
-                user_id INTEGER PRIMARY KEY,
-                last_seen TEXT,
-                last_path TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        if db_type == 'postgres':
-            c.execute("SELECT user_id, last_seen FROM user_presence")
-            rows = c.fetchall()
-        else:
-            c.execute("SELECT user_id, last_seen FROM user_presence")
-            rows = c.fetchall()
+    return jsonify({"count": online_counter.online(PRESENCE_ONLINE_MINUTES)})
 
-        now = datetime.now()
-        window = now - timedelta(minutes=3)
-        count = 0
-        for row in rows:
-            try:
-                last_seen = row['last_seen'] if isinstance(row, dict) or hasattr(row, 'keys') else row[1]
-                if not last_seen:
-                    continue
-                last_dt = datetime.fromisoformat(str(last_seen))
-                if last_dt >= window:
-                    count += 1
-            except Exception:
-                continue
-        conn.close()
-        return jsonify({"count": count})
-    except Exception as e:
-        logger.error(f"Presence online error: {e}")
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
-        return jsonify({"count": 0}), 500
+NotificationRecord = record_type('NotificationRecord', (
+    'id', 'title', 'message', 'type', 'source', 'is_read', 'created_at'))
 
 @app.route('/api/notifications')
 def get_notifications():
@@ -5188,106 +7102,28 @@ def get_notifications():
         return jsonify([]), 401
     conn = None
     try:
-        conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_notifications (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER,
-                    title TEXT,
-                    message TEXT,
-                    notif_type TEXT DEFAULT 'announcement',
-                    source TEXT DEFAULT 'admin',
-                    is_read INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    sent_at TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT,
-                    message TEXT,
-                    notif_type TEXT DEFAULT 'announcement',
-                    source TEXT DEFAULT 'admin',
-                    is_read INTEGER DEFAULT 0,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    sent_at TEXT
-                )
-            """)
-        if db_type == 'postgres':
-            c.execute("""
-                SELECT id, title, message, notif_type, source, is_read, created_at
-                FROM user_notifications
-                WHERE user_id = %s
-                ORDER BY created_at DESC
-                LIMIT 50
-            """, (session['user_id'],))
-        else:
-            c.execute("""
-                SELECT id, title, message, notif_type, source, is_read, created_at
-                FROM user_notifications
-                WHERE user_id = ?
-                ORDER BY created_at DESC
-                LIMIT 50
-            """, (session['user_id'],))
-        rows = c.fetchall()
+        conn, db_type = get_db(readonly=True)
+        # Announcements expire after 30 minutes; other notification types never do.
+        announcement_cutoff = utc_now() - timedelta(minutes=30)
+        rows = db_query(conn, db_type, """
+            SELECT id, title, message, notif_type, source, is_read, created_at
+            FROM user_notifications
+            WHERE user_id = ?
+              AND (COALESCE(notif_type, 'announcement') <> 'announcement'
+                   OR created_at IS NULL OR created_at >= ?)
+            ORDER BY created_at DESC
+            LIMIT 50
+        """, (session['user_id'], announcement_cutoff.isoformat()))
         conn.close()
-        def _parse_ts(val):
-            if not val:
-                return None
-            if isinstance(val, datetime):
-                return val
-            text = str(val).strip()
-            if not text:
-                return None
-            try:
-                return datetime.fromisoformat(text)
-            except Exception:
-                try:
-                    return datetime.fromisoformat(text.replace(' ', 'T'))
-                except Exception:
-                    return None
-
-        out = []
-        now = datetime.now()
-        ttl_seconds = 30 * 60
-        for row in rows:
-            if hasattr(row, 'keys'):
-                n_type = row['notif_type'] or 'announcement'
-                created_at = row['created_at']
-                if n_type == 'announcement':
-                    ts = _parse_ts(created_at)
-                    if ts and (now - ts).total_seconds() > ttl_seconds:
-                        continue
-                out.append({
-                    "id": row['id'],
-                    "title": row['title'] or 'Notification',
-                    "message": row['message'] or '',
-                    "type": n_type,
-                    "source": row['source'] or 'admin',
-                    "is_read": bool(row['is_read'] or 0),
-                    "created_at": created_at
-                })
-            else:
-                n_type = row[3] or 'announcement'
-                created_at = row[6]
-                if n_type == 'announcement':
-                    ts = _parse_ts(created_at)
-                    if ts and (now - ts).total_seconds() > ttl_seconds:
-                        continue
-                out.append({
-                    "id": row[0],
-                    "title": row[1] or 'Notification',
-                    "message": row[2] or '',
-                    "type": n_type,
-                    "source": row[4] or 'admin',
-                    "is_read": bool(row[5] or 0),
-                    "created_at": created_at
-                })
+        out = [NotificationRecord(
+            id=row.id,
+            title=row.title or 'Notification',
+            message=row.message or '',
+            type=row.notif_type or 'announcement',
+            source=row.source or 'admin',
+            is_read=bool(row.is_read or 0),
+            created_at=row.created_at
+        ) for row in rows]
         return jsonify(out)
     except Exception as e:
         logger.error(f"Get notifications error: {e}")
@@ -5305,39 +7141,7 @@ def mark_notifications_read():
     conn = None
     try:
         conn, db_type = get_db()
-        c = get_cursor(conn, db_type)
-        if db_type == 'postgres':
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_notifications (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER,
-                    title TEXT,
-                    message TEXT,
-                    notif_type TEXT DEFAULT 'announcement',
-                    source TEXT DEFAULT 'admin',
-                    is_read INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    sent_at TIMESTAMP
-                )
-            """)
-        else:
-            c.execute("""
-                CREATE TABLE IF NOT EXISTS user_notifications (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    title TEXT,
-                    message TEXT,
-                    notif_type TEXT DEFAULT 'announcement',
-                    source TEXT DEFAULT 'admin',
-                    is_read INTEGER DEFAULT 0,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    sent_at TEXT
-                )
-            """)
-        if db_type == 'postgres':
-            c.execute("UPDATE user_notifications SET is_read = 1 WHERE user_id = %s", (session['user_id'],))
-        else:
-            c.execute("UPDATE user_notifications SET is_read = 1 WHERE user_id = ?", (session['user_id'],))
+        db_execute(conn, db_type, "UPDATE user_notifications SET is_read = 1 WHERE user_id = ?", (session['user_id'],))
         conn.commit()
         conn.close()
         return jsonify({"success": True})
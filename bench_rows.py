@@ -0,0 +1,192 @@
+"""Micro-benchmark: per-row dicts vs. Row/Record objects on the hot list endpoints.
+
+Builds the community feed (100 messages with replies and reactions) and a large
+library from an in-memory SQLite database, once the old way (sqlite3.Row -> dict ->
+json.dumps, with per-message reply and reaction queries) and once the way the
+handlers do it now (row cursor -> Record -> RecordJSONProvider, replies and
+reactions batch-loaded through get_replies_for_parents/get_reaction_counts_for_items).
+"held" is the memory the built payload keeps alive, "peak" includes serialization;
+both outputs are checked to be byte-identical.
+
+    python bench_rows.py [--library-size 2000] [--runs 30]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+# Keep the app's own SQLite file out of the way; only the in-memory DB below is measured.
+os.environ.setdefault('DB_MODE', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'bible_ios_bench.db'))
+# No verse rotation or upstream fetches while measuring.
+os.environ.setdefault('GENERATOR_THREAD', '0')
+
+import app as A  # noqa: E402
+
+FEED_SQL = """
+    SELECT cm.id, cm.user_id, cm.text, cm.timestamp, cm.google_name, cm.google_picture,
+           u.name, COALESCE(u.custom_picture, u.picture) AS picture, u.role, u.avatar_decoration
+    FROM community_messages cm LEFT JOIN users u ON cm.user_id = u.id
+    ORDER BY cm.timestamp DESC, cm.id DESC LIMIT 100
+"""
+REPLIES_SQL = """
+    SELECT r.id, r.user_id, r.text, r.timestamp, r.google_name, r.google_picture,
+           u.name AS db_name, COALESCE(u.custom_picture, u.picture) AS db_picture, u.role AS db_role,
+           u.avatar_decoration AS db_decor
+    FROM comment_replies r LEFT JOIN users u ON r.user_id = u.id
+    WHERE r.parent_type = 'community' AND r.parent_id = ? AND COALESCE(r.is_deleted, 0) = 0
+    ORDER BY r.timestamp ASC
+"""
+REACTIONS_SQL = """
+    SELECT reaction, COUNT(*) AS cnt FROM comment_reactions
+    WHERE item_type = 'community' AND item_id = ? GROUP BY reaction
+"""
+LIBRARY_SQL = """
+    SELECT v.id, v.reference, v.text, v.translation, v.source, v.book, l.timestamp AS liked_at
+    FROM verses v JOIN likes l ON v.id = l.verse_id WHERE l.user_id = 1 ORDER BY l.timestamp DESC
+"""
+
+
+def build_db(library_size):
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT, picture TEXT, custom_picture TEXT, role TEXT,
+                            avatar_decoration TEXT);
+        CREATE TABLE community_messages (id INTEGER PRIMARY KEY, user_id INTEGER, text TEXT, timestamp TEXT,
+                                         google_name TEXT, google_picture TEXT);
+        CREATE TABLE comment_replies (id INTEGER PRIMARY KEY, parent_type TEXT, parent_id INTEGER, user_id INTEGER,
+                                      text TEXT, timestamp TEXT, google_name TEXT, google_picture TEXT,
+                                      is_deleted INTEGER DEFAULT 0);
+        CREATE INDEX idx_replies_parent ON comment_replies (parent_type, parent_id, timestamp);
+        CREATE TABLE comment_reactions (id INTEGER PRIMARY KEY, item_type TEXT, item_id INTEGER, user_id INTEGER,
+                                        reaction TEXT);
+        CREATE INDEX idx_reactions_item ON comment_reactions (item_type, item_id, reaction);
+        CREATE TABLE verses (id INTEGER PRIMARY KEY, reference TEXT, text TEXT, translation TEXT, source TEXT, book TEXT);
+        CREATE TABLE likes (user_id INTEGER, verse_id INTEGER, timestamp TEXT);
+    """)
+    conn.executemany("INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"User {i}", f"https://example.com/{i}.png", None, 'user', '') for i in range(1, 51)])
+    conn.executemany("INSERT INTO community_messages VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, i % 50 + 1, f"Message {i} " * 8, f"2024-05-01T10:{i % 60:02d}:00", 'G', '')
+                      for i in range(1, 101)])
+    conn.executemany("INSERT INTO comment_replies VALUES (?, 'community', ?, ?, ?, ?, ?, ?, 0)",
+                     [(i, i % 100 + 1, i % 50 + 1, f"Reply {i}", f"2024-05-02T10:{i % 60:02d}:00", 'G', '')
+                      for i in range(1, 301)])
+    conn.executemany("INSERT INTO comment_reactions VALUES (?, 'community', ?, ?, ?)",
+                     [(i, i % 100 + 1, i % 50 + 1, ('heart', 'pray', 'cross')[i % 3]) for i in range(1, 401)])
+    conn.executemany("INSERT INTO verses VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"Psalm {i // 30 + 1}:{i % 30 + 1}", "The Lord is my shepherd; I shall not want. " * 2,
+                       'KJV', 'bench', 'Psalms') for i in range(1, library_size + 1)])
+    conn.executemany("INSERT INTO likes VALUES (1, ?, ?)",
+                     [(i, f"2024-01-01T00:00:{i % 60:02d}") for i in range(1, library_size + 1)])
+    return conn
+
+
+def feed_dicts(conn):
+    conn.row_factory = sqlite3.Row
+    c = conn.cursor()
+    messages = []
+    for row in c.execute(FEED_SQL).fetchall():
+        replies = [{
+            "id": r['id'], "user_id": r['user_id'], "text": r['text'] or "", "timestamp": r['timestamp'],
+            "user_name": r['db_name'] or r['google_name'] or "Anonymous",
+            "user_picture": r['db_picture'] or r['google_picture'] or "",
+            "user_role": r['db_role'] or "user", "avatar_decoration": r['db_decor'] or ""
+        } for r in c.execute(REPLIES_SQL, (row['id'],)).fetchall()]
+        reactions = {"heart": 0, "pray": 0, "cross": 0}
+        for r in c.execute(REACTIONS_SQL, (row['id'],)).fetchall():
+            reactions[r['reaction']] = r['cnt']
+        messages.append({
+            "id": row['id'], "text": row['text'] or "", "timestamp": row['timestamp'],
+            "user_name": row['name'] or row['google_name'] or "Anonymous",
+            "user_picture": row['picture'] or row['google_picture'] or "",
+            "avatar_decoration": row['avatar_decoration'] or "", "user_id": row['user_id'],
+            "user_role": row['role'] or "user", "reactions": reactions,
+            "replies": replies, "reply_count": len(replies)
+        })
+    conn.row_factory = None
+    return messages
+
+
+def feed_records(conn):
+    rows = A.db_query(conn, 'sqlite', FEED_SQL)
+    ids = [row.id for row in rows]
+    replies = A.get_replies_for_parents(conn, 'sqlite', "community", ids)
+    reactions = A.get_reaction_counts_for_items(conn, 'sqlite', "community", ids)
+    return [A.PostRecord(
+        id=row.id, text=row.text or "", timestamp=row.timestamp,
+        user_name=row.name or row.google_name or "Anonymous",
+        user_picture=row.picture or row.google_picture or "",
+        avatar_decoration=row.avatar_decoration or "", user_id=row.user_id,
+        user_role=row.role or "user", reactions=reactions[row.id],
+        replies=replies[row.id], reply_count=len(replies[row.id])
+    ) for row in rows]
+
+
+def library_dicts(conn):
+    conn.row_factory = sqlite3.Row
+    liked = [{"id": row['id'], "ref": row['reference'], "text": row['text'], "trans": row['translation'],
+              "source": row['source'], "book": row['book'], "liked_at": row['liked_at'], "saved_at": None}
+             for row in conn.execute(LIBRARY_SQL).fetchall()]
+    conn.row_factory = None
+    return {"liked": liked, "liked_count": len(liked)}
+
+
+def library_records(conn):
+    liked = [A.LibraryVerseRecord(row.id, row.reference, row.text, row.translation, row.source, row.book,
+                                  row.liked_at, None)
+             for row in A.db_query(conn, 'sqlite', LIBRARY_SQL)]
+    return {"liked": liked, "liked_count": len(liked)}
+
+
+def dumps_dicts(payload):
+    return json.dumps(payload, ensure_ascii=True, sort_keys=True, separators=(',', ':'))
+
+
+def dumps_records(payload):
+    return A.app.json.dumps(payload, separators=(',', ':'))
+
+
+def measure(build, dumps, conn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        body = dumps(build(conn))
+        timings.append(time.perf_counter() - start)
+    tracemalloc.start()
+    payload = build(conn)
+    held, _ = tracemalloc.get_traced_memory()
+    dumps(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return body, statistics.median(timings) * 1000, held, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--library-size', type=int, default=2000)
+    parser.add_argument('--runs', type=int, default=30)
+    args = parser.parse_args()
+
+    conn = build_db(args.library_size)
+    cases = [
+        ("community feed (100 msgs)", (feed_dicts, dumps_dicts), (feed_records, dumps_records)),
+        (f"library ({args.library_size} verses)", (library_dicts, dumps_dicts), (library_records, dumps_records)),
+    ]
+    print(f"{'case':<28} {'variant':<8} {'median ms':>10} {'held KiB':>10} {'peak KiB':>10}")
+    for label, old, new in cases:
+        results = {}
+        for variant, (build, dumps) in (("dicts", old), ("records", new)):
+            body, ms, held, peak = measure(build, dumps, conn, args.runs)
+            results[variant] = body
+            print(f"{label:<28} {variant:<8} {ms:>10.2f} {held / 1024:>10.1f} {peak / 1024:>10.1f}")
+        if results["dicts"] != results["records"]:
+            raise SystemExit(f"{label}: record output differs from dict output")
+
+
+if __name__ == '__main__':
+    main()